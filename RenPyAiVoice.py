@@ -1,13 +1,20 @@
 import os
 import re
 import base64
-import hashlib
-import queue
 import threading
-import time
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
-import requests
+
+from tts_backends import parse_backends
+from tts_cache import SynthesisCache
+from tts_client import DEFAULT_SERVER, DEFAULT_TIMEOUT
+from tts_concurrency import percentile
+from tts_engine import SynthesisEngine, plan_jobs
+from tts_retry import format_reasons
+from tts_schedule import DEFAULT_TIMINGS_PATH, DurationModel, format_duration
+from tts_stats import format_bytes
+from tts_ui import Dashboard, LogFile, UIEventBus
+from tts_voices import load_voice_map, speakers_in, write_voice_map_template
 
 # 设置Tcl/Tk库路径
 tcl_library_path = "C:/Users/Administrator/AppData/Local/Programs/Python/Python313/tcl/tcl8.6"
@@ -43,9 +50,6 @@ class TTSGeneratorTool:
         self.setup_tab2_ui()
         self.setup_tab3_ui()
 
-        # 初始化TTS生成器
-        self.tts_generator = TTSGenerator()
-
         # 存储中间结果
         self.translation_dict = {}
         self.character_stats = {}
@@ -181,49 +185,105 @@ class TTSGeneratorTool:
         ttk.Entry(output_frame, textvariable=self.output_path, width=60).pack(side=tk.LEFT, fill=tk.X, expand=True)
         ttk.Button(output_frame, text="浏览", command=self.browse_output).pack(side=tk.RIGHT, padx=(5, 0))
 
+        # TTS服务器，可填多个
+        ttk.Label(main_frame, text="服务器:").grid(row=3, column=0, sticky=tk.W, pady=5)
+        self.server_var = tk.StringVar(value=DEFAULT_SERVER)
+        server_entry = ttk.Entry(main_frame, textvariable=self.server_var, width=60)
+        server_entry.grid(row=3, column=1, sticky=(tk.W, tk.E), pady=5)
+        ttk.Label(main_frame, text="多台用逗号分隔，地址*权重；tts+地址用/tts接口").grid(row=3, column=2, sticky=tk.W,
+                                                                       padx=(5, 0), pady=5)
+
         # 模型选择
-        ttk.Label(main_frame, text="模型:").grid(row=3, column=0, sticky=tk.W, pady=5)
+        ttk.Label(main_frame, text="模型:").grid(row=4, column=0, sticky=tk.W, pady=5)
         self.model_var = tk.StringVar(value="原神-中文-莱欧斯利_ZH")
         model_combo = ttk.Combobox(main_frame, textvariable=self.model_var, width=57)
-        model_combo.grid(row=3, column=1, sticky=(tk.W, tk.E), pady=5)
+        model_combo.grid(row=4, column=1, sticky=(tk.W, tk.E), pady=5)
         model_combo['values'] = ("原神-中文-莱欧斯利_ZH", "其他模型1", "其他模型2")
 
+        # 角色模型映射，未列出的角色使用上面的模型
+        ttk.Label(main_frame, text="角色模型:").grid(row=5, column=0, sticky=tk.W, pady=5)
+        self.voice_map_path = tk.StringVar()
+        voice_map_frame = ttk.Frame(main_frame)
+        voice_map_frame.grid(row=5, column=1, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+        ttk.Entry(voice_map_frame, textvariable=self.voice_map_path, width=50).pack(side=tk.LEFT, fill=tk.X,
+                                                                                    expand=True)
+        ttk.Button(voice_map_frame, text="浏览", command=self.browse_voice_map).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(voice_map_frame, text="生成模板",
+                   command=self.generate_voice_map_template).pack(side=tk.LEFT, padx=(5, 0))
+
         # 语速设置
-        ttk.Label(main_frame, text="语速因子:").grid(row=4, column=0, sticky=tk.W, pady=5)
+        ttk.Label(main_frame, text="语速因子:").grid(row=6, column=0, sticky=tk.W, pady=5)
         self.speed_var = tk.DoubleVar(value=1.0)
         speed_scale = ttk.Scale(main_frame, from_=0.5, to=2.0, variable=self.speed_var, orient=tk.HORIZONTAL)
-        speed_scale.grid(row=4, column=1, sticky=(tk.W, tk.E), pady=5)
-        ttk.Label(main_frame, textvariable=self.speed_var).grid(row=4, column=2, sticky=tk.W, padx=(5, 0), pady=5)
+        speed_scale.grid(row=6, column=1, sticky=(tk.W, tk.E), pady=5)
+        ttk.Label(main_frame, textvariable=self.speed_var).grid(row=6, column=2, sticky=tk.W, padx=(5, 0), pady=5)
 
         # 线程数设置
-        ttk.Label(main_frame, text="线程数:").grid(row=5, column=0, sticky=tk.W, pady=5)
+        ttk.Label(main_frame, text="最大并发:").grid(row=7, column=0, sticky=tk.W, pady=5)
         self.thread_count_var = tk.IntVar(value=3)
-        thread_spinbox = ttk.Spinbox(main_frame, from_=1, to=10, textvariable=self.thread_count_var, width=10)
-        thread_spinbox.grid(row=5, column=1, sticky=tk.W, pady=5)
+        concurrency_frame = ttk.Frame(main_frame)
+        concurrency_frame.grid(row=7, column=1, sticky=tk.W, pady=5)
+        thread_spinbox = ttk.Spinbox(concurrency_frame, from_=1, to=256, textvariable=self.thread_count_var, width=10)
+        thread_spinbox.pack(side=tk.LEFT)
+        self.adaptive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(concurrency_frame, text="自适应（按服务器延迟自动调整，上限为左侧数值）",
+                        variable=self.adaptive_var).pack(side=tk.LEFT, padx=(10, 0))
+        # 长台词拆开并行合成后拼接
+        self.split_var = tk.BooleanVar(value=False)
+        self.split_chars_var = tk.IntVar(value=80)
+        ttk.Checkbutton(concurrency_frame, text="拆分超过", variable=self.split_var).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Spinbox(concurrency_frame, from_=20, to=500, textvariable=self.split_chars_var, width=5).pack(side=tk.LEFT)
+        ttk.Label(concurrency_frame, text="字的长台词").pack(side=tk.LEFT)
+        self.pack_var = tk.BooleanVar(value=False)
+        self.pack_lines_var = tk.IntVar(value=10)
+        ttk.Checkbutton(concurrency_frame, text="合并短台词，每次",
+                        variable=self.pack_var).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Spinbox(concurrency_frame, from_=2, to=50, textvariable=self.pack_lines_var, width=4).pack(side=tk.LEFT)
+        ttk.Label(concurrency_frame, text="行").pack(side=tk.LEFT)
+
+        # 请求限速，运行中修改立即生效
+        ttk.Label(main_frame, text="限速:").grid(row=8, column=0, sticky=tk.W, pady=5)
+        self.rate_limit_var = tk.DoubleVar(value=0)
+        self.burst_var = tk.IntVar(value=0)
+        rate_frame = ttk.Frame(main_frame)
+        rate_frame.grid(row=8, column=1, sticky=tk.W, pady=5)
+        ttk.Spinbox(rate_frame, from_=0, to=1000, textvariable=self.rate_limit_var, width=10).pack(side=tk.LEFT)
+        ttk.Label(rate_frame, text="次/秒，突发").pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Spinbox(rate_frame, from_=0, to=1000, textvariable=self.burst_var, width=5).pack(side=tk.LEFT)
+        ttk.Label(rate_frame, text="次（0为不限速；突发为0时取1秒的量）").pack(side=tk.LEFT, padx=(5, 0))
+        self.rate_limit_var.trace_add("write", self.on_rate_limit_change)
+        self.burst_var.trace_add("write", self.on_rate_limit_change)
 
         # 控制按钮框架
         button_frame = ttk.Frame(main_frame)
-        button_frame.grid(row=6, column=0, columnspan=3, pady=10)
+        button_frame.grid(row=9, column=0, columnspan=3, pady=10)
 
         self.start_button = ttk.Button(button_frame, text="开始合成", command=self.start_processing)
         self.start_button.pack(side=tk.LEFT, padx=5)
 
+        self.retry_failed_button = ttk.Button(button_frame, text="只重跑失败",
+                                              command=lambda: self.start_processing(only_failed=True))
+        self.retry_failed_button.pack(side=tk.LEFT, padx=5)
+
+        self.pause_button = ttk.Button(button_frame, text="暂停", command=self.toggle_pause, state=tk.DISABLED)
+        self.pause_button.pack(side=tk.LEFT, padx=5)
+
         self.stop_button = ttk.Button(button_frame, text="停止", command=self.stop_processing, state=tk.DISABLED)
         self.stop_button.pack(side=tk.LEFT, padx=5)
 
         # 进度条
-        ttk.Label(main_frame, text="进度:").grid(row=7, column=0, sticky=tk.W, pady=5)
+        ttk.Label(main_frame, text="进度:").grid(row=10, column=0, sticky=tk.W, pady=5)
         self.progress_var = tk.DoubleVar()
         self.progress_bar = ttk.Progressbar(main_frame, variable=self.progress_var, maximum=100)
-        self.progress_bar.grid(row=7, column=1, sticky=(tk.W, tk.E), pady=5)
+        self.progress_bar.grid(row=10, column=1, sticky=(tk.W, tk.E), pady=5)
 
         # 状态标签
         self.tab3_status = tk.StringVar(value="准备就绪")
-        ttk.Label(main_frame, textvariable=self.tab3_status).grid(row=8, column=0, columnspan=3, sticky=tk.W, pady=5)
+        ttk.Label(main_frame, textvariable=self.tab3_status).grid(row=11, column=0, columnspan=3, sticky=tk.W, pady=5)
 
         # 统计信息
         stats_frame = ttk.Frame(main_frame)
-        stats_frame.grid(row=9, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=5)
+        stats_frame.grid(row=12, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=5)
 
         ttk.Label(stats_frame, text="成功:").pack(side=tk.LEFT)
         self.success_var = tk.StringVar(value="0")
@@ -241,26 +301,54 @@ class TTSGeneratorTool:
         self.total_var = tk.StringVar(value="0")
         ttk.Label(stats_frame, textvariable=self.total_var).pack(side=tk.LEFT)
 
-        ttk.Label(stats_frame, text="活动线程:").pack(side=tk.LEFT, padx=(20, 0))
+        ttk.Label(stats_frame, text="在途请求:").pack(side=tk.LEFT, padx=(20, 0))
         self.active_threads_var = tk.StringVar(value="0")
         ttk.Label(stats_frame, textvariable=self.active_threads_var).pack(side=tk.LEFT)
 
+        ttk.Label(stats_frame, text="请求速率:").pack(side=tk.LEFT, padx=(20, 0))
+        self.request_rate_var = tk.StringVar(value="0.0/秒")
+        ttk.Label(stats_frame, textvariable=self.request_rate_var).pack(side=tk.LEFT)
+
+        ttk.Label(stats_frame, text="请求耗时:").pack(side=tk.LEFT, padx=(20, 0))
+        self.latency_var = tk.StringVar(value="-")
+        ttk.Label(stats_frame, textvariable=self.latency_var).pack(side=tk.LEFT)
+
+        ttk.Label(stats_frame, text="已下载:").pack(side=tk.LEFT, padx=(20, 0))
+        self.downloaded_var = tk.StringVar(value=format_bytes(0))
+        ttk.Label(stats_frame, textvariable=self.downloaded_var).pack(side=tk.LEFT)
+
+        # 各后端的吞吐量
+        self.backend_var = tk.StringVar(value="")
+        ttk.Label(main_frame, textvariable=self.backend_var).grid(row=13, column=0, columnspan=3, sticky=tk.W)
+
+        # 实时监控，按自己的定时器刷新
+        self.dashboard = Dashboard(main_frame, lambda: self.engine)
+        self.dashboard.frame.grid(row=14, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=5)
+
         # 日志输出
-        ttk.Label(main_frame, text="日志:").grid(row=10, column=0, sticky=tk.W, pady=5)
+        ttk.Label(main_frame, text="日志:").grid(row=15, column=0, sticky=tk.W, pady=5)
+        self.failures_only_var = tk.BooleanVar(value=False)
+        failures_only = ttk.Checkbutton(main_frame, text="只看失败", variable=self.failures_only_var,
+                                        command=lambda: self.ui.set_failures_only(self.failures_only_var.get()))
+        failures_only.grid(row=15, column=1, sticky=tk.W, pady=5)
         self.log_text = scrolledtext.ScrolledText(main_frame, height=15, width=80)
-        self.log_text.grid(row=11, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
+        self.log_text.grid(row=16, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
+        # 合成线程只往队列里发消息，由Tk主线程按帧刷新日志和计数；完整日志由后台线程写入文件
+        try:
+            log_file = LogFile()
+        except OSError:
+            log_file = None
+        self.ui = UIEventBus(self.root, self.log_text, log_file=log_file)
 
         # 配置网格权重
         main_frame.columnconfigure(1, weight=1)
-        main_frame.rowconfigure(11, weight=1)
+        main_frame.rowconfigure(16, weight=1)
 
         # 多线程相关变量
         self.is_processing = False
         self.stop_requested = False
-        self.task_queue = queue.Queue()
-        self.threads = []
-        self.processed_count = 0
-        self.lock = threading.Lock()
+        self.engine = None
+        self.total_lines = 0
 
     # Tab 1: 角色定义提取相关方法
     def browse_name_rpy(self):
@@ -517,95 +605,163 @@ class TTSGeneratorTool:
         if directory:
             self.output_path.set(directory)
 
-    def log_message(self, message):
-        """向日志区域添加消息"""
-        self.log_text.insert(tk.END, message + "\n")
-        self.log_text.see(tk.END)
-        self.root.update_idletasks()
+    def log_message(self, message, failed=False):
+        """向日志区域添加消息，可在任何线程中调用，下一帧显示；failed为True的消息在只看失败时也显示"""
+        self.ui.log(message, failed)
 
     def update_active_threads(self):
-        """更新活动线程计数"""
-        active_count = sum(1 for thread in self.threads if thread.is_alive())
-        self.active_threads_var.set(str(active_count))
-
-    def worker_thread(self, thread_id):
-        """工作线程函数"""
-        while not self.stop_requested:
-            try:
-                task = self.task_queue.get(timeout=1)
-                i, original_line, total_lines, output_dir, model_name, speed_factor = task
-
-                if self.stop_requested:
-                    break
-
-                processed_line = re.sub(r'^[^:]+:\s*', '', original_line.strip())
-
-                if not processed_line:
-                    with self.lock:
-                        self.skipped_var.set(str(int(self.skipped_var.get()) + 1))
-                    continue
-
-                # 生成SHA1哈希文件名
-                sha1_hash = hashlib.sha1()
-                sha1_hash.update(original_line.encode('utf-8'))
-                filename = sha1_hash.hexdigest() + ".wav"
-                output_path = os.path.join(output_dir, filename)
-
-                # 检查文件是否已存在
-                if os.path.exists(output_path):
-                    with self.lock:
-                        self.log_message(f"⏭️ 线程{thread_id}: 跳过已存在文件: {filename}")
-                        self.skipped_var.set(str(int(self.skipped_var.get()) + 1))
-                    continue
-
-                # 生成TTS
-                with self.lock:
-                    self.log_message(f"🧵 线程{thread_id}: [{i + 1}/{total_lines}] 处理: {processed_line[:50]}...")
-
-                if self.tts_generator.generate_tts(processed_line, output_path, model_name, speed_factor):
-                    with self.lock:
-                        self.success_var.set(str(int(self.success_var.get()) + 1))
-                        self.log_message(f"✅ 线程{thread_id}: 成功生成: {filename}")
-                else:
-                    with self.lock:
-                        self.failed_var.set(str(int(self.failed_var.get()) + 1))
-                        self.log_message(f"❌ 线程{thread_id}: 生成失败: {filename}")
-
-                # 更新进度
-                with self.lock:
-                    try:
-                        # 将文本转换为整数并计算已处理的总数
-                        success_count = int(self.success_var.get())
-                        failed_count = int(self.failed_var.get())
-                        skipped_count = int(self.skipped_var.get())
-
-                        total_processed = success_count + failed_count + skipped_count
-                        self.processed_count = total_processed
-
-                        progress = (total_processed / total_lines) * 100
-                        self.progress_var.set(progress)
-                        self.tab3_status.set(f"处理中: {total_processed}/{total_lines}")
-
-                    except ValueError:
-                        # 如果转换失败，使用processed_count作为备选方案
-                        progress = (self.processed_count / total_lines) * 100
-                        self.progress_var.set(progress)
-                        self.tab3_status.set(f"处理中: {self.processed_count}/{total_lines}")
-                        self.log_message("警告: 计数转换错误，使用processed_count作为进度")
-
-                self.task_queue.task_done()
-                self.update_active_threads()
-                time.sleep(0.5)
-
-            except queue.Empty:
-                break
-            except Exception as e:
-                with self.lock:
-                    self.failed_var.set(str(int(self.failed_var.get()) + 1))
-                    self.log_message(f"❌ 线程{thread_id}: 发生错误: {str(e)}")
-                self.task_queue.task_done()
-
-    def start_processing(self):
+        """更新在途请求数和实际请求速率"""
+        if self.engine:
+            self.active_threads_var.set(str(self.engine.in_flight))
+            self.request_rate_var.set(f"{self.engine.request_rate:.1f}/秒")
+
+    def rate_limit(self):
+        """界面上设置的(每秒请求数, 突发量)，输入无效时视为不限速"""
+        try:
+            return max(0.0, self.rate_limit_var.get()), max(0, self.burst_var.get())
+        except (tk.TclError, ValueError):
+            return 0.0, 0
+
+    def on_rate_limit_change(self, *args):
+        """运行中修改限速立即生效"""
+        if self.engine:
+            self.engine.set_rate_limit(*self.rate_limit())
+
+    def on_engine_event(self, event, job, detail):
+        """合成引擎的回调，在引擎线程中触发，只发布消息，不直接操作Tk"""
+        engine = self.engine
+        if event == "planned":
+            # 续跑或只重跑失败时，实际要处理的行数以引擎登记的为准
+            self.total_lines = detail
+            self.ui.refresh(self.refresh_progress)
+            return
+        if event == "concurrency":
+            self.log_message(f"⚙️ 并发数调整为: {detail}")
+        elif event == "start":
+            self.log_message(f"🧵 [{job.index + 1}/{self.total_lines}] 处理: {job.text[:50]}...")
+        elif event == "skipped":
+            if detail == "已存在":
+                self.log_message(f"⏭️ 跳过已存在文件: {job.filename}")
+            elif detail == "重复":
+                self.log_message(f"⏭️ 跳过重复行: {job.filename}")
+        elif event == "success":
+            if detail == "cache":
+                self.log_message(f"♻️ 缓存命中: {job.filename}")
+            elif detail == "dedup":
+                self.log_message(f"🔗 复用相同文本的音频: {job.filename}")
+            elif detail == "pack":
+                self.log_message(f"📦 合并合成: {job.filename}")
+            else:
+                self.log_message(f"✅ 成功生成: {job.filename}")
+        elif event == "failed":
+            self.log_message(f"❌ 生成失败: {job.filename} ({detail})", failed=True)
+        elif event == "retry":
+            self.log_message(f"🔁 重试: {job.filename} ({detail})")
+        elif event == "paused":
+            if detail:
+                self.log_message("⏸️ 已暂停，在途请求完成后不再发出新请求")
+            else:
+                self.log_message("▶️ 继续合成")
+        elif event == "model":
+            self.log_message(f"🎙️ 切换到模型: {detail}（已预热）")
+        elif event == "backend":
+            if detail.healthy:
+                self.log_message(f"🖥️ 后端已恢复，重新加入: {detail.name}")
+            else:
+                self.log_message(f"🖥️ 后端连续不可用，已摘除: {detail.name}", failed=True)
+        elif event == "circuit":
+            if detail == "open":
+                self.log_message(f"⛔ 服务器连续不可用，暂停派发 {engine.circuit_breaker.recovery_timeout:.0f} 秒",
+                                 failed=True)
+            elif detail == "half_open":
+                self.log_message("🔍 发送探测请求检查服务器是否恢复")
+            else:
+                self.log_message("✅ 服务器已恢复，继续派发")
+
+        # 计数和进度在下一帧统一刷新
+        self.ui.refresh(self.refresh_progress)
+
+    def refresh_progress(self):
+        """按引擎当前状态刷新计数、进度和状态栏，在Tk主线程中每帧最多调用一次"""
+        engine = self.engine
+        if not engine:
+            return
+        stats = engine.stats.snapshot()
+        self.total_var.set(str(self.total_lines))
+        self.success_var.set(str(stats["success"]))
+        self.failed_var.set(str(stats["failed"]))
+        self.skipped_var.set(str(stats["skipped"]))
+        latency = stats.latency("request")
+        if latency:
+            self.latency_var.set(f"p50 {latency[50]:.2f}s / p95 {latency[95]:.2f}s / p99 {latency[99]:.2f}s")
+        self.downloaded_var.set(format_bytes(stats["bytes"]))
+        total_processed = stats["success"] + stats["failed"] + stats["skipped"]
+        self.progress_var.set((total_processed / max(self.total_lines, 1)) * 100)
+        self.backend_var.set(engine.backends.summary())
+        if not self.stop_requested:
+            paused = "  ⛔ 服务器不可用，已暂停" if engine.circuit_breaker.state != "closed" else ""
+            eta = engine.eta()
+            remaining = f"  预计剩余: {format_duration(eta)}" if eta is not None else ""
+            held = "  ⏸️ 已暂停" if engine.paused else ""
+            self.tab3_status.set(f"处理中: {total_processed}/{self.total_lines}  并发: {engine.concurrency_limit}"
+                                 f"{remaining}{held}{paused}")
+        self.update_active_threads()
+
+    def browse_voice_map(self):
+        filename = filedialog.askopenfilename(
+            title="选择角色模型映射文件",
+            filetypes=[("文本文件", "*.txt"), ("所有文件", "*.*")]
+        )
+        if filename:
+            self.voice_map_path.set(filename)
+
+    def character_names(self):
+        """第一步提取的角色（角色代码→中文名），没有运行第一步时读取第二步选择的角色定义文件"""
+        if not self.translation_dict and os.path.exists(self.character_def_path.get()):
+            return self.load_character_translations_from_file(self.character_def_path.get())
+        return self.translation_dict
+
+    def generate_voice_map_template(self):
+        """列出第一步得到的角色和输入文件中出现的角色，生成映射模板"""
+        path = self.voice_map_path.get()
+        if not path:
+            path = filedialog.asksaveasfilename(title="保存角色模型映射", defaultextension=".txt",
+                                                initialfile="voice_map.txt", filetypes=[("文本文件", "*.txt")])
+            if not path:
+                return
+        try:
+            speakers = list(self.character_names().values())
+            if os.path.exists(self.input_path.get()):
+                with open(self.input_path.get(), 'r', encoding='utf-8') as f:
+                    speakers.extend(speakers_in(f))
+            added = write_voice_map_template(path, speakers)
+        except Exception as e:
+            messagebox.showerror("错误", f"生成映射模板时出错: {str(e)}")
+            return
+        self.voice_map_path.set(path)
+        messagebox.showinfo("完成", f"已写入 {path}，新增 {added} 个角色，请在等号后填写模型名")
+
+    def synthesis_settings(self):
+        """在Tk主线程中读取合成用到的全部界面设置，返回普通dict，交给合成线程使用"""
+        rate_limit, burst = self.rate_limit()
+        return {
+            "input_file": self.input_path.get(),
+            "output_dir": self.output_path.get(),
+            "model_name": self.model_var.get(),
+            "speed_factor": self.speed_var.get(),
+            "server": self.server_var.get(),
+            "concurrency": self.thread_count_var.get(),
+            "adaptive": self.adaptive_var.get(),
+            "split_chars": self.split_chars_var.get() if self.split_var.get() else 0,
+            "pack_lines": self.pack_lines_var.get() if self.pack_var.get() else 0,
+            "rate_limit": rate_limit,
+            "burst": burst,
+            "voice_map_path": self.voice_map_path.get(),
+            # 角色映射中的角色代码按第一步的角色定义换成中文名
+            "character_names": self.character_names() if self.voice_map_path.get() else None,
+        }
+
+    def start_processing(self, only_failed=False):
         if not self.input_path.get():
             messagebox.showerror("错误", "请选择输入文件")
             return
@@ -614,170 +770,156 @@ class TTSGeneratorTool:
             messagebox.showerror("错误", "输入文件不存在")
             return
 
+        if self.voice_map_path.get() and not os.path.exists(self.voice_map_path.get()):
+            messagebox.showerror("错误", "角色模型映射文件不存在")
+            return
+
+        try:
+            parse_backends(self.server_var.get())
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return
+
+        # 在Tk主线程中读取设置、创建引擎：合成线程只用这份快照，不碰Tk变量；
+        # 点击开始之后的暂停和停止都作用在这次运行的引擎上
+        try:
+            settings = self.synthesis_settings()
+            engine = SynthesisEngine(server=settings["server"], concurrency=settings["concurrency"],
+                                     timeout=DEFAULT_TIMEOUT, on_event=self.on_engine_event,
+                                     adaptive=settings["adaptive"],
+                                     cache=SynthesisCache(), durations=DurationModel(DEFAULT_TIMINGS_PATH),
+                                     split_chars=settings["split_chars"], pack_lines=settings["pack_lines"],
+                                     rate_limit=settings["rate_limit"], burst=settings["burst"])
+        except Exception as e:
+            messagebox.showerror("错误", str(e))
+            return
+        self.engine = engine
+
         # 重置状态
         self.is_processing = True
         self.stop_requested = False
-        self.processed_count = 0
         self.success_var.set("0")
         self.failed_var.set("0")
         self.skipped_var.set("0")
         self.total_var.set("0")
         self.progress_var.set(0)
         self.active_threads_var.set("0")
-        self.log_text.delete(1.0, tk.END)
-
-        # 清空任务队列
-        while not self.task_queue.empty():
-            self.task_queue.get_nowait()
+        self.request_rate_var.set("0.0/秒")
+        self.latency_var.set("-")
+        self.downloaded_var.set(format_bytes(0))
+        self.backend_var.set("")
+        self.ui.clear()
+        self.dashboard.reset()
 
         # 更新UI状态
-        self.start_button.config(state=tk.NORMAL)
+        self.start_button.config(state=tk.DISABLED)
+        self.retry_failed_button.config(state=tk.DISABLED)
+        self.pause_button.config(state=tk.NORMAL, text="暂停")
         self.stop_button.config(state=tk.NORMAL)
         self.tab3_status.set("正在准备...")
 
         # 在新线程中处理
-        thread = threading.Thread(target=self.prepare_and_process)
+        thread = threading.Thread(target=self.prepare_and_process, args=(engine, settings, only_failed))
         thread.daemon = True
         thread.start()
 
-    def prepare_and_process(self):
+    def prepare_and_process(self, engine, settings, only_failed=False):
         try:
-            input_file = self.input_path.get()
-            output_dir = self.output_path.get()
-            model_name = self.model_var.get()
-            speed_factor = self.speed_var.get()
-            thread_count = self.thread_count_var.get()
+            input_file = settings["input_file"]
+            output_dir = settings["output_dir"]
 
             # 读取文件
             with open(input_file, 'r', encoding='utf-8') as f:
                 lines = f.readlines()
 
-            total_lines = len(lines)
-            self.total_var.set(str(total_lines))
+            self.total_lines = len(lines)
+            self.ui.call(self.total_var.set, str(self.total_lines))
 
-            # 填充任务队列
-            for i, line in enumerate(lines):
-                original_line = line.strip()
-                if original_line:
-                    self.task_queue.put((i, original_line, total_lines, output_dir, model_name, speed_factor))
+            voice_map = None
+            if settings["voice_map_path"]:
+                voice_map = load_voice_map(settings["voice_map_path"], settings["character_names"])
+            jobs = plan_jobs(lines, output_dir, settings["model_name"], settings["speed_factor"], voice_map=voice_map)
 
-            self.log_message(f"开始处理 {total_lines} 条对话，使用 {thread_count} 个线程")
+            mode = "自适应" if engine.controller else "固定"
+            self.log_message(f"开始处理 {self.total_lines} 条对话，最大并发 {engine.concurrency}（{mode}）")
+            if engine.rate_limiter.rate:
+                self.log_message(f"限速: 每秒 {engine.rate_limiter.rate:g} 次请求")
+            if only_failed:
+                self.log_message("只重跑上次运行失败的行")
             self.log_message(f"输出目录: {output_dir}")
+            if self.ui.log_file:
+                self.log_message(f"完整日志: {self.ui.log_file.path}")
             self.log_message("-" * 50)
 
-            # 创建工作线程
-            self.threads = []
-            for i in range(thread_count):
-                thread = threading.Thread(target=self.worker_thread, args=(i + 1,))
-                thread.daemon = True
-                thread.start()
-                self.threads.append(thread)
-
-            # 等待所有任务完成
-            self.task_queue.join()
+            # 运行合成引擎，直到所有任务完成或被停止
+            counts = engine.run(jobs, only_failed)
 
             # 检查是否被用户停止
             if not self.stop_requested:
-                self.tab3_status.set("处理完成")
+                self.ui.call(self.tab3_status.set, "处理完成")
                 self.log_message("\n" + "=" * 50)
                 self.log_message("处理完成!")
-                self.log_message(f"成功: {self.success_var.get()}")
-                self.log_message(f"失败: {self.failed_var.get()}")
-                self.log_message(f"跳过: {self.skipped_var.get()}")
-                self.log_message(f"总计: {total_lines}")
+                self.log_message(f"成功: {counts['success']}")
+                self.log_message(f"失败: {counts['failed']}")
+                if engine.failure_reasons:
+                    self.log_message(f"失败原因: {format_reasons(engine.failure_reasons)}")
+                self.log_message(f"重试次数: {engine.retries}")
+                self.log_message(f"缓存命中: {engine.cache_hits}")
+                self.log_message(f"重复合并: {engine.duplicates} 行，节省服务器请求: {engine.calls_saved}")
+                for backend in engine.backends.backends:
+                    self.log_message(f"后端 {backend.name}: 成功 {backend.completed}，失败 {backend.failed}")
+                if engine.ttfbs:
+                    self.log_message(f"首字节时间: p50 {percentile(engine.ttfbs, 50):.2f}s，"
+                                     f"p95 {percentile(engine.ttfbs, 95):.2f}s")
+                if engine.split_lines:
+                    self.log_message(f"拆分合成: {engine.split_lines} 行，共 {engine.split_pieces} 段")
+                if engine.packed_lines or engine.pack_fallbacks:
+                    self.log_message(f"合并合成: {engine.packed_lines} 行，共 {engine.packed_requests} 次请求，"
+                                     f"退回逐行 {engine.pack_fallbacks} 次")
+                if engine.models > 1:
+                    self.log_message(f"模型: {engine.models} 个，切换 {engine.model_switches} 次"
+                                     f"（按文件顺序需切换 {engine.file_order_switches} 次）")
+                self.log_message(f"跳过: {counts['skipped']}")
+                self.log_message(f"总计: {self.total_lines}")
+            else:
+                self.ui.call(self.tab3_status.set, "已停止")
+                self.log_message(f"已停止，成功 {counts['success']} 行，未完成的行下次运行时继续")
 
         except Exception as e:
-            self.log_message(f"处理过程中出错: {str(e)}")
-            self.tab3_status.set("处理出错")
+            self.log_message(f"处理过程中出错: {str(e)}", failed=True)
+            self.ui.call(self.tab3_status.set, "处理出错")
         finally:
-            # 恢复UI状态
-            self.start_button.config(state=tk.NORMAL)
-            self.stop_button.config(state=tk.DISABLED)
-            self.is_processing = False
-            self.stop_requested = False
+            self.ui.call(self.finish_processing)
+
+    def finish_processing(self):
+        """合成线程结束后在Tk主线程中恢复UI状态"""
+        self.start_button.config(state=tk.NORMAL)
+        self.retry_failed_button.config(state=tk.NORMAL)
+        self.pause_button.config(state=tk.DISABLED, text="暂停")
+        self.stop_button.config(state=tk.DISABLED)
+        self.active_threads_var.set("0")
+        self.is_processing = False
+        self.stop_requested = False
+
+    def toggle_pause(self):
+        """暂停时不再发出新请求，队列和日志保持不变，继续后接着合成"""
+        if not self.engine:
+            return
+        if self.engine.paused:
+            self.engine.resume()
+            self.pause_button.config(text="暂停")
+        else:
+            self.engine.pause()
+            self.pause_button.config(text="继续")
 
     def stop_processing(self):
         self.stop_requested = True
         self.tab3_status.set("正在停止...")
-        self.log_message("正在停止所有线程...")
-
-        # 清空任务队列
-        while not self.task_queue.empty():
-            try:
-                self.task_queue.get_nowait()
-                self.task_queue.task_done()
-            except:
-                pass
-
-
-class TTSGenerator:
-    def __init__(self):
-        self.headers = {
-            "Connection": "keep-alive",
-            "sec-ch-ua": "\"Chromium\";v=\"92\", \" Not A;Brand\";v=\"99\", \"Microsoft Edge\";v=\"92\"",
-            "Accept": "application/json, text/plain, */*",
-            "sec-ch-ua-mobile": "?0",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.131 Safari/537.36 Edg/92.0.902.67",
-            "Content-Type": "application/json",
-            "Origin": "http://127.0.0.1:8000",
-            "Sec-Fetch-Site": "same-origin",
-            "Sec-Fetch-Mode": "cors",
-            "Sec-Fetch-Dest": "empty",
-            "Referer": "http://127.0.0.1:8000/",
-            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6"
-        }
+        self.log_message("正在停止，中止在途请求...")
 
-    def generate_tts(self, text, output_path, model_name="原神-中文-莱欧斯利_ZH", speed_factor=1.0):
-        """生成单个文本的TTS"""
-        url = "http://127.0.0.1:8000/infer_single"
-
-        data = {
-            "dl_url": "http://127.0.0.1:8000",
-            "version": "v4",
-            "model_name": model_name,
-            "prompt_text_lang": "中文",
-            "emotion": "默认",
-            "text": text,
-            "text_lang": "中文",
-            "top_k": 10,
-            "top_p": 1,
-            "temperature": 1,
-            "text_split_method": "按标点符号切",
-            "batch_size": 10,
-            "batch_threshold": 0.75,
-            "split_bucket": True,
-            "speed_facter": speed_factor,
-            "fragment_interval": 0.3,
-            "media_type": "wav",
-            "parallel_infer": True,
-            "repetition_penalty": 1.35,
-            "seed": 473410238,
-            "sample_steps": 16,
-            "if_sr": False
-        }
-
-        try:
-            response = requests.post(url, headers=self.headers, json=data, timeout=9999)
-
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("msg") == "合成成功":
-                    audio_url = result.get("audio_url")
-                    audio_response = requests.get(audio_url, timeout=9999)
-                    if audio_response.status_code == 200:
-                        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                        with open(output_path, 'wb') as f:
-                            f.write(audio_response.content)
-                        return True
-                    else:
-                        return False
-                else:
-                    return False
-            else:
-                return False
-
-        except Exception as e:
-            return False
+        # 不再派发新任务，在途请求立即中止，写了一半的文件会被删除
+        if self.engine:
+            self.engine.stop(cancel=True)
 
 
 def main():
@@ -1,77 +1,56 @@
 import argparse
 import sys
-import os
 
+from tts_client import DEFAULT_SERVER, TTSGenerator
 
-class TTSGenerator:
-    def __init__(self):
-        self.headers = {'Content-Type': 'application/json'}
 
-    def generate_tts(self, text, output_path, model_name="原神-中文-莱欧斯利_ZH", speed_factor=1.0):
-        """生成单个文本的TTS（保持原有代码不变）"""
-        # 这里保持您原有的requests代码不变
-        import requests
-        url = "http://127.0.0.1:8000/infer_single"
+def run_batch(args, extra):
+    """交给tts_batch合成整个对话文件，返回它的退出码；extra为本程序不认识、原样转交的tts_batch选项"""
+    import tts_batch
 
-        data = {
-            "dl_url": "http://127.0.0.1:8000",
-            "version": "v4",
-            "model_name": model_name,
-            "prompt_text_lang": "中文",
-            "emotion": "默认",
-            "text": text,
-            "text_lang": "中文",
-            "top_k": 10,
-            "top_p": 1,
-            "temperature": 1,
-            "text_split_method": "按标点符号切",
-            "batch_size": 10,
-            "batch_threshold": 0.75,
-            "split_bucket": True,
-            "speed_facter": speed_factor,
-            "fragment_interval": 0.3,
-            "media_type": "wav",
-            "parallel_infer": True,
-            "repetition_penalty": 1.35,
-            "seed": 473410238,
-            "sample_steps": 16,
-            "if_sr": False
-        }
-
-        try:
-            response = requests.post(url, headers=self.headers, json=data, timeout=60)
-
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("msg") == "合成成功":
-                    audio_url = result.get("audio_url")
-                    audio_response = requests.get(audio_url, timeout=60)
-                    if audio_response.status_code == 200:
-                        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                        with open(output_path, 'wb') as f:
-                            f.write(audio_response.content)
-                        return True
-                    else:
-                        return False
-                else:
-                    return False
-            else:
-                return False
-
-        except Exception as e:
-            return False
+    argv = [args.input, '--output', args.output, '--server', args.server, '--model', args.model,
+            '--speed', str(args.speed), '--concurrency', str(args.concurrency), '--cache-size', str(args.cache_size),
+            '--format', 'text']
+    for option, value in (('--voice-map', args.voice_map), ('--characters', args.characters),
+                          ('--cache-dir', args.cache_dir)):
+        if value:
+            argv += [option, value]
+    for option, enabled in (('--adaptive', args.adaptive), ('--no-cache', args.no_cache),
+                            ('--only-failed', args.only_failed)):
+        if enabled:
+            argv.append(option)
+    return tts_batch.main(argv + extra)
 
 
 def main():
     parser = argparse.ArgumentParser(description='TTS生成工具')
-    parser.add_argument('--text', required=True, help='要合成的文本')
-    parser.add_argument('--output', required=True, help='输出文件路径')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--text', help='要合成的文本')
+    source.add_argument('--input', help='对话文件或目录，每行“角色:台词”，交给tts_batch.py批量合成，'
+                                        '--split-chars等其他tts_batch.py选项原样转交')
+    parser.add_argument('--output', required=True, help='输出文件路径（--input时为输出目录）')
+    parser.add_argument('--server', default=DEFAULT_SERVER,
+                        help='TTS服务器地址，多台用逗号分隔，可写成“地址*权重”，地址前加tts+表示用/tts接口，'
+                             '此时需在地址后用?ref_audio_path=指定参考音频')
     parser.add_argument('--model', default='原神-中文-莱欧斯利_ZH', help='模型名称')
     parser.add_argument('--speed', type=float, default=1.0, help='语速因子')
+    parser.add_argument('--voice-map', default=None, help='批量合成时的角色模型映射文件，每行“角色 = 模型名”')
+    parser.add_argument('--characters', default=None, help='角色定义文件（角色代码 = 中文名），映射中写角色代码时需要')
+    parser.add_argument('--concurrency', type=int, default=16, help='批量合成时的最大并发请求数')
+    parser.add_argument('--adaptive', action='store_true', help='按服务器延迟自动调整并发数，--concurrency为上限')
+    parser.add_argument('--cache-dir', default=None, help='合成缓存目录，默认在用户目录下')
+    parser.add_argument('--cache-size', type=float, default=2.0, help='合成缓存上限（GB）')
+    parser.add_argument('--no-cache', action='store_true', help='不使用合成缓存')
+    parser.add_argument('--only-failed', action='store_true', help='只重跑输出目录日志中上次失败的行')
+
+    args, extra = parser.parse_known_args()
 
-    args = parser.parse_args()
+    if args.input:
+        sys.exit(run_batch(args, extra))
+    if extra:
+        parser.error(f"无法识别的参数: {' '.join(extra)}")
 
-    tts = TTSGenerator()
+    tts = TTSGenerator(server=args.server)
     success = tts.generate_tts(
         text=args.text,
         output_path=args.output,
@@ -83,9 +62,9 @@ def main():
         print(f"TTS生成成功，文件保存至: {args.output}")
         sys.exit(0)
     else:
-        print("TTS生成失败")
+        print(f"TTS生成失败: {tts.last_error}")
         sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tts_mock_server import MockTTSServer  # noqa: E402
+
+
+@pytest.fixture
+def mock_server():
+    """按参数启动MockTTSServer（或server_class指定的子类，随机端口），测试结束时关闭"""
+    servers = []
+
+    def start(server_class=MockTTSServer, **kwargs):
+        server = server_class(**kwargs).start_background()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
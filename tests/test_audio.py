@@ -0,0 +1,150 @@
+import io
+import struct
+import wave
+
+import pytest
+
+from tts_client import FRAGMENT_INTERVAL, wav_size_fixups
+from tts_engine import SynthesisEngine, plan_jobs
+from tts_journal import JobJournal
+from tts_mock_server import MockTTSServer, speech_wav, tone_samples, wav_header
+
+np = pytest.importorskip("numpy")
+
+from tts_stitch import read_pcm, split_on_silence, stitch_wavs, write_pcm  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+
+def tone(frame_count, seed):
+    return np.frombuffer(tone_samples(frame_count, seed), dtype='<i2').reshape(-1, 1)
+
+
+def write_wav(path, frames):
+    with open(path, 'wb') as f:
+        write_pcm(f, (1, SAMPLE_RATE), frames)
+
+
+def test_wav_size_fixups_streamed_header():
+    # api_v2流式返回的WAV头中长度为0
+    header = wav_header(0)
+    assert wav_size_fixups(header, 44 + 1000) == [(4, struct.pack("<I", 1036)), (40, struct.pack("<I", 1000))]
+
+
+def test_wav_size_fixups_correct_header():
+    assert wav_size_fixups(wav_header(1000), 44 + 1000) == []
+
+
+def test_wav_size_fixups_skips_extra_chunks():
+    fmt_end = wav_header(0)[:36]
+    header = fmt_end + b"LIST" + struct.pack("<I", 5) + b"abcde\x00" + b"data" + struct.pack("<I", 0)
+    data_offset = len(header) - 8
+    assert wav_size_fixups(header, len(header) + 100) == [(4, struct.pack("<I", len(header) + 92)),
+                                                          (data_offset + 4, struct.pack("<I", 100))]
+
+
+def test_wav_size_fixups_not_wav():
+    assert wav_size_fixups(b"<html>" + b"\x00" * 100, 106) == []
+    assert wav_size_fixups(b"RIFF", 4) == []
+
+
+def test_fixed_stream_is_readable():
+    data = speech_wav("第一句。第二句。")[44:]
+    content = bytearray(wav_header(0) + data)
+    for offset, value in wav_size_fixups(bytes(content[:256]), len(content)):
+        content[offset:offset + len(value)] = value
+    with wave.open(io.BytesIO(bytes(content))) as w:
+        assert w.getnframes() * 2 == len(data)
+
+
+def test_stitch_and_split_round_trip(tmp_path):
+    segments = [tone(3000, 1), tone(5000, 2), tone(2000, 3)]
+    paths = []
+    for i, frames in enumerate(segments):
+        paths.append(str(tmp_path / f"{i}.wav"))
+        write_wav(paths[-1], frames)
+    stitched = str(tmp_path / "stitched.wav")
+    with open(stitched, 'wb') as f:
+        stitch_wavs(paths, f, crossfade_ms=0, gap=FRAGMENT_INTERVAL)
+
+    params, frames = read_pcm(stitched)
+    assert params == (1, SAMPLE_RATE)
+    assert len(frames) == sum(len(s) for s in segments) + 2 * int(SAMPLE_RATE * FRAGMENT_INTERVAL)
+    params, parts = split_on_silence(stitched, 3, FRAGMENT_INTERVAL)
+    assert [part.tolist() for part in parts] == [s.tolist() for s in segments]
+    # 段数对不上时交给调用方退回逐行合成
+    assert split_on_silence(stitched, 2, FRAGMENT_INTERVAL) is None
+    assert split_on_silence(stitched, 4, FRAGMENT_INTERVAL) is None
+
+
+def test_stitch_crossfade_length(tmp_path):
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path / f"{i}.wav"))
+        write_wav(paths[-1], tone(4000, i))
+    output = io.BytesIO()
+    stitch_wavs(paths, output, crossfade_ms=10, gap=0.0)
+    output.seek(0)
+    with wave.open(output) as w:
+        assert w.getnframes() == 3 * 4000 - 2 * int(SAMPLE_RATE * 0.01)
+
+
+def test_stitch_rejects_mixed_formats(tmp_path):
+    first, second = str(tmp_path / "a.wav"), str(tmp_path / "b.wav")
+    write_wav(first, tone(1000, 1))
+    with open(second, 'wb') as f:
+        write_pcm(f, (1, SAMPLE_RATE * 2), tone(1000, 1))
+    with pytest.raises(ValueError):
+        stitch_wavs([first, second], io.BytesIO())
+
+
+class NoGapServer(MockTTSServer):
+    """句子之间不留静音，合并请求切不回各行"""
+
+    def render(self, text, data):
+        return speech_wav(text, data.get("model_name", ""), data.get("speed_facter", 1.0), self.seconds_per_char,
+                          0.0, self.sample_rate)
+
+
+def test_pack_splits_back_into_lines(mock_server, tmp_path):
+    server = mock_server()
+    lines = [f"角色{i % 3}:短句{i}" for i in range(8)]
+    engine = SynthesisEngine(server=server.base_url, pack_lines=4)
+    counts = engine.run(plan_jobs(lines, str(tmp_path)))
+    assert counts["success"] == 8
+    assert engine.packed_requests == 2
+    assert engine.pack_fallbacks == 0
+    assert server.infer_count == 2
+    for job in plan_jobs(lines, str(tmp_path)):
+        expected = speech_wav(job.text + "。", job.model_name)
+        assert read_pcm(job.output_path)[1].tobytes() == expected[44:]
+
+
+def test_pack_falls_back_when_gap_count_is_wrong(mock_server, tmp_path):
+    server = mock_server(server_class=NoGapServer)
+    lines = [f"角色{i % 3}:短句{i}" for i in range(8)]
+    engine = SynthesisEngine(server=server.base_url, pack_lines=4)
+    counts = engine.run(plan_jobs(lines, str(tmp_path)))
+    assert counts["success"] == 8
+    assert engine.packed_requests == 0
+    assert engine.pack_fallbacks == 2
+    # 2次合并请求 + 8次逐行请求
+    assert server.infer_count == 10
+    assert not list(tmp_path.rglob("*.part"))
+
+
+def test_pack_fallback_starts_each_line_once(mock_server, tmp_path, monkeypatch):
+    server = mock_server(server_class=NoGapServer)
+    lines = [f"角色{i % 3}:短句{i}" for i in range(8)]
+    running = []
+    mark_running = JobJournal.mark_running
+    monkeypatch.setattr(JobJournal, "mark_running", lambda journal, job: (running.append(job.index),
+                                                                          mark_running(journal, job)))
+    events = []
+    engine = SynthesisEngine(server=server.base_url, pack_lines=4,
+                             on_event=lambda event, job, detail: events.append((event, job)))
+    counts = engine.run(plan_jobs(lines, str(tmp_path)))
+    assert counts["success"] == 8
+    assert engine.pack_fallbacks == 2
+    assert sorted(job.index for event, job in events if event == "start") == list(range(8))
+    assert sorted(running) == list(range(8))
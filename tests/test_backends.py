@@ -0,0 +1,136 @@
+import pytest
+
+from tts_backends import API_INFER_SINGLE, API_TTS, Backend, BackendPool, parse_backends
+from tts_engine import SynthesisEngine, plan_jobs
+from tts_mock_server import ERROR_HTTP_500
+from tts_retry import CONNECTION, SYNTHESIS_FAILED, CircuitBreaker, RetryPolicy, SynthesisError
+
+
+def test_parse_backends():
+    backends = parse_backends(" http://10.0.0.2:8000/*2, tts+http://10.0.0.3:9880?ref_audio_path=ref/a.wav*3 ,")
+    assert [(backend.url, backend.weight, backend.api) for backend in backends] == [
+        ("http://10.0.0.2:8000", 2.0, API_INFER_SINGLE), ("http://10.0.0.3:9880", 3.0, API_TTS)]
+    assert backends[0].endpoint == "http://10.0.0.2:8000/infer_single"
+    assert backends[1].endpoint == "http://10.0.0.3:9880/tts"
+    assert backends[1].name == "10.0.0.3:9880"
+    assert backends[0].options == {}
+    assert backends[1].options == {"ref_audio_path": "ref/a.wav", "prompt_text": "", "prompt_lang": "zh",
+                                   "text_lang": "zh"}
+
+
+def test_parse_tts_options():
+    backend, = parse_backends("tts+http://a?ref_audio_path=%E5%8F%82%E8%80%83%2C1.wav&prompt_text=你好%2A&"
+                              "prompt_lang=ja&text_lang=en")
+    assert backend.options == {"ref_audio_path": "参考,1.wav", "prompt_text": "你好*", "prompt_lang": "ja",
+                               "text_lang": "en"}
+
+
+@pytest.mark.parametrize("spec", ["", " , ", "http://a*x", "http://a*0", "http://a*-1",
+                                  # /tts后端必须有参考音频，不认识的参数、infer_single后端带参数都报错
+                                  "tts+http://a", "tts+http://a?prompt_text=x",
+                                  "tts+http://a?ref_audio_path=r.wav&model_name=m",
+                                  "http://a?ref_audio_path=r.wav"])
+def test_parse_backends_rejects(spec):
+    with pytest.raises(ValueError):
+        parse_backends(spec)
+
+
+def test_pick_balances_in_flight_by_weight():
+    pool = BackendPool([Backend("http://a", 2), Backend("http://b", 1)])
+    for _ in range(30):
+        pool.pick()
+    assert [backend.in_flight for backend in pool.backends] == [20, 10]
+
+
+def test_pick_rotates_by_weight_at_low_concurrency():
+    # 一次只有一个请求时在途数总是0，按分到的总数/权重轮转
+    pool = BackendPool([Backend("http://a", 3), Backend("http://b", 1)])
+    for _ in range(40):
+        pool.release(pool.pick(), 0.1)
+    assert [backend.completed for backend in pool.backends] == [30, 10]
+
+
+def test_ejection_and_readmission():
+    changes = []
+    a, b = Backend("http://a"), Backend("http://b")
+    pool = BackendPool([a, b], failure_threshold=3, on_change=lambda backend, healthy: changes.append(
+        (backend.name, healthy)))
+    for _ in range(2):
+        pool.release(pool.pick(), 1.0, SynthesisError(CONNECTION))
+        pool.release(pool.pick(), 1.0, SynthesisError(CONNECTION))
+    # 合成失败说明服务器还能响应，不算不可用，并把连续失败清零
+    a.in_flight += 1
+    pool.release(a, 1.0, SynthesisError(SYNTHESIS_FAILED))
+    assert a.consecutive_failures == 0 and a.healthy
+    assert b.consecutive_failures == 2
+
+    b.in_flight += 1
+    pool.release(b, 1.0, SynthesisError(CONNECTION))
+    assert not b.healthy
+    assert changes == [("b", False)]
+    assert {pool.pick().name for _ in range(5)} == {"a"}
+    assert pool.healthy_count == 1
+
+    pool.set_health(b, True)
+    assert b.healthy and b.consecutive_failures == 0
+    assert changes == [("b", False), ("b", True)]
+
+
+def test_all_ejected_falls_back_to_every_backend():
+    pool = BackendPool([Backend("http://a"), Backend("http://b")], failure_threshold=1)
+    for backend in pool.backends:
+        backend.in_flight += 1
+        pool.release(backend, 1.0, SynthesisError(CONNECTION))
+    assert pool.healthy_count == 0
+    assert {pool.pick().name for _ in range(4)} == {"a", "b"}
+
+
+def test_success_on_ejected_backend_readmits_it():
+    pool = BackendPool([Backend("http://a")], failure_threshold=1)
+    backend = pool.pick()
+    pool.release(backend, 1.0, SynthesisError(CONNECTION))
+    assert not backend.healthy
+    pool.release(pool.pick(), 0.1)
+    assert backend.healthy
+
+
+def test_passive_probe_sends_one_request_after_interval():
+    a, b = Backend("http://a"), Backend("http://b")
+    pool = BackendPool([a, b], failure_threshold=1, check_interval=10, passive_probe=True)
+    b.in_flight += 1
+    pool.release(b, 1.0, SynthesisError(CONNECTION))
+    assert {pool.pick().name for _ in range(4)} == {"a"}
+    b.last_probe -= 10
+    assert pool.pick() is b
+    assert pool.pick() is a
+
+
+def test_probes_due():
+    a, b, c = Backend("http://a"), Backend("http://b"), Backend("http://c")
+    pool = BackendPool([a, b, c], check_interval=5)
+    # 忙碌的后端不需要探测，刚探测过的要等check_interval
+    a.in_flight = 1
+    c.last_probe = float("inf")
+    assert pool.probes_due() == [b]
+
+
+def test_engine_ejects_failing_backend(mock_server, tmp_path):
+    good = mock_server()
+    bad = mock_server(error_rate=1.0, error_kinds=[ERROR_HTTP_500])
+    engine = SynthesisEngine(server=f"{good.base_url},{bad.base_url}*4", concurrency=2,
+                             retry_policy=RetryPolicy(5, 0, 0), circuit_breaker=CircuitBreaker(100))
+    counts = engine.run(plan_jobs([f"A:第{i}行。" for i in range(20)], str(tmp_path)))
+    assert counts["success"] == 20
+    assert good.infer_count == 20
+    # 连续3次5xx之后摘除，之后不再收到合成请求（只有健康检查）；摘除时可能还有一个请求在途
+    assert 3 <= bad.error_count <= 4
+    assert not engine.backends.backends[1].healthy
+
+
+def test_engine_splits_load_by_weight(mock_server, tmp_path):
+    servers = [mock_server(latency=0.05), mock_server(latency=0.05)]
+    engine = SynthesisEngine(server=f"{servers[0].base_url}*3,{servers[1].base_url}", concurrency=4)
+    counts = engine.run(plan_jobs([f"A:第{i}行。" for i in range(40)], str(tmp_path)))
+    assert counts["success"] == 40
+    assert sum(server.infer_count for server in servers) == 40
+    assert 28 <= servers[0].infer_count <= 32
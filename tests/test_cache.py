@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import tts_cache
+from tts_cache import SynthesisCache, link_or_copy, synthesis_key
+from tts_engine import SynthesisEngine, plan_jobs
+
+
+def make_file(path, size, mtime=None):
+    path.write_bytes(b"x" * size)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_synthesis_key_normalizes_text_and_covers_parameters():
+    key = synthesis_key("你好 世界。", "模型A", 1.0)
+    assert synthesis_key("  你好　\n世界。 ", "模型A", 1.0) == key
+    # NFC：é的组合形式与分解形式是同一段文本
+    assert synthesis_key("caf\u00e9", "模型A", 1.0) == synthesis_key("cafe\u0301", "模型A", 1.0)
+    assert synthesis_key("你好 世界。", "模型B", 1.0) != key
+    assert synthesis_key("你好 世界。", "模型A", 1.2) != key
+    assert synthesis_key("你好，世界。", "模型A", 1.0) != key
+
+
+def test_put_and_materialize(tmp_path):
+    cache = SynthesisCache(str(tmp_path / "cache"))
+    output = tmp_path / "out" / "a.wav"
+    assert not cache.materialize("ab" * 32, str(output))
+    cache.put("ab" * 32, make_file(tmp_path / "src.wav", 10))
+    assert cache.materialize("ab" * 32, str(output))
+    assert output.read_bytes() == b"x" * 10
+    assert (cache.hits, cache.misses, cache.total_bytes) == (1, 1, 10)
+
+
+def test_lru_eviction_without_rescanning(tmp_path, monkeypatch):
+    cache = SynthesisCache(str(tmp_path / "cache"), max_bytes=350)
+    keys = [f"{i:02d}" * 32 for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, make_file(tmp_path / "src.wav", 100))
+    # 建立索引之后不再遍历目录
+    monkeypatch.setattr(cache, "_scan", lambda: pytest.fail("重新遍历了缓存目录"))
+    assert cache.materialize(keys[0], str(tmp_path / "hit.wav"))
+    cache.put(keys[3], make_file(tmp_path / "src.wav", 100))
+
+    # 超过350字节后淘汰到315字节：最久没用的是keys[1]
+    assert cache.total_bytes == 300
+    assert [os.path.exists(cache.path_for(key)) for key in keys] == [True, False, True, True]
+
+
+def test_index_orders_existing_entries_by_mtime(tmp_path):
+    # 其他进程或上次运行留下的条目按mtime排LRU顺序
+    cache = SynthesisCache(str(tmp_path / "cache"), max_bytes=250)
+    keys = [f"{i:02d}" * 32 for i in range(3)]
+    for key, mtime in zip(keys, (300, 100, 200)):
+        os.makedirs(os.path.dirname(cache.path_for(key)))
+        make_file(tmp_path / "cache" / key[:2] / (key + ".wav"), 100, mtime)
+
+    cache.evict()
+    assert cache.total_bytes == 200
+    assert [os.path.exists(cache.path_for(key)) for key in keys] == [True, False, True]
+
+
+def test_link_or_copy_uses_hard_link(tmp_path):
+    src = make_file(tmp_path / "src.wav", 10)
+    dst = tmp_path / "sub" / "dst.wav"
+    link_or_copy(src, str(dst))
+    assert os.path.samefile(src, dst)
+    assert sorted(os.listdir(tmp_path / "sub")) == ["dst.wav"]
+
+
+def test_link_or_copy_falls_back_to_copy(tmp_path, monkeypatch):
+    # 跨文件系统时os.link失败（EXDEV）
+    def cross_device(src, dst):
+        raise OSError(18, "Invalid cross-device link")
+
+    monkeypatch.setattr(tts_cache.os, "link", cross_device)
+    src = make_file(tmp_path / "src.wav", 10)
+    dst = tmp_path / "sub" / "dst.wav"
+    link_or_copy(src, str(dst))
+    assert not os.path.samefile(src, dst)
+    assert dst.read_bytes() == b"x" * 10
+    assert sorted(os.listdir(tmp_path / "sub")) == ["dst.wav"]
+
+
+def test_engine_reuses_cache_across_output_dirs(mock_server, tmp_path):
+    server = mock_server()
+    cache = SynthesisCache(str(tmp_path / "cache"))
+    lines = [f"A:第{i}行。" for i in range(5)]
+    engine = SynthesisEngine(server=server.base_url, cache=cache)
+    assert engine.run(plan_jobs(lines, str(tmp_path / "first")))["success"] == 5
+    assert server.infer_count == 5
+
+    engine = SynthesisEngine(server=server.base_url, cache=cache)
+    assert engine.run(plan_jobs(lines, str(tmp_path / "second")))["success"] == 5
+    assert server.infer_count == 5
+    assert engine.cache_hits == 5
+    first = sorted(path.name for path in (tmp_path / "first").rglob("*.wav"))
+    assert sorted(path.name for path in (tmp_path / "second").rglob("*.wav")) == first
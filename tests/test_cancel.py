@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from tts_engine import SynthesisEngine, plan_jobs
+from tts_journal import DONE, PENDING, JobJournal
+
+LONG_TEXT = "这是一段用来测试中止的很长的旁白。" * 6
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("等待超时")
+        time.sleep(0.02)
+
+
+@pytest.mark.parametrize("prefix", ["", "tts+"])
+def test_cancel_leaves_no_part_files(mock_server, tmp_path, prefix):
+    # tts+下长台词流式合成，中止时有写了一半的临时文件
+    server = mock_server(latency=3.0)
+    lines = [f"旁白:{i}{LONG_TEXT}" for i in range(4)]
+    engine = SynthesisEngine(server=server.tts_url if prefix else server.base_url, concurrency=4)
+    thread = threading.Thread(target=engine.run, args=(plan_jobs(lines, str(tmp_path)),))
+    thread.start()
+    try:
+        if prefix:
+            wait_for(lambda: list(tmp_path.rglob("*.part")))
+        else:
+            wait_for(lambda: server.active == 4)
+        start = time.monotonic()
+        engine.stop(cancel=True)
+        thread.join(5)
+        assert not thread.is_alive()
+        # 不用等服务器合成完
+        assert time.monotonic() - start < 1.5
+    finally:
+        engine.stop(cancel=True)
+        thread.join()
+
+    assert not list(tmp_path.rglob("*.part"))
+    assert not any(path.suffix == ".wav" for path in tmp_path.rglob("*"))
+    journal = JobJournal(str(tmp_path))
+    try:
+        assert journal.counts() == {PENDING: 4}
+    finally:
+        journal.close()
+
+
+def test_stop_without_cancel_finishes_in_flight(mock_server, tmp_path):
+    server = mock_server(latency=0.5)
+    lines = [f"角色:第{i}行。" for i in range(8)]
+    engine = SynthesisEngine(server=server.base_url, concurrency=2)
+    thread = threading.Thread(target=engine.run, args=(plan_jobs(lines, str(tmp_path)),))
+    thread.start()
+    wait_for(lambda: server.active == 2)
+    engine.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert engine.counts["success"] == 2
+    assert not list(tmp_path.rglob("*.part"))
+    journal = JobJournal(str(tmp_path))
+    try:
+        assert journal.counts() == {DONE: 2, PENDING: 6}
+    finally:
+        journal.close()
+
+
+def test_stop_and_pause_before_run(mock_server, tmp_path):
+    # 界面在Tk线程中创建引擎，点击开始之后、合成线程调用run()之前就可能暂停或停止
+    server = mock_server()
+    engine = SynthesisEngine(server=server.base_url)
+    engine.stop(cancel=True)
+    assert engine.run(plan_jobs(["A:第一行。"], str(tmp_path / "stopped")))["success"] == 0
+
+    engine = SynthesisEngine(server=server.base_url)
+    engine.pause()
+    thread = threading.Thread(target=engine.run, args=(plan_jobs(["A:第二行。"], str(tmp_path / "paused")),))
+    thread.start()
+    time.sleep(0.3)
+    assert server.infer_count == 0
+    engine.resume()
+    thread.join(5)
+    assert engine.counts["success"] == 1
@@ -0,0 +1,84 @@
+import os
+import stat
+import threading
+import time
+
+import pytest
+import requests
+
+from tts_backends import parse_backends
+from tts_client import TTSGenerator, atomic_write, build_payload, build_request
+from tts_mock_server import check_tts_request
+from tts_retry import RetryPolicy
+
+
+def test_build_request_for_tts_backend():
+    backend, = parse_backends("tts+http://a?ref_audio_path=ref/a.wav&prompt_text=参考文本&prompt_lang=ja")
+    data = build_request(backend, "你好。", model_name="模型", speed_factor=1.2)
+    assert check_tts_request(data) is None
+    assert {key: data[key] for key in ("text", "text_lang", "ref_audio_path", "prompt_text", "prompt_lang",
+                                       "speed_factor", "text_split_method")} == {
+        "text": "你好。", "text_lang": "zh", "ref_audio_path": "ref/a.wav", "prompt_text": "参考文本",
+        "prompt_lang": "ja", "speed_factor": 1.2, "text_split_method": "cut5"}
+    assert "model_name" not in data
+
+
+def test_mock_tts_rejects_infer_single_body(mock_server):
+    server = mock_server()
+    response = requests.post(server.base_url + "/tts", json=build_payload("你好。", dl_url=server.base_url),
+                             timeout=5)
+    assert response.status_code == 400
+    backend, = parse_backends(server.tts_url)
+    response = requests.post(backend.endpoint, json=build_request(backend, "你好。"), timeout=5)
+    assert response.status_code == 200
+    assert response.content[:4] == b"RIFF"
+
+
+def test_resize_during_requests(mock_server, tmp_path):
+    server = mock_server(latency=0.3)
+    generator = TTSGenerator(server.base_url, pool_size=2, retry_policy=RetryPolicy(1))
+    old_session = generator.session_pool.session
+    results = []
+
+    def worker(i):
+        results.append(generator.generate_tts(f"第{i}行。", str(tmp_path / f"{i}.wav")))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    # 在途请求还在用旧Session
+    generator.set_pool_size(8)
+    for thread in threads:
+        thread.join()
+    assert results == [True] * 4
+    assert generator.session_pool.session is not old_session
+    assert generator.generate_tts("再来一行。", str(tmp_path / "next.wav"))
+
+
+def test_resize_same_size_keeps_session(mock_server):
+    generator = TTSGenerator(mock_server().base_url, pool_size=4)
+    session = generator.session_pool.session
+    generator.set_pool_size(4)
+    assert generator.session_pool.session is session
+
+
+def test_atomic_write_uses_umask_permissions(tmp_path):
+    umask = os.umask(0o027)
+    try:
+        path = tmp_path / "a.wav"
+        with atomic_write(str(path)) as f:
+            f.write(b"data")
+    finally:
+        os.umask(umask)
+    assert path.read_bytes() == b"data"
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+
+
+def test_atomic_write_removes_temp_file_on_error(tmp_path):
+    path = tmp_path / "a.wav"
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(path)) as f:
+            f.write(b"half")
+            raise RuntimeError
+    assert not list(tmp_path.iterdir())
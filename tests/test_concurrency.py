@@ -0,0 +1,79 @@
+import time
+
+from tts_concurrency import AIMDController, ConcurrencyLimiter
+from tts_engine import ADAPTIVE_START, SynthesisEngine, plan_jobs
+from tts_mock_server import ERROR_HTTP_500, ERROR_SYNTHESIS
+from tts_retry import CircuitBreaker, RetryPolicy
+
+# 耗时取得很小，等一下再记录，样本就不会被当成上次调整之前发出的请求
+SCALE = 1e-5
+
+
+def run_window(controller, relative=1.0, congested=0, expected=(1, 10, 100)):
+    """用满并发后记录一个窗口的样本，返回评估结果"""
+    limiter = controller.limiter
+    limiter.in_use = limiter.limit
+    controller.on_dispatch()
+    limiter.in_use = 0
+    time.sleep(0.005)
+    result = None
+    for i in range(max(controller.min_samples, limiter.limit)):
+        cost = expected[i % len(expected)]
+        result = controller.record(cost * relative * SCALE, i < congested, cost)
+    return result
+
+
+def test_aimd_compares_latency_relative_to_expected():
+    # 长短台词交替，耗时相差100倍，但相对延迟不变，不算过载
+    controller = AIMDController(ConcurrencyLimiter(4), max_limit=64, min_samples=6)
+    assert [run_window(controller) for _ in range(3)] == [8, 16, 32]
+    assert controller.slow_start
+
+    # 即使只发长台词、耗时比基线高很多，相对延迟没有变化也不减小
+    assert run_window(controller, expected=(100,)) == 64
+    assert controller.baseline == 1.0 * SCALE
+
+
+def test_aimd_slow_start_backs_off_to_half_then_multiplies():
+    controller = AIMDController(ConcurrencyLimiter(4), max_limit=64, min_samples=6)
+    assert run_window(controller) == 8
+    assert run_window(controller) == 16
+    assert run_window(controller, relative=2.0) == 8
+    assert not controller.slow_start
+    assert run_window(controller) == 9
+    assert run_window(controller, relative=2.0) == 6
+
+
+def test_aimd_counts_congestion_signals():
+    controller = AIMDController(ConcurrencyLimiter(10), max_limit=64, min_samples=6)
+    controller.slow_start = False
+    assert run_window(controller, congested=2) == 7
+    assert controller.last_error_rate == 0.2
+
+
+def test_aimd_ignores_requests_sent_before_the_last_change():
+    controller = AIMDController(ConcurrencyLimiter(4), max_limit=64, min_samples=4)
+    assert run_window(controller) == 8
+    # 耗时1秒的请求在刚才的调整之前就已发出
+    for _ in range(20):
+        assert controller.record(1.0, True) is None
+    assert not controller.samples
+
+
+def test_engine_does_not_back_off_on_synthesis_failures(mock_server, tmp_path):
+    # 合成失败与服务器负载无关，不能减小并发
+    server = mock_server(error_rate=1.0, error_kinds=[ERROR_SYNTHESIS])
+    engine = SynthesisEngine(server=server.base_url, concurrency=16, adaptive=True, retry_policy=RetryPolicy(1),
+                             circuit_breaker=CircuitBreaker(1000))
+    engine.run(plan_jobs([f"A:第{i}行。" for i in range(40)], str(tmp_path)))
+    assert engine.counts["failed"] == 40
+    assert engine.limiter.limit == ADAPTIVE_START
+    assert not engine.controller.samples
+
+
+def test_engine_backs_off_on_server_errors(mock_server, tmp_path):
+    server = mock_server(error_rate=1.0, error_kinds=[ERROR_HTTP_500])
+    engine = SynthesisEngine(server=server.base_url, concurrency=16, adaptive=True, retry_policy=RetryPolicy(1),
+                             circuit_breaker=CircuitBreaker(1000))
+    engine.run(plan_jobs([f"A:第{i}行。" for i in range(40)], str(tmp_path)))
+    assert engine.limiter.limit < ADAPTIVE_START
@@ -0,0 +1,38 @@
+import pytest
+
+from tts_cache import SynthesisCache
+from tts_engine import SynthesisEngine, plan_jobs
+from tts_mock_server import ERROR_SYNTHESIS
+from tts_retry import RetryPolicy
+
+COMMON = "这是所有台词共有的一句很长的旁白。"
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_identical_lines_and_pieces_are_synthesized_once(mock_server, tmp_path, cache):
+    server = mock_server(latency=0.3)
+    # 4行长台词拆成“开场白 + COMMON”两段，还有一行短台词正好是COMMON，另有两行文本相同
+    lines = [f"旁白:第{i}段开场白，各不相同。{COMMON}" for i in range(4)]
+    lines += [f"角色:{COMMON}", "A:嗯。", "B:嗯。"]
+    engine = SynthesisEngine(server=server.base_url, concurrency=8, split_chars=18,
+                             cache=SynthesisCache(str(tmp_path / "cache")) if cache else None)
+    counts = engine.run(plan_jobs(lines, str(tmp_path / "out")))
+    assert counts["success"] == 7
+    assert engine.split_lines == 4
+    # 4段开场白 + COMMON + 嗯
+    assert server.infer_count == 6
+    assert engine.calls_saved == 5
+    for job in plan_jobs(lines, str(tmp_path / "out")):
+        with open(job.output_path, 'rb') as f:
+            assert f.read(4) == b"RIFF"
+    assert not list((tmp_path / "out").rglob("*.part"))
+
+
+def test_follower_gets_the_leader_error(mock_server, tmp_path):
+    server = mock_server(latency=0.3, error_rate=1.0, error_kinds=[ERROR_SYNTHESIS])
+    lines = [f"旁白:第{i}段开场白，各不相同。{COMMON}" for i in range(2)]
+    engine = SynthesisEngine(server=server.base_url, concurrency=4, split_chars=18, retry_policy=RetryPolicy(1))
+    counts = engine.run(plan_jobs(lines, str(tmp_path)))
+    assert counts["failed"] == 2
+    assert server.error_count == 3
+    assert engine.calls_saved == 1
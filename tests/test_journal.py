@@ -0,0 +1,85 @@
+import os
+
+from tts_engine import SynthesisEngine, plan_jobs
+from tts_journal import DONE, FAILED, PENDING, JobJournal
+from tts_mock_server import ERROR_SYNTHESIS
+from tts_retry import RetryPolicy
+
+LINES = ["A:第一行。", "B:第二行。", "A:第三行。"]
+
+
+def run(server, output_dir, lines=LINES, speed_factor=1.0, only_failed=False):
+    """合成一遍，返回(计数, 各行的(事件, detail))"""
+    events = []
+
+    def on_event(event, job, detail):
+        if job is not None and event in ("success", "failed", "skipped"):
+            events.append((job.original_line, event, detail if event == "skipped" else None))
+
+    engine = SynthesisEngine(server=server.base_url, on_event=on_event, retry_policy=RetryPolicy(1))
+    counts = engine.run(plan_jobs(lines, str(output_dir), speed_factor=speed_factor), only_failed)
+    return counts, events
+
+
+def journal_states(output_dir):
+    journal = JobJournal(str(output_dir))
+    try:
+        return journal.counts()
+    finally:
+        journal.close()
+
+
+def test_resume_skips_done_lines(mock_server, tmp_path):
+    server = mock_server()
+    counts, _ = run(server, tmp_path)
+    assert counts["success"] == 3
+    infer_count = server.infer_count
+
+    counts, events = run(server, tmp_path)
+    assert counts["success"] == 0
+    assert {detail for _, _, detail in events} == {"已存在"}
+    assert server.infer_count == infer_count
+    assert journal_states(tmp_path) == {DONE: 3}
+
+
+def test_changed_parameters_make_lines_stale(mock_server, tmp_path):
+    server = mock_server()
+    run(server, tmp_path)
+    paths = [job.output_path for job in plan_jobs(LINES, str(tmp_path))]
+    before = [open(path, 'rb').read() for path in paths]
+
+    # 文件名只取决于台词，语速变了要覆盖已有文件
+    counts, _ = run(server, tmp_path, speed_factor=1.5)
+    assert counts["success"] == 3
+    assert all(open(path, 'rb').read() != data for path, data in zip(paths, before))
+
+    counts, _ = run(server, tmp_path, speed_factor=1.5)
+    assert counts["success"] == 0
+
+
+def test_only_failed_reruns_failed_lines(mock_server, tmp_path):
+    healthy = mock_server()
+    failing = mock_server(error_rate=1.0, error_kinds=[ERROR_SYNTHESIS])
+    run(healthy, tmp_path, LINES[:2])
+    counts, _ = run(failing, tmp_path, LINES)
+    assert counts["failed"] == 1
+    assert journal_states(tmp_path) == {DONE: 2, FAILED: 1}
+
+    # 新加的行和已完成的行都不在only_failed的范围内
+    counts, events = run(healthy, tmp_path, LINES + ["B:新加的一行。"], only_failed=True)
+    assert counts == {"success": 1, "failed": 0, "skipped": 0}
+    assert events == [(LINES[2], "success", None)]
+    new_job = plan_jobs(["B:新加的一行。"], str(tmp_path))[0]
+    assert not os.path.exists(new_job.output_path)
+    assert journal_states(tmp_path) == {DONE: 3, PENDING: 1}
+
+
+def test_existing_files_without_journal_are_kept(mock_server, tmp_path):
+    server = mock_server()
+    job = plan_jobs(LINES[:1], str(tmp_path))[0]
+    with open(job.output_path, 'wb') as f:
+        f.write(b"old")
+    counts, _ = run(server, tmp_path, LINES[:1])
+    assert counts["skipped"] == 1
+    assert open(job.output_path, 'rb').read() == b"old"
+    assert journal_states(tmp_path) == {DONE: 1}
@@ -0,0 +1,106 @@
+import time
+
+import pytest
+import requests
+
+from tts_engine import SynthesisEngine, plan_jobs
+from tts_metrics import CONTENT_TYPE, MetricsServer, _labels, render_metrics
+from tts_stats import LATENCY_BUCKETS
+
+
+def parse(text):
+    """把Prometheus文本格式拆成({指标名: (类型, 说明)}, {样本名和标签: 值})"""
+    families = {}
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            name, help_text = line[7:].split(" ", 1)
+            families[name] = (None, help_text)
+        elif line.startswith("# TYPE "):
+            name, kind = line[7:].split(" ")
+            families[name] = (kind, families[name][1])
+        else:
+            key, value = line.rsplit(" ", 1)
+            assert key not in samples
+            samples[key] = float(value)
+    return families, samples
+
+
+def test_labels_are_escaped():
+    assert _labels() == ""
+    assert _labels(stage="request", backend=None) == '{stage="request"}'
+    assert _labels(backend='a"b\\c\nd') == '{backend="a\\"b\\\\c\\nd"}'
+
+
+def test_render_metrics():
+    engine = SynthesisEngine(server="http://10.0.0.2:8000,http://10.0.0.3:8000", concurrency=6)
+    engine.backends.backends[1].healthy = False
+    stats = engine.stats
+    stats.add("success", 7)
+    stats.add("failed")
+    stats.add("requests", 7, label="success")
+    stats.add("requests", 2, label="超时")
+    stats.add("cache_hits", 1)
+    stats.add("cache_misses", 3)
+    stats.add("bytes", 2048)
+    stats.observe("request", 0.3, label="10.0.0.2:8000")
+    stats.observe("request", 0.3, label="10.0.0.2:8000")
+    stats.observe("request", 1000.0, label="10.0.0.2:8000")
+    stats.observe("write", 0.01)
+    text = render_metrics(engine)
+    assert text.endswith("\n")
+    families, samples = parse(text)
+
+    assert families["tts_lines_total"][0] == "counter"
+    assert families["tts_cache_hit_ratio"][0] == "gauge"
+    assert families["tts_stage_latency_seconds"][0] == "histogram"
+    assert all(kind and help_text for kind, help_text in families.values())
+    assert samples['tts_lines_total{outcome="success"}'] == 7
+    assert samples['tts_lines_total{outcome="failed"}'] == 1
+    assert samples['tts_lines_total{outcome="skipped"}'] == 0
+    assert samples['tts_requests_total{outcome="超时"}'] == 2
+    assert samples["tts_retries_total"] == 0
+    assert samples["tts_cache_hit_ratio"] == 0.25
+    assert samples["tts_bytes_written_total"] == 2048
+    assert samples["tts_queue_depth"] == 0
+    assert samples["tts_concurrency_limit"] == 6
+    assert samples['tts_backend_up{backend="10.0.0.2:8000"}'] == 1
+    assert samples['tts_backend_up{backend="10.0.0.3:8000"}'] == 0
+    # 还没有运行，没有预计剩余时间
+    assert "tts_eta_seconds" not in families
+
+    # 直方图的桶是累计的，+Inf桶等于总数
+    prefix = 'tts_stage_latency_seconds_bucket{stage="request",backend="10.0.0.2:8000",le='
+    buckets = [samples[f'{prefix}"{bound:g}"}}'] for bound in LATENCY_BUCKETS] + [samples[prefix + '"+Inf"}']]
+    assert buckets == [0, 0, 0, 2, 2, 2, 2, 2, 2, 2, 2, 3]
+    assert samples['tts_stage_latency_seconds_count{stage="request",backend="10.0.0.2:8000"}'] == 3
+    assert samples['tts_stage_latency_seconds_sum{stage="request",backend="10.0.0.2:8000"}'] == pytest.approx(1000.6)
+    # 不分后端的阶段没有backend标签
+    assert samples['tts_stage_latency_seconds_count{stage="write"}'] == 1
+
+
+def test_render_metrics_eta():
+    engine = SynthesisEngine()
+    engine.predicted_total = 30.0
+    engine.predicted_done = 10.0
+    engine._started = time.monotonic() - 10
+    _, samples = parse(render_metrics(engine))
+    assert samples["tts_eta_seconds"] == pytest.approx(20.0, abs=0.5)
+
+
+def test_metrics_server(mock_server, tmp_path):
+    server = mock_server()
+    engine = SynthesisEngine(server=server.base_url)
+    assert engine.run(plan_jobs(["甲:一。", "乙:二。"], str(tmp_path)))["success"] == 2
+    metrics = MetricsServer(engine, 0).start_background()
+    try:
+        url = f"http://127.0.0.1:{metrics.server_address[1]}"
+        response = requests.get(url + "/metrics", timeout=5)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == CONTENT_TYPE
+        _, samples = parse(response.text)
+        assert samples['tts_lines_total{outcome="success"}'] == 2
+        assert samples['tts_requests_total{outcome="success"}'] == 2
+        assert requests.get(url + "/", timeout=5).status_code == 404
+    finally:
+        metrics.close()
@@ -0,0 +1,200 @@
+import asyncio
+import time
+
+import pytest
+
+from tts_client import TTSGenerator
+from tts_concurrency import TokenBucket
+from tts_engine import SynthesisEngine, plan_jobs
+from tts_mock_server import (ERROR_BAD_JSON, ERROR_BUSY, ERROR_DISCONNECT, ERROR_HTTP_500, ERROR_MISSING_AUDIO,
+                             ERROR_STALL, ERROR_SYNTHESIS)
+from tts_retry import (BACKEND_UNAVAILABLE, BAD_RESPONSE, CLIENT_ERROR, CONNECTION, DOWNLOAD_FAILED, SERVER_ERROR,
+                       STALLED, SYNTHESIS_FAILED, TIMEOUT, CircuitBreaker, RetryPolicy, SynthesisError)
+
+
+def run_one(server, output_dir, prefix="", **options):
+    """最多尝试2次合成一行，返回引擎"""
+    options.setdefault("stall_timeout", 0.5)
+    options.setdefault("timeout", 5)
+    engine = SynthesisEngine(server=server.tts_url if prefix else server.base_url, concurrency=2,
+                             retry_policy=RetryPolicy(2, 0, 0), circuit_breaker=CircuitBreaker(100), **options)
+    engine.run(plan_jobs(["A:测试一下。"], str(output_dir)))
+    return engine
+
+
+@pytest.mark.parametrize("prefix, kind, reason, attempts", [
+    ("", ERROR_HTTP_500, SERVER_ERROR, 2),
+    ("", ERROR_BUSY, SERVER_ERROR, 2),
+    ("", ERROR_SYNTHESIS, SYNTHESIS_FAILED, 1),
+    ("", ERROR_BAD_JSON, BAD_RESPONSE, 2),
+    ("", ERROR_MISSING_AUDIO, DOWNLOAD_FAILED, 2),
+    ("", ERROR_DISCONNECT, CONNECTION, 2),
+    ("", ERROR_STALL, STALLED, 2),
+    ("tts+", ERROR_HTTP_500, SERVER_ERROR, 2),
+    ("tts+", ERROR_SYNTHESIS, SYNTHESIS_FAILED, 1),
+    ("tts+", ERROR_BAD_JSON, BAD_RESPONSE, 2),
+    ("tts+", ERROR_MISSING_AUDIO, CLIENT_ERROR, 1),
+    ("tts+", ERROR_DISCONNECT, CONNECTION, 2),
+    ("tts+", ERROR_STALL, STALLED, 2),
+])
+def test_engine_classifies_failures(mock_server, tmp_path, prefix, kind, reason, attempts):
+    server = mock_server(error_rate=1.0, error_kinds=[kind], stall_time=2)
+    engine = run_one(server, tmp_path, prefix)
+    assert dict(engine.failure_reasons) == {reason: 1}
+    # 不可重试的原因只请求一次
+    assert engine.stats.snapshot().labelled("requests") == {reason: attempts}
+
+
+@pytest.mark.parametrize("prefix", ["", "tts+"])
+def test_engine_slow_response_is_timeout(mock_server, tmp_path, prefix):
+    server = mock_server(latency=2.0)
+    engine = run_one(server, tmp_path, prefix, timeout=0.5)
+    assert dict(engine.failure_reasons) == {TIMEOUT: 1}
+
+
+@pytest.mark.parametrize("prefix", ["", "tts+"])
+def test_engine_stall_without_stall_timeout_is_timeout(mock_server, tmp_path, prefix):
+    # asyncio.TimeoutError是OSError的子类，不能被当成写文件失败
+    server = mock_server(error_rate=1.0, error_kinds=[ERROR_STALL], stall_time=3)
+    engine = run_one(server, tmp_path, prefix, timeout=1, stall_timeout=None)
+    assert dict(engine.failure_reasons) == {TIMEOUT: 1}
+
+
+@pytest.mark.parametrize("prefix", ["", "tts+"])
+def test_client_stall_is_timeout(mock_server, tmp_path, prefix):
+    server = mock_server(error_rate=1.0, error_kinds=[ERROR_STALL], stall_time=3)
+    generator = TTSGenerator(server.tts_url if prefix else server.base_url, timeout=0.5, retry_policy=RetryPolicy(1))
+    assert not generator.generate_tts("测试一下。", str(tmp_path / "a.wav"))
+    assert generator.last_error.reason == TIMEOUT
+    assert not list(tmp_path.iterdir())
+
+
+def test_engine_retries_until_success(mock_server, tmp_path):
+    server = mock_server(error_rate=0.5, error_kinds=[ERROR_HTTP_500], seed=1)
+    engine = SynthesisEngine(server=server.base_url, concurrency=4, retry_policy=RetryPolicy(10, 0, 0),
+                             circuit_breaker=CircuitBreaker(100))
+    counts = engine.run(plan_jobs([f"A:第{i}行。" for i in range(20)], str(tmp_path)))
+    assert counts["success"] == 20
+    assert engine.stats.snapshot()["retries"] == server.error_count
+
+
+def test_circuit_breaker_open_half_open_close():
+    async def scenario():
+        changes = []
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.1, on_state_change=changes.append)
+        await breaker.acquire()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+        # 断开期间acquire等到recovery_timeout之后，只放行一个探测请求
+        start = time.monotonic()
+        await breaker.acquire()
+        assert time.monotonic() - start >= 0.09
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        waiter = asyncio.create_task(breaker.acquire())
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+
+        breaker.record_success()
+        await asyncio.wait_for(waiter, 1)
+        assert breaker.state == CircuitBreaker.CLOSED
+        return changes
+
+    changes = asyncio.run(scenario())
+    assert changes == [CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN, CircuitBreaker.CLOSED]
+
+
+def test_circuit_breaker_failed_probe_reopens_with_backoff():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05, max_recovery_timeout=0.15)
+        breaker.record_failure()
+        for expected in (0.1, 0.15, 0.15):
+            await breaker.acquire()
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+            breaker.record_failure()
+            assert breaker.state == CircuitBreaker.OPEN
+            assert breaker.recovery_timeout == pytest.approx(expected)
+        await breaker.acquire()
+        breaker.record_success()
+        assert breaker.recovery_timeout == 0.05
+
+    asyncio.run(scenario())
+
+
+def test_circuit_breaker_neutral_releases_probe():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+        breaker.record_failure()
+        await breaker.acquire()
+        waiter = asyncio.create_task(breaker.acquire())
+        await asyncio.sleep(0.02)
+        assert not waiter.done()
+        breaker.record_neutral()
+        await asyncio.wait_for(waiter, 1)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    asyncio.run(scenario())
+
+
+def test_circuit_breaker_max_outage():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10, max_outage=0.1)
+        breaker.record_failure()
+        with pytest.raises(SynthesisError) as excinfo:
+            await asyncio.wait_for(breaker.acquire(), 1)
+        assert excinfo.value.reason == BACKEND_UNAVAILABLE
+
+    asyncio.run(scenario())
+
+
+def test_token_bucket_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=20, burst=1)
+        start = time.monotonic()
+        for _ in range(11):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # 第一个令牌是现成的，其余10个按每秒20个补充
+    assert 0.45 <= asyncio.run(scenario()) < 0.8
+
+
+def test_token_bucket_burst_and_unlimited():
+    async def scenario():
+        bucket = TokenBucket(rate=5, burst=5)
+        start = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        burst = time.monotonic() - start
+        bucket.set_rate(0)
+        start = time.monotonic()
+        for _ in range(100):
+            await bucket.acquire()
+        return burst, time.monotonic() - start
+
+    burst, unlimited = asyncio.run(scenario())
+    assert burst < 0.05
+    assert unlimited < 0.05
+
+
+def test_streaming_waits_for_each_fragment_not_the_whole_line(mock_server, tmp_path):
+    # 整句合成2秒，超过timeout，但每个片段之间不到stall_timeout
+    server = mock_server(latency=2.0)
+    engine = SynthesisEngine(server=server.tts_url, timeout=1, stall_timeout=0.8,
+                             retry_policy=RetryPolicy(1))
+    counts = engine.run(plan_jobs(["旁白:" + "这是一段很长的旁白。" * 8], str(tmp_path)))
+    assert counts["success"] == 1
+    assert engine.streamed == 1
+
+
+def test_streaming_response_header_wait_is_bounded(mock_server, tmp_path):
+    # 第一个片段迟迟合成不完时，响应头也不会来
+    server = mock_server(latency=3.0)
+    engine = SynthesisEngine(server=server.tts_url, timeout=60, stall_timeout=0.3,
+                             retry_policy=RetryPolicy(1))
+    start = time.monotonic()
+    engine.run(plan_jobs(["旁白:" + "这是一段很长的旁白。" * 8], str(tmp_path)))
+    assert dict(engine.failure_reasons) == {TIMEOUT: 1}
+    assert time.monotonic() - start < 2
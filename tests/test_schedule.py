@@ -0,0 +1,91 @@
+import heapq
+import json
+import time
+
+import pytest
+
+from tts_engine import SynthesisEngine, group_jobs, plan_jobs
+from tts_schedule import MAX_SAMPLES, MIN_SAMPLES, PRIOR_BASE, PRIOR_PER_CHAR, DurationModel, fit_line, format_duration
+
+
+def test_fit_line():
+    assert fit_line([(1, 3.0), (2, 5.0), (3, 7.0)]) == pytest.approx((1.0, 2.0))
+    # 斜率不小于0，x全部相同时斜率为0
+    assert fit_line([(1, 3.0), (2, 1.0)]) == pytest.approx((2.0, 0.0))
+    assert fit_line([(5, 1.0), (5, 3.0)]) == pytest.approx((2.0, 0.0))
+
+
+def test_format_duration():
+    assert [format_duration(s) for s in (45.4, 200, 3725)] == ["45秒", "3分20秒", "1小时02分"]
+
+
+def test_duration_model_fit():
+    model = DurationModel()
+    assert model.predict("A", 1.0, 10) == pytest.approx(PRIOR_BASE + PRIOR_PER_CHAR * 10)
+    for chars in range(1, MIN_SAMPLES + 1):
+        model.observe("A", 2.0, chars * 2, 0.5 + 0.2 * chars)
+    # 字数按语速换算：2倍语速的20字相当于1倍语速的10字
+    assert model.predict("A", 2.0, 20) == pytest.approx(2.5)
+    assert model.predict("A", 1.0, 10) == pytest.approx(2.5)
+    # 样本不足的模型用全部模型合在一起的拟合
+    model.observe("B", 1.0, 4, 1.3)
+    assert model.predict("B", 1.0, 10) == pytest.approx(2.5)
+
+
+def test_duration_model_save_and_load(tmp_path):
+    path = tmp_path / "sub" / "timings.json"
+    model = DurationModel(str(path))
+    for i in range(MAX_SAMPLES + 5):
+        model.observe("模型甲", 1.0, i, 1.0)
+    model.save()
+    loaded = DurationModel(str(path))
+    assert len(loaded.samples["模型甲"]) == MAX_SAMPLES
+    assert loaded.samples["模型甲"][0] == (5.0, 1.0)
+    assert loaded.predict("模型甲", 1.0, 3) == pytest.approx(model.predict("模型甲", 1.0, 3))
+
+    path.write_text("{损坏", encoding='utf-8')
+    assert DurationModel(str(path)).samples == {}
+    path.write_text(json.dumps([1, 2]), encoding='utf-8')
+    assert DurationModel(str(path)).samples == {}
+
+
+def scheduled_texts(engine, lines, tmp_path, voice_map=None):
+    queue = engine._schedule(engine._units(group_jobs(plan_jobs(lines, str(tmp_path), voice_map=voice_map))))
+    return [heapq.heappop(queue)[4][0][0].text for _ in range(len(queue))]
+
+
+def test_schedule_longest_first_within_model(tmp_path):
+    lines = ["甲:一。", "乙:二二二二。", "甲:三三三。", "乙:四四。", "甲:五五五五五。"]
+    voice_map = {"甲": "A", "乙": "B"}
+    # 模型按首次出现的顺序分批，同一模型内预测耗时从长到短（LPT）
+    assert scheduled_texts(SynthesisEngine(), lines, tmp_path, voice_map) == [
+        "五五五五五。", "三三三。", "一。", "二二二二。", "四四。"]
+    assert scheduled_texts(SynthesisEngine(longest_first=False), lines, tmp_path, voice_map) == [
+        "一。", "三三三。", "五五五五五。", "二二二二。", "四四。"]
+
+
+def test_eta(tmp_path):
+    engine = SynthesisEngine()
+    assert engine.eta() is None
+    engine._schedule(engine._units(group_jobs(plan_jobs(["甲:一。", "乙:二二。"], str(tmp_path)))))
+    assert engine.predicted_total == pytest.approx(2 * PRIOR_BASE + 5 * PRIOR_PER_CHAR)
+
+    # 10秒完成了预测总量的1/4，剩下的3/4还要30秒；暂停的5秒不算
+    engine.predicted_total = 40.0
+    engine.predicted_done = 10.0
+    engine._started = time.monotonic() - 15
+    engine._paused_total = 5.0
+    assert engine.eta() == pytest.approx(30.0, abs=0.1)
+    engine._paused_at = time.monotonic() - 5
+    assert engine.eta() == pytest.approx(15.0, abs=0.1)
+    engine.predicted_done = 40.0
+    assert engine.eta() == 0.0
+
+
+def test_run_reports_eta_and_completes_prediction(mock_server, tmp_path):
+    server = mock_server(latency=0.05)
+    engine = SynthesisEngine(server=server.base_url, concurrency=2)
+    counts = engine.run(plan_jobs([f"甲:第{i}行。" for i in range(6)], str(tmp_path)))
+    assert counts["success"] == 6
+    assert engine.predicted_done == pytest.approx(engine.predicted_total)
+    assert engine.eta() == 0.0
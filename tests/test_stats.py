@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from tts_stats import LATENCY_BUCKETS, SynthesisStats, format_bytes
+
+
+def test_format_bytes():
+    assert [format_bytes(size) for size in (512, 3 * 1024 + 300, 5 * 1024 ** 2, 3 * 1024 ** 3)] == [
+        "512 B", "3.3 KB", "5.0 MB", "3.00 GB"]
+
+
+def test_empty_snapshot():
+    snapshot = SynthesisStats().snapshot()
+    assert snapshot["success"] == 0
+    assert snapshot.labelled("requests") == {}
+    assert snapshot.latency("request") is None
+    assert snapshot.histograms == {}
+
+
+def test_shards_from_threads_are_merged():
+    stats = SynthesisStats()
+    barrier = threading.Barrier(4)
+
+    def worker(n):
+        # 四个线程都已经有了自己的一份之后才开始记录
+        stats.add("success", 0)
+        barrier.wait()
+        for i in range(100):
+            stats.add("success")
+            stats.add("bytes", 10)
+            stats.add("requests", label="success" if i % 4 else "超时")
+            stats.observe("request", 0.1 * (n + 1), label=f"后端{n % 2}")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(stats._shards) == 4
+
+    snapshot = stats.snapshot()
+    assert snapshot["success"] == 400
+    assert snapshot["bytes"] == 4000
+    assert snapshot.labelled("requests") == {"success": 300, "超时": 100}
+    assert len(snapshot.samples["request"]) == 400
+    assert snapshot.latency("request") == pytest.approx({50: 0.2, 95: 0.4, 99: 0.4}, abs=0.1)
+    # 后端0是线程0和2（0.1秒、0.3秒），后端1是线程1和3（0.2秒、0.4秒）
+    histogram = snapshot.histograms[("request", "后端0")]
+    assert len(histogram) == len(LATENCY_BUCKETS) + 2
+    assert histogram[LATENCY_BUCKETS.index(0.1)] == 100
+    assert histogram[LATENCY_BUCKETS.index(0.5)] == 100
+    assert sum(histogram[:-1]) == 200
+    assert histogram[-1] == pytest.approx(100 * 0.1 + 100 * 0.3)
+    assert sum(snapshot.histograms[("request", "后端1")][:-1]) == 200
+
+
+def test_rolling_window_and_cumulative_histogram():
+    stats = SynthesisStats(window=10)
+    for i in range(30):
+        stats.observe("ttfb", i)
+    stats.observe("ttfb", 1000)
+    snapshot = stats.snapshot()
+    # 滚动窗口只留最近10个样本，直方图从头累计，超过最大桶的进+Inf桶
+    assert snapshot.samples["ttfb"] == list(range(21, 30)) + [1000]
+    histogram = snapshot.histograms[("ttfb", None)]
+    assert sum(histogram[:-1]) == 31
+    assert histogram[-2] == 1
+    assert histogram[-1] == sum(range(30)) + 1000
+
+
+def test_snapshot_does_not_change_afterwards():
+    stats = SynthesisStats()
+    stats.add("success")
+    stats.observe("request", 1.0)
+    snapshot = stats.snapshot()
+    stats.add("success")
+    stats.observe("request", 2.0)
+    assert snapshot["success"] == 1
+    assert snapshot.samples["request"] == [1.0]
+    assert sum(snapshot.histograms[("request", None)][:-1]) == 1
@@ -0,0 +1,128 @@
+import tkinter as tk
+
+from tts_ui import UIEventBus
+
+
+class FakeRoot:
+    """记录after()登记的回调，由测试代替Tk主循环调用"""
+
+    def __init__(self):
+        self.pending = []
+
+    def after(self, interval, callback):
+        self.pending.append(callback)
+
+    def frame(self):
+        callback = self.pending.pop(0)
+        callback()
+
+
+class FakeText:
+    """只实现UIEventBus用到的Text方法：按行存放，位置只支持“行.0”、“1.0”、END和“end-1c”"""
+
+    def __init__(self):
+        self.content = ""
+        self.inserts = 0
+        self.sees = 0
+
+    def insert(self, index, text):
+        assert index == tk.END
+        self.content += text
+        self.inserts += 1
+
+    def delete(self, start, end):
+        assert start == "1.0"
+        if end == tk.END:
+            self.content = ""
+        else:
+            lines = self.content.split("\n")
+            self.content = "\n".join(lines[int(end.split(".")[0]) - 1:])
+
+    def index(self, index):
+        assert index == "end-1c"
+        return f"{self.content.count(chr(10)) + 1}.0"
+
+    def see(self, index):
+        self.sees += 1
+
+    @property
+    def lines(self):
+        return self.content.split("\n")[:-1]
+
+
+def make_bus(max_lines=5):
+    root, text = FakeRoot(), FakeText()
+    return UIEventBus(root, text, max_lines=max_lines), root, text
+
+
+def test_logs_are_batched_per_frame():
+    bus, root, text = make_bus()
+    refreshed = []
+    order = []
+
+    def refresh():
+        refreshed.append(len(text.lines))
+        order.append("refresh")
+
+    for i in range(3):
+        bus.log(f"第{i}行")
+        bus.refresh(refresh)
+    bus.call(order.append, "完成")
+    root.frame()
+    # 一帧内的日志合成一次插入，refresh只调用一次，call在refresh之后
+    assert text.lines == ["第0行", "第1行", "第2行"]
+    assert text.inserts == 1 and text.sees == 1
+    assert refreshed == [3]
+    assert order == ["refresh", "完成"]
+    # 每帧都重新登记下一帧
+    assert len(root.pending) == 1
+    root.frame()
+    assert text.inserts == 1
+
+
+def test_log_area_is_a_ring_buffer():
+    bus, root, text = make_bus(max_lines=5)
+    for i in range(3):
+        bus.log(f"a{i}")
+    root.frame()
+    for i in range(12):
+        bus.log(f"b{i}")
+    root.frame()
+    assert text.lines == [f"b{i}" for i in range(7, 12)]
+    assert list(bus.entries) == text.lines
+
+
+def test_failures_only():
+    bus, root, text = make_bus(max_lines=3)
+    bus.log("失败1", failed=True)
+    for i in range(10):
+        bus.log(f"成功{i}")
+    bus.log("失败2", failed=True)
+    root.frame()
+    assert text.lines == ["成功8", "成功9", "失败2"]
+
+    # 失败日志有自己的环形缓冲，不会被成功日志挤掉
+    bus.set_failures_only(True)
+    assert text.lines == ["失败1", "失败2"]
+    bus.log("成功10")
+    bus.log("失败3", failed=True)
+    root.frame()
+    assert text.lines == ["失败1", "失败2", "失败3"]
+
+    bus.set_failures_only(False)
+    assert text.lines == ["失败2", "成功10", "失败3"]
+    bus.clear()
+    assert text.lines == [] and not bus.entries and not bus.failures
+
+
+def test_log_file_gets_every_message():
+    written = []
+
+    class FakeLogFile:
+        def write(self, message, failed=False):
+            written.append((message, failed))
+
+    bus = UIEventBus(FakeRoot(), FakeText(), log_file=FakeLogFile())
+    bus.log("成功")
+    bus.log("失败", failed=True)
+    assert written == [("成功", False), ("失败", True)]
@@ -0,0 +1,81 @@
+from tts_engine import SynthesisEngine, count_model_switches, group_jobs, plan_jobs
+from tts_retry import SERVER_ERROR, RetryPolicy, SynthesisError
+from tts_voices import load_character_names, load_voice_map, speaker_of, speakers_in, write_voice_map_template
+
+
+def test_speakers():
+    lines = ["李华: 你好。", "旁白", "王明:嗯。", "李华:再见。", ":没有名字"]
+    assert speaker_of(lines[0]) == "李华"
+    assert speaker_of(lines[1]) == ""
+    assert speakers_in(lines) == ["李华", "王明"]
+
+
+def test_load_voice_map(tmp_path):
+    characters = tmp_path / "characters.txt"
+    characters.write_text("lh = 李华\nwm = 王明\n", encoding='utf-8')
+    path = tmp_path / "voices.txt"
+    path.write_text("# 注释\n\nlh = 模型甲\n王明 =\n旁白 = 模型乙\n没有等号的行\n", encoding='utf-8')
+    # 角色代码和中文名都能匹配，模型名留空的角色不写入
+    assert load_voice_map(str(path), load_character_names(str(characters))) == {
+        "lh": "模型甲", "李华": "模型甲", "旁白": "模型乙"}
+    assert load_voice_map(str(path)) == {"lh": "模型甲", "旁白": "模型乙"}
+
+
+def test_write_voice_map_template_keeps_filled_entries(tmp_path):
+    path = tmp_path / "sub" / "voices.txt"
+    assert write_voice_map_template(str(path), ["李华", "王明"]) == 2
+    path.write_text(path.read_text(encoding='utf-8').replace("李华 = ", "李华 = 模型甲"), encoding='utf-8')
+    assert write_voice_map_template(str(path), ["王明", "旁白"], "默认") == 1
+    assert load_voice_map(str(path)) == {"李华": "模型甲", "旁白": "默认"}
+
+
+def test_plan_jobs_and_grouping(tmp_path):
+    lines = ["甲:一。", "乙:二。", "丙:三。", "甲:四。", "丁:二。"]
+    jobs = plan_jobs(lines, str(tmp_path), "默认", voice_map={"甲": "A", "乙": "B", "丁": "B"})
+    assert [job.model_name for job in jobs] == ["A", "B", "默认", "A", "B"]
+    assert count_model_switches(jobs) == 4
+    # 乙和丁的“二。”模型相同，合成一次；模型按首次出现的顺序分批，同一模型内保持原顺序
+    groups = group_jobs(jobs)
+    assert [[job.text for job in group] for group in groups] == [["一。"], ["四。"], ["二。", "二。"], ["三。"]]
+    assert count_model_switches([group[0] for group in groups]) == 2
+
+
+def test_engine_batches_models(mock_server, tmp_path):
+    server = mock_server()
+    lines = [f"{'甲乙'[i % 2]}:第{i}行。" for i in range(8)]
+    engine = SynthesisEngine(server=server.base_url, concurrency=4)
+    counts = engine.run(plan_jobs(lines, str(tmp_path), voice_map={"甲": "A", "乙": "B"}))
+    assert counts["success"] == 8
+    assert engine.file_order_switches == 7
+    assert engine.model_switches == 1
+    assert server.model_loads == 2
+
+
+class FailOnceEngine(SynthesisEngine):
+    """模型A的第一次请求返回服务器错误，并记录每次请求发出时服务器当前的模型"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent = []
+        self.failed = False
+
+    async def synthesize(self, session, job, backend):
+        self.sent.append((job.model_name, self.current_model))
+        if job.model_name == "A" and not self.failed:
+            self.failed = True
+            raise SynthesisError(SERVER_ERROR, "503")
+        await super().synthesize(session, job, backend)
+
+
+def test_retry_waits_for_model_barrier(mock_server, tmp_path):
+    # A的台词在退避期间，派发已经轮到B并切换了模型；重试必须先切回A
+    server = mock_server(latency=0.2)
+    policy = RetryPolicy(2)
+    policy.delay = lambda attempt: 0.3
+    engine = FailOnceEngine(server=server.base_url, concurrency=2, retry_policy=policy)
+    lines = ["甲:第一行。"] + [f"乙:第{i}行。" for i in range(8)]
+    counts = engine.run(plan_jobs(lines, str(tmp_path), voice_map={"甲": "A", "乙": "B"}))
+    assert counts["success"] == 9
+    assert len(engine.sent) == 10
+    assert all(model_name == current for model_name, current in engine.sent)
+    assert server.model_loads == engine.model_switches + 1
@@ -0,0 +1,214 @@
+import collections
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+# 计算吞吐量的时间窗口（秒）
+RATE_WINDOW = 10.0
+DEFAULT_CHECK_INTERVAL = 5.0
+DEFAULT_FAILURE_THRESHOLD = 3
+
+# 接口风格：infer_single先返回JSON里的audio_url再下载，两次往返；
+# tts（GPT-SoVITS api_v2的/tts）在响应正文中直接返回音频，一次往返
+API_INFER_SINGLE = "infer_single"
+API_TTS = "tts"
+# 地址前加“tts+”表示使用/tts接口
+API_PREFIXES = {"tts+": API_TTS}
+# /tts后端在地址的查询参数里指定的设置及默认值：音色由参考音频决定，ref_audio_path必填
+TTS_OPTIONS = {"ref_audio_path": "", "prompt_text": "", "prompt_lang": "zh", "text_lang": "zh"}
+
+
+def parse_backends(spec):
+    """
+    解析后端列表
+
+    逗号分隔的服务器地址，地址后可以用“*权重”指定权重，地址前加“tts+”表示该服务器用/tts接口直接返回音频。
+    /tts后端（GPT-SoVITS api_v2）按参考音频决定音色，在地址的查询参数中指定TTS_OPTIONS中的设置，如：
+    http://10.0.0.2:8000*2,tts+http://10.0.0.3:9880?ref_audio_path=ref/narrator.wav&prompt_text=参考音频的文本
+    参考音频的路径是服务器上的路径；值里的逗号、“*”、“&”要写成%2C、%2A、%26。
+    """
+    backends = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.partition("*")
+        api = API_INFER_SINGLE
+        for prefix, prefix_api in API_PREFIXES.items():
+            if url.startswith(prefix):
+                url, api = url[len(prefix):], prefix_api
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"无效的权重: {item}")
+        if weight <= 0:
+            raise ValueError(f"权重必须大于0: {item}")
+        url, _, query = url.partition("?")
+        options = dict(parse_qsl(query, keep_blank_values=True))
+        if api == API_TTS:
+            unknown = set(options) - set(TTS_OPTIONS)
+            if unknown:
+                raise ValueError(f"未知的/tts参数{'、'.join(sorted(unknown))}: {item}")
+            options = {**TTS_OPTIONS, **options}
+            if not options["ref_audio_path"]:
+                raise ValueError(f"tts+后端需要用?ref_audio_path=指定参考音频: {item}")
+        elif options:
+            raise ValueError(f"只有tts+后端可以在地址后指定参数: {item}")
+        backends.append(Backend(url, weight, api, options))
+    if not backends:
+        raise ValueError("没有指定TTS服务器")
+    return backends
+
+
+class Backend:
+    """一台TTS服务器及其运行统计"""
+
+    def __init__(self, url, weight=1.0, api=API_INFER_SINGLE, options=None):
+        self.url = url.strip().rstrip("/")
+        self.weight = weight
+        self.api = api
+        # /tts后端的参考音频和语言设置（见TTS_OPTIONS）
+        self.options = options or {}
+        self.healthy = True
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.consecutive_failures = 0
+        self.last_probe = 0.0
+        # 最近一次成功请求的耗时
+        self.latency = None
+        self._recent = collections.deque()
+
+    @property
+    def name(self):
+        return urlsplit(self.url).netloc or self.url
+
+    @property
+    def endpoint(self):
+        """合成请求的地址"""
+        return f"{self.url}/{self.api}"
+
+    def _trim(self, now):
+        while self._recent and now - self._recent[0] > RATE_WINDOW:
+            self._recent.popleft()
+
+    def record_completion(self, latency):
+        self.completed += 1
+        self.latency = latency
+        self._recent.append(time.monotonic())
+
+    def rate(self, now=None):
+        """最近RATE_WINDOW秒内的成功行数/秒"""
+        now = time.monotonic() if now is None else now
+        self._trim(now)
+        return len(self._recent) / RATE_WINDOW
+
+    def __repr__(self):
+        return f"Backend({self.url!r}, weight={self.weight}, api={self.api!r})"
+
+
+class BackendPool:
+    """
+    加权的多后端调度
+
+    每次请求选择健康后端中 在途请求数/权重 最小的一个，相同时选 (已处理数+在途请求数)/权重 最小的。
+    连续failure_threshold次服务器不可用（超时、连接失败、5xx）的后端被摘除；
+    摘除的后端由健康检查重新加入：引擎在事件循环里主动探测（probes_due），
+    没有事件循环的同步调用方用passive_probe=True，每check_interval秒放一个真实请求过去试探。
+    所有后端都被摘除时退回到在全部后端中选择，由熔断器负责暂停。
+    可在多个线程中使用。
+    """
+
+    def __init__(self, backends, failure_threshold=DEFAULT_FAILURE_THRESHOLD, check_interval=DEFAULT_CHECK_INTERVAL,
+                 passive_probe=False, on_change=None):
+        self.backends = list(backends)
+        self.failure_threshold = failure_threshold
+        self.check_interval = check_interval
+        self.passive_probe = passive_probe
+        self.on_change = on_change
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.backends)
+
+    def pick(self):
+        """选择一个后端并计入在途，用完必须调用release()"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [backend for backend in self.backends if backend.healthy]
+            if self.passive_probe:
+                for backend in self.backends:
+                    if not backend.healthy and now - backend.last_probe >= self.check_interval:
+                        backend.last_probe = now
+                        candidates = [backend]
+                        break
+            if not candidates:
+                candidates = self.backends
+            # 在途数/权重相同时（如一次只有一个请求，在途数都是0）按分到的总数/权重轮转，低并发时也能按权重分摊
+            backend = min(candidates, key=lambda candidate: (
+                candidate.in_flight / candidate.weight,
+                (candidate.completed + candidate.failed + candidate.in_flight) / candidate.weight))
+            backend.in_flight += 1
+        return backend
+
+    def release(self, backend, latency, error=None):
+        """请求结束，error为SynthesisError或None"""
+        changed = None
+        with self._lock:
+            backend.in_flight -= 1
+            if error is None:
+                backend.record_completion(latency)
+            else:
+                backend.failed += 1
+            if error is None or not error.backend_down:
+                backend.consecutive_failures = 0
+                if not backend.healthy:
+                    backend.healthy = True
+                    changed = True
+            else:
+                backend.consecutive_failures += 1
+                if backend.healthy and backend.consecutive_failures >= self.failure_threshold:
+                    backend.healthy = False
+                    backend.last_probe = time.monotonic()
+                    changed = False
+        if changed is not None and self.on_change:
+            self.on_change(backend, changed)
+
+    def abandon(self, backend):
+        """请求被取消，只减少在途数，不计成功或失败"""
+        with self._lock:
+            backend.in_flight -= 1
+
+    def set_health(self, backend, healthy):
+        """健康检查的结果"""
+        with self._lock:
+            backend.last_probe = time.monotonic()
+            if backend.healthy == healthy:
+                return
+            backend.healthy = healthy
+            backend.consecutive_failures = 0
+        if self.on_change:
+            self.on_change(backend, healthy)
+
+    def probes_due(self):
+        """需要主动探测的后端：已摘除的，以及空闲中的（忙碌的后端由真实请求证明可用）"""
+        now = time.monotonic()
+        with self._lock:
+            return [backend for backend in self.backends if now - backend.last_probe >= self.check_interval
+                    and (not backend.healthy or not backend.in_flight)]
+
+    @property
+    def healthy_count(self):
+        return sum(1 for backend in self.backends if backend.healthy)
+
+    def summary(self):
+        """每个后端一段的状态文字，用于界面和日志"""
+        now = time.monotonic()
+        parts = []
+        for backend in self.backends:
+            if backend.healthy:
+                parts.append(f"{backend.name} {backend.rate(now):.1f}行/秒 "
+                             f"在途{backend.in_flight} 完成{backend.completed}")
+            else:
+                parts.append(f"{backend.name} 离线 完成{backend.completed}")
+        return "  |  ".join(parts)
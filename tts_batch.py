@@ -0,0 +1,338 @@
+"""
+无界面批量合成
+
+用法：python tts_batch.py dialogue.txt 对话目录/ -o voice/ --concurrency 16
+输入可以是对话文件（每行“角色:台词”）或目录（合成其中所有.txt文件），
+所有音频按SHA1文件名写到同一个输出目录，与renpyVoicePath.rpy一致。
+进度默认以JSON Lines写到标准输出，每行一个事件，最后一行是summary。
+不导入tkinter和GUI模块，重依赖（aiohttp、requests）在解析完参数后才导入。
+
+退出码：
+    0   全部成功（或已存在被跳过）
+    1   有台词合成失败
+    2   参数错误
+    3   输入文件不存在或无法读取，或输出目录无法写入（如正被另一个任务使用）
+    4   全部失败，且原因都是服务器不可用
+    130 被Ctrl+C或SIGTERM中断
+"""
+import argparse
+import json
+import os
+import signal
+import sqlite3
+import sys
+import time
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INPUT_ERROR = 3
+EXIT_BACKEND_DOWN = 4
+EXIT_INTERRUPTED = 130
+
+# 服务器持续不可用多少秒后放弃
+DEFAULT_MAX_OUTAGE = 300.0
+
+
+class InputError(Exception):
+    """输入文件不存在或无法读取"""
+
+
+def collect_inputs(paths):
+    """展开输入参数：文件原样保留，目录按文件名顺序取其中（含子目录）所有.txt文件"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(".txt"))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            raise InputError(f"输入不存在: {path}")
+    if not files:
+        raise InputError("没有找到任何对话文件")
+    return files
+
+
+def load_voice_map_file(path, characters_path=None):
+    """读取角色模型映射，characters_path为角色定义文件（角色代码 = 中文名），用于解析写成角色代码的角色"""
+    from tts_voices import load_character_names, load_voice_map
+
+    try:
+        translation_dict = load_character_names(characters_path) if characters_path else None
+        return load_voice_map(path, translation_dict)
+    except (OSError, UnicodeDecodeError) as e:
+        raise InputError(f"无法读取角色模型映射: {e}")
+
+
+def load_jobs(files, output_dir, model_name, speed_factor, voice_map=None):
+    """读取所有输入文件并生成合成任务"""
+    from tts_engine import plan_jobs
+
+    jobs = []
+    for path in files:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except (OSError, UnicodeDecodeError) as e:
+            raise InputError(f"无法读取 {path}: {e}")
+        jobs.extend(plan_jobs(lines, output_dir, model_name, speed_factor, source=path, voice_map=voice_map))
+    return jobs
+
+
+class JsonLinesReporter:
+    """把引擎事件逐行输出为JSON"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.engine = None
+        self.total = 0
+
+    def write(self, record):
+        self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.stream.flush()
+
+    def __call__(self, event, job, detail):
+        record = {"event": event, "time": round(time.time(), 3)}
+        if event == "planned":
+            self.total = detail
+            record["jobs"] = detail
+        elif event == "concurrency":
+            record["limit"] = detail
+        elif event == "circuit":
+            record["state"] = detail
+        elif event == "model":
+            record["model"] = detail
+        if job is not None:
+            record.update(source=job.source, line=job.index + 1, file=job.filename)
+        if event in ("success", "skipped") and detail:
+            record["via"] = detail
+        elif event in ("failed", "retry"):
+            record.update(reason=detail.reason, error=str(detail), attempts=job.attempts)
+        if event in ("success", "failed", "skipped"):
+            if job.latency is not None:
+                record["latency"] = round(job.latency, 3)
+            if event == "success" and not detail and job.ttfb is not None:
+                record["ttfb"] = round(job.ttfb, 3)
+            record.update(done=self.engine.processed, total=self.total)
+            eta = self.engine.eta()
+            if eta is not None:
+                record["eta"] = round(eta, 1)
+        self.write(record)
+
+    def summary(self, record):
+        self.write(dict(record, event="summary"))
+
+
+class TextReporter:
+    """给人看的输出：只打印失败和最后的汇总"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.engine = None
+
+    def __call__(self, event, job, detail):
+        if event == "failed":
+            print(f"失败: {job.source}:{job.index + 1} {job.filename} ({detail})", file=self.stream, flush=True)
+        elif event == "circuit" and detail == "open":
+            print("服务器连续不可用，暂停派发", file=self.stream, flush=True)
+
+    def summary(self, record):
+        from tts_retry import REASON_LABELS
+        from tts_stats import format_bytes
+
+        counts = record["counts"]
+        print(f"成功: {counts['success']}  失败: {counts['failed']}  跳过: {counts['skipped']}  "
+              f"总计: {record['jobs']}  耗时: {record['elapsed']:.1f}s", file=self.stream)
+        if record["cache_hits"]:
+            print(f"缓存命中: {record['cache_hits']}", file=self.stream)
+        if record["latency_p50"] is not None:
+            print(f"服务器请求: {record['requests']} 次  已下载: {format_bytes(record['bytes'])}  "
+                  f"请求耗时: p50 {record['latency_p50']:.2f}s  p95 {record['latency_p95']:.2f}s  "
+                  f"p99 {record['latency_p99']:.2f}s", file=self.stream)
+        print(f"重复合并: {record['duplicates']} 行，节省服务器请求: {record['calls_saved']}", file=self.stream)
+        if record["ttfb_p50"] is not None:
+            print(f"首字节时间: p50 {record['ttfb_p50']:.2f}s  p95 {record['ttfb_p95']:.2f}s  "
+                  f"流式请求: {record['streamed']}", file=self.stream)
+        if record["split_lines"]:
+            print(f"拆分合成: {record['split_lines']} 行，共 {record['split_pieces']} 段", file=self.stream)
+        if record["packed_lines"] or record["pack_fallbacks"]:
+            print(f"合并合成: {record['packed_lines']} 行，共 {record['packed_requests']} 次请求，"
+                  f"退回逐行 {record['pack_fallbacks']} 次", file=self.stream)
+        if record["models"] > 1:
+            print(f"模型: {record['models']} 个，切换 {record['model_switches']} 次"
+                  f"（按文件顺序需切换 {record['file_order_switches']} 次）", file=self.stream)
+        if record["failure_reasons"]:
+            reasons = "，".join(f"{REASON_LABELS.get(reason, reason)}×{count}"
+                               for reason, count in record["failure_reasons"].items())
+            print(f"失败原因: {reasons}  重试次数: {record['retries']}", file=self.stream)
+        if record["interrupted"]:
+            print("已中断，下次运行会从日志处继续", file=self.stream)
+        self.stream.flush()
+
+
+def exit_code(engine, interrupted):
+    """根据运行结果计算退出码"""
+    from tts_retry import BACKEND_DOWN_REASONS
+
+    if interrupted:
+        return EXIT_INTERRUPTED
+    failed = engine.counts["failed"]
+    if not failed:
+        return EXIT_OK
+    if engine.counts["success"] == 0 and set(engine.failure_reasons) <= BACKEND_DOWN_REASONS:
+        return EXIT_BACKEND_DOWN
+    return EXIT_FAILED
+
+
+def run_batch(files, output_dir, reporter, model_name=None, speed_factor=1.0, server=None, concurrency=None,
+              adaptive=False, cache=None, only_failed=False, max_outage=DEFAULT_MAX_OUTAGE, voice_map=None,
+              stall_timeout=None, split_chars=0, pack_lines=0, rate_limit=0.0, burst=None, metrics_port=0,
+              metrics_host="127.0.0.1"):
+    """
+    合成files中的所有台词，返回退出码
+
+    SIGINT/SIGTERM时停止派发并等在途请求结束；再按一次中止在途请求（写了一半的文件随之删除，
+    这些行下次运行时重新合成），通常不到一秒即可退出。
+    服务器持续不可用超过max_outage秒后剩余台词直接记为失败，运行随之结束。
+    voice_map（角色名→模型名）中的角色使用各自的模型，其余使用model_name。
+    接收音频时连续stall_timeout秒没有数据的请求会被中止并重新排队。
+    split_chars>0时超过这么多字的台词拆成几段并行合成后拼接；pack_lines>1时每这么多行短台词合并成一次请求。
+    rate_limit>0时每秒最多发出这么多个请求（含重试），可突发burst个。
+    metrics_port不为0时运行期间在metrics_host:metrics_port上提供Prometheus格式的/metrics。
+    """
+    from tts_client import DEFAULT_MODEL, DEFAULT_SERVER
+    from tts_concurrency import percentile
+    from tts_engine import DEFAULT_CONCURRENCY, DEFAULT_STALL_TIMEOUT, SynthesisEngine
+    from tts_retry import CircuitBreaker
+    from tts_schedule import DEFAULT_TIMINGS_PATH, DurationModel
+
+    jobs = load_jobs(files, output_dir, model_name or DEFAULT_MODEL, speed_factor, voice_map)
+    engine = SynthesisEngine(server=server or DEFAULT_SERVER, concurrency=concurrency or DEFAULT_CONCURRENCY,
+                             on_event=reporter, adaptive=adaptive, cache=cache,
+                             circuit_breaker=CircuitBreaker(max_outage=max_outage),
+                             stall_timeout=stall_timeout or DEFAULT_STALL_TIMEOUT, split_chars=split_chars,
+                             pack_lines=pack_lines, durations=DurationModel(DEFAULT_TIMINGS_PATH),
+                             rate_limit=rate_limit, burst=burst, metrics_port=metrics_port, metrics_host=metrics_host)
+    reporter.engine = engine
+    interrupted = []
+
+    def on_signal(signum, frame):
+        interrupted.append(signum)
+        # 第二次中断不再等待在途请求
+        engine.stop(cancel=len(interrupted) > 1)
+
+    previous = {sig: signal.signal(sig, on_signal) for sig in (signal.SIGINT, signal.SIGTERM)}
+    start = time.perf_counter()
+    try:
+        counts = engine.run(jobs, only_failed)
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+
+    code = exit_code(engine, bool(interrupted))
+    stats = engine.stats.snapshot()
+    latency = stats.latency("request") or {}
+    reporter.summary({
+        "counts": dict(counts),
+        "jobs": engine.planned,
+        "files": len(files),
+        "elapsed": round(time.perf_counter() - start, 3),
+        "retries": stats["retries"],
+        "cache_hits": stats["cache_hits"],
+        "requests": sum(stats.labelled("requests").values()),
+        "bytes": stats["bytes"],
+        "latency_p50": round(latency[50], 3) if latency else None,
+        "latency_p95": round(latency[95], 3) if latency else None,
+        "latency_p99": round(latency[99], 3) if latency else None,
+        "duplicates": engine.duplicates,
+        "calls_saved": engine.calls_saved,
+        "ttfb_p50": round(percentile(engine.ttfbs, 50), 3) if engine.ttfbs else None,
+        "ttfb_p95": round(percentile(engine.ttfbs, 95), 3) if engine.ttfbs else None,
+        "streamed": engine.streamed,
+        "split_lines": engine.split_lines,
+        "split_pieces": engine.split_pieces,
+        "packed_lines": engine.packed_lines,
+        "packed_requests": engine.packed_requests,
+        "pack_fallbacks": engine.pack_fallbacks,
+        "models": engine.models,
+        "model_switches": engine.model_switches,
+        "file_order_switches": engine.file_order_switches,
+        "failure_reasons": dict(engine.failure_reasons.most_common()),
+        "interrupted": bool(interrupted),
+        "exit_code": code,
+    })
+    return code
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='无界面批量语音合成')
+    parser.add_argument('inputs', nargs='+', help='对话文件或目录（目录下所有.txt文件），每行“角色:台词”')
+    parser.add_argument('-o', '--output', required=True, help='输出目录')
+    parser.add_argument('--model', default=None, help='模型名称')
+    parser.add_argument('--speed', type=float, default=1.0, help='语速因子')
+    parser.add_argument('--voice-map', default=None, help='角色模型映射文件，每行“角色 = 模型名”，未列出的角色用--model')
+    parser.add_argument('--characters', default=None, help='角色定义文件（角色代码 = 中文名），映射中写角色代码时需要')
+    parser.add_argument('--server', default=None,
+                        help='TTS服务器地址，默认http://127.0.0.1:8000；多台用逗号分隔，可写成“地址*权重”，'
+                             '地址前加tts+表示用直接返回音频的/tts接口，参考音频写在地址后，如'
+                             'tts+http://host:9880?ref_audio_path=ref.wav&prompt_text=参考文本')
+    parser.add_argument('--concurrency', type=int, default=16, help='最大并发请求数')
+    parser.add_argument('--adaptive', action='store_true', help='按服务器延迟自动调整并发数，--concurrency为上限')
+    parser.add_argument('--max-outage', type=float, default=DEFAULT_MAX_OUTAGE,
+                        help='服务器持续不可用超过多少秒后放弃剩余台词')
+    parser.add_argument('--stall-timeout', type=float, default=None,
+                        help='接收音频时连续多少秒没有数据就中止并重新排队，默认30')
+    parser.add_argument('--split-chars', type=int, default=0,
+                        help='超过这么多字的台词按标点拆开并行合成再拼接（需要numpy），0为不拆分')
+    parser.add_argument('--pack-lines', type=int, default=0,
+                        help='把相邻的同模型短台词每这么多行合并成一次请求，按静音切回各行（需要numpy），0为不合并')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='每秒最多发出的请求数（含重试），0为不限速')
+    parser.add_argument('--burst', type=int, default=None, help='限速时允许的突发请求数，默认为1秒的量')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='运行期间在这个端口上提供Prometheus格式的/metrics，0为不提供')
+    parser.add_argument('--metrics-host', default='127.0.0.1', help='/metrics监听的地址，供其他机器抓取时设为0.0.0.0')
+    parser.add_argument('--only-failed', action='store_true', help='只重跑输出目录日志中上次失败的行')
+    parser.add_argument('--cache-dir', default=None, help='合成缓存目录，默认在用户目录下')
+    parser.add_argument('--cache-size', type=float, default=2.0, help='合成缓存上限（GB）')
+    parser.add_argument('--no-cache', action='store_true', help='不使用合成缓存')
+    parser.add_argument('--format', choices=['jsonl', 'text'], default='jsonl',
+                        help='进度输出格式：jsonl每个事件一行JSON，text只输出失败和汇总')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.concurrency < 1:
+        print("--concurrency必须大于0", file=sys.stderr)
+        return EXIT_USAGE
+
+    reporter = JsonLinesReporter() if args.format == 'jsonl' else TextReporter()
+    try:
+        files = collect_inputs(args.inputs)
+        voice_map = load_voice_map_file(args.voice_map, args.characters) if args.voice_map else None
+        cache = None
+        if not args.no_cache:
+            from tts_cache import DEFAULT_CACHE_DIR, SynthesisCache
+            cache = SynthesisCache(args.cache_dir or DEFAULT_CACHE_DIR, int(args.cache_size * 1024 ** 3))
+        return run_batch(files, args.output, reporter, args.model, args.speed, args.server, args.concurrency,
+                         args.adaptive, cache, args.only_failed, args.max_outage, voice_map,
+                         args.stall_timeout, args.split_chars, args.pack_lines, args.rate_limit, args.burst,
+                         args.metrics_port, args.metrics_host)
+    except InputError as e:
+        print(str(e), file=sys.stderr)
+        return EXIT_INPUT_ERROR
+    except ValueError as e:
+        # --server写错或--metrics-port被占用
+        print(str(e), file=sys.stderr)
+        return EXIT_USAGE
+    except (OSError, sqlite3.Error) as e:
+        print(f"输出目录不可用: {e}", file=sys.stderr)
+        return EXIT_INPUT_ERROR
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,459 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from tts_client import TTSGenerator, build_payload
+from tts_concurrency import percentile
+from tts_engine import SynthesisEngine, plan_jobs
+from tts_mock_server import MockTTSServer
+
+
+def legacy_generate_tts(server_url, text, output_path, timeout=60):
+    """改造前的写法：每次调用都用模块级requests新建连接"""
+    import requests
+    data = build_payload(text, dl_url=server_url)
+    response = requests.post(server_url + "/infer_single", json=data, timeout=timeout)
+    if response.status_code != 200 or response.json().get("msg") != "合成成功":
+        return False
+    audio_response = requests.get(response.json()["audio_url"], timeout=timeout)
+    if audio_response.status_code != 200:
+        return False
+    with open(output_path, 'wb') as f:
+        f.write(audio_response.content)
+    return True
+
+
+def run_threads(func, lines, thread_count):
+    """用thread_count个线程跑完所有行，返回(耗时, 成功数)"""
+    index = {"next": 0, "ok": 0}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = index["next"]
+                index["next"] += 1
+            if i >= len(lines):
+                return
+            if func(i, lines[i]):
+                with lock:
+                    index["ok"] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, index["ok"]
+
+
+def bench_session_pool(line_count=400, thread_count=4, latency=0.0):
+    """对比模块级requests与共享连接池的吞吐量"""
+    server = MockTTSServer(latency=latency, seconds_per_char=0.01).start_background()
+    lines = [f"测试台词{i}，这是一句用于压测的对话。" for i in range(line_count)]
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            def before(i, text):
+                return legacy_generate_tts(server.base_url, text, os.path.join(output_dir, f"a{i}.wav"))
+
+            connections = server.connection_count
+            elapsed, ok = run_threads(before, lines, thread_count)
+            results["before"] = (elapsed, ok, server.connection_count - connections)
+
+            generator = TTSGenerator(server=server.base_url, pool_size=thread_count)
+
+            def after(i, text):
+                return generator.generate_tts(text, os.path.join(output_dir, f"b{i}.wav"))
+
+            connections = server.connection_count
+            elapsed, ok = run_threads(after, lines, thread_count)
+            results["after"] = (elapsed, ok, server.connection_count - connections)
+            generator.session_pool.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def run_engine(server, lines, output_dir, concurrency, adaptive=False, use_tts=False, split_chars=0, pack_lines=0,
+               longest_first=True):
+    """
+    用合成引擎跑完lines（不使用缓存），返回(耗时, 成功数, 各行延迟, 最终并发数)
+
+    use_tts=True时使用/tts接口（server.tts_url），split_chars>0时拆分长台词，pack_lines>1时合并短台词，
+    longest_first=False时按文件顺序派发。
+    """
+    started = {}
+    latencies = []
+
+    def on_event(event, job, detail):
+        if event == "start":
+            started[job.index] = time.perf_counter()
+        elif event in ("success", "failed"):
+            latencies.append(time.perf_counter() - started.pop(job.index))
+
+    engine = SynthesisEngine(server=server.tts_url if use_tts else server.base_url, concurrency=concurrency,
+                             on_event=on_event, adaptive=adaptive, split_chars=split_chars, pack_lines=pack_lines,
+                             longest_first=longest_first)
+    jobs = plan_jobs(lines, output_dir)
+    start = time.perf_counter()
+    counts = engine.run(jobs)
+    return time.perf_counter() - start, counts["success"], latencies, engine.concurrency_limit
+
+
+def bench_adaptive(line_count=600, max_concurrency=64, latency=0.1, capacity=8, overload=1.5):
+    """对比固定并发与自适应并发：服务器超过capacity个并发后按overload降速"""
+    server = MockTTSServer(latency=latency, seconds_per_char=0.01, capacity=capacity,
+                           overload=overload).start_background()
+    results = {}
+    try:
+        for name, concurrency, adaptive in [("固定2", 2, False), (f"固定{capacity}", capacity, False),
+                                            (f"固定{max_concurrency}", max_concurrency, False),
+                                            ("自适应", max_concurrency, True)]:
+            lines = [f"{name}台词{i}，这是一句用于压测的对话。" for i in range(line_count)]
+            with tempfile.TemporaryDirectory() as output_dir:
+                results[name] = run_engine(server, lines, output_dir, concurrency, adaptive)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def bench_api(line_count=400, concurrency=4, latency=0.02, rtt=0.005, distributions=("short", "mixed")):
+    """
+    对比两种接口：/infer_single（POST后再GET audio_url）与/tts（POST直接返回音频）
+
+    rtt模拟每个HTTP请求的网络往返，短台词的合成时间短，第二次往返占比更大。
+    """
+    server = MockTTSServer(latency=latency, latency_per_char=0.001, rtt=rtt).start_background()
+    results = {}
+    try:
+        for distribution in distributions:
+            lines = make_lines(line_count, distribution)
+            for name, use_tts in (("infer_single", False), ("tts", True)):
+                with tempfile.TemporaryDirectory() as output_dir:
+                    elapsed, ok, latencies, _ = run_engine(server, lines, output_dir, concurrency, use_tts=use_tts)
+                results[(distribution, name)] = (elapsed, ok, latencies)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def bench_split(line_count=200, concurrency=16, latency=0.05, long_lines=4, split_chars=40):
+    """
+    对比长台词拆分前后的完成时间（makespan）
+
+    line_count条短台词之后跟long_lines条长旁白，模拟长台词排在队尾、其他并发名额空闲的情况。
+    两种模式都按文件顺序派发（不用LPT，否则长台词一开始就派发，不会排在队尾）；
+    concurrency要明显大于long_lines，拆出的各段才有空闲的名额可用，否则拆分只多出拼接的开销。
+    """
+    server = MockTTSServer(latency=latency, latency_per_char=0.01).start_background()
+    narration = "这是一段很长的旁白，讲述了很多发生过的故事。" * 12
+    lines = [f"角色{i % 7}:第{i}句短台词。" for i in range(line_count)]
+    lines += [f"旁白:{i}{narration}" for i in range(long_lines)]
+    results = {}
+    try:
+        for name, chars in (("不拆分", 0), (f"拆分>{split_chars}字", split_chars)):
+            with tempfile.TemporaryDirectory() as output_dir:
+                results[name] = run_engine(server, lines, output_dir, concurrency, split_chars=chars,
+                                           longest_first=False)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def bench_lpt(line_count=200, concurrency=8, latency=0.05, long_lines=6):
+    """
+    对比按文件顺序派发与按预测耗时从长到短派发（LPT）的完成时间
+
+    台词长短混合，几条长旁白排在文件末尾；两种模式都不拆分长台词。
+    """
+    server = MockTTSServer(latency=latency, latency_per_char=0.01).start_background()
+    narration = "这是一段很长的旁白，讲述了很多发生过的故事。" * 20
+    lines = make_lines(line_count, "mixed") + [f"旁白:{i}{narration}" for i in range(long_lines)]
+    results = {}
+    try:
+        for name, longest_first in (("文件顺序", False), ("LPT", True)):
+            with tempfile.TemporaryDirectory() as output_dir:
+                results[name] = run_engine(server, lines, output_dir, concurrency, longest_first=longest_first)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+SHORT_REPLIES = ["嗯", "好的", "是吗", "知道了", "走吧", "谢谢", "没关系", "等一下"]
+
+
+def bench_pack(line_count=400, concurrency=4, latency=0.05, pack_lines=10):
+    """
+    对比逐行请求与合并短台词：每次请求有固定的latency开销，短台词的合成时间几乎全是这部分开销
+
+    返回{模式: (耗时, 成功数, 各行延迟, 服务器请求数)}。
+    """
+    server = MockTTSServer(latency=latency, latency_per_char=0.001).start_background()
+    lines = [f"角色{i % 7}:{random.Random(i).choice(SHORT_REPLIES)}{i}。" for i in range(line_count)]
+    results = {}
+    try:
+        for name, pack in (("逐行", 0), (f"每{pack_lines}行合并", pack_lines)):
+            infer_before = server.infer_count
+            with tempfile.TemporaryDirectory() as output_dir:
+                elapsed, ok, latencies, _ = run_engine(server, lines, output_dir, concurrency, pack_lines=pack)
+            results[name] = (elapsed, ok, latencies, server.infer_count - infer_before)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+# 台词长度分布：(最短字数, 最长字数, 权重)
+LENGTH_DISTRIBUTIONS = {
+    "short": [(1, 6, 1.0)],
+    "mixed": [(1, 6, 0.4), (7, 30, 0.45), (31, 120, 0.15)],
+    "long": [(60, 200, 1.0)],
+}
+FILLER = "这是一句用于压测的对话内容我们来看看合成速度到底怎么样"
+
+
+def make_lines(count, distribution, seed=0):
+    """按长度分布生成count行互不相同的台词，seed相同则结果相同"""
+    rng = random.Random(seed)
+    buckets = LENGTH_DISTRIBUTIONS[distribution]
+    lines = []
+    for i in range(count):
+        low, high, _ = rng.choices(buckets, weights=[bucket[2] for bucket in buckets])[0]
+        length = rng.randint(low, high)
+        body = (FILLER * (length // len(FILLER) + 1))[:length]
+        lines.append(f"角色{i % 7}:{i}{body}")
+    return lines
+
+
+def output_bytes(output_dir):
+    return sum(entry.stat().st_size for entry in os.scandir(output_dir) if entry.name.endswith(".wav"))
+
+
+def bench_suite(concurrencies=(1, 4, 16, 64), distributions=("short", "mixed", "long"), audio_sizes=(0.02, 0.1),
+                line_count=300, latency=0.02, latency_per_char=0.001, repeat=3):
+    """
+    端到端吞吐量测试：在模拟服务器上扫描并发数、台词长度分布和音频大小
+
+    每个组合跑repeat次取中位数，包括排队、计算SHA1/synthesis key、日志和写文件在内的完整流程。
+    audio_sizes为每个字对应的音频秒数，决定下载量。
+    """
+    server = MockTTSServer(latency=latency, latency_per_char=latency_per_char).start_background()
+    results = []
+    try:
+        for seconds_per_char in audio_sizes:
+            server.seconds_per_char = seconds_per_char
+            for distribution in distributions:
+                lines = make_lines(line_count, distribution)
+                for concurrency in concurrencies:
+                    runs = []
+                    for _ in range(repeat):
+                        with tempfile.TemporaryDirectory() as output_dir:
+                            elapsed, ok, latencies, _ = run_engine(server, lines, output_dir, concurrency)
+                            runs.append((elapsed, ok, latencies, output_bytes(output_dir)))
+                    elapsed, ok, latencies, size = sorted(runs, key=lambda run: run[0])[len(runs) // 2]
+                    results.append({
+                        "case": f"c{concurrency}-{distribution}-a{seconds_per_char:g}",
+                        "concurrency": concurrency,
+                        "distribution": distribution,
+                        "seconds_per_char": seconds_per_char,
+                        "lines": line_count,
+                        "success": ok,
+                        "elapsed": round(elapsed, 4),
+                        "lines_per_sec": round(ok / elapsed, 2),
+                        "mb_per_sec": round(size / elapsed / 1024 ** 2, 3),
+                        "p50": round(percentile(latencies, 50), 4),
+                        "p95": round(percentile(latencies, 95), 4),
+                        "p99": round(percentile(latencies, 99), 4),
+                        "spread": round(statistics.pstdev(run[0] for run in runs) / elapsed, 3),
+                    })
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def suite_report(results, params):
+    """带运行环境信息的JSON报告"""
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+
+
+def compare_baseline(results, baseline, tolerance=0.1):
+    """
+    与基线报告对比，返回回归列表[(case, 基线行/秒, 当前行/秒, 变化比例)]
+
+    行/秒下降超过tolerance视为回归；基线中没有的组合跳过。
+    """
+    previous = {result["case"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        old = previous.get(result["case"])
+        if not old or not old["lines_per_sec"]:
+            continue
+        change = result["lines_per_sec"] / old["lines_per_sec"] - 1
+        if change < -tolerance:
+            regressions.append((result["case"], old["lines_per_sec"], result["lines_per_sec"], change))
+    return regressions
+
+
+def print_suite_table(results, baseline=None):
+    previous = {result["case"]: result for result in (baseline or {}).get("results", [])}
+    print(f"{'组合':<22}{'行/秒':>10}{'MB/秒':>10}{'p50(s)':>10}{'p95(s)':>10}{'p99(s)':>10}{'波动':>8}{'对比基线':>10}")
+    for result in results:
+        old = previous.get(result["case"])
+        change = f"{result['lines_per_sec'] / old['lines_per_sec'] - 1:+.1%}" if old and old["lines_per_sec"] else "-"
+        print(f"{result['case']:<22}{result['lines_per_sec']:>10.1f}{result['mb_per_sec']:>10.2f}"
+              f"{result['p50']:>10.3f}{result['p95']:>10.3f}{result['p99']:>10.3f}{result['spread']:>8.1%}{change:>10}")
+
+
+def run_suite(args):
+    """运行suite场景，返回退出码：有回归时为1"""
+    params = {
+        "concurrency": [int(value) for value in args.concurrency_list.split(",")],
+        "distributions": args.distributions.split(","),
+        "audio_sizes": [float(value) for value in args.audio_sizes.split(",")],
+        "lines": args.lines,
+        "latency": args.latency,
+        "latency_per_char": args.latency_per_char,
+        "repeat": args.repeat,
+    }
+    results = bench_suite(params["concurrency"], params["distributions"], params["audio_sizes"], args.lines,
+                          args.latency, args.latency_per_char, args.repeat)
+    report = suite_report(results, params)
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_suite_table(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到: {args.save_baseline}")
+
+    if baseline is None:
+        return 0
+    regressions = compare_baseline(results, baseline, args.tolerance)
+    for case, old, new, change in regressions:
+        print(f"回归: {case} {old:.1f} -> {new:.1f} 行/秒 ({change:+.1%})")
+    if not regressions:
+        print(f"与基线相比没有超过{args.tolerance:.0%}的下降")
+    return 1 if regressions else 0
+
+
+DEFAULT_THREADS = 4
+# split要有比长台词条数多得多的并发名额，拆出的各段才能并行
+SPLIT_THREADS = 16
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TTS客户端性能测试')
+    parser.add_argument('scenario', nargs='?', default='pool', choices=['pool', 'adaptive', 'suite', 'api', 'split',
+                                                                      'pack', 'lpt'],
+                        help='pool: 连接池前后对比；adaptive: 固定并发与自适应并发对比；suite: 端到端吞吐量扫描；'
+                             'api: /infer_single与/tts接口对比；split: 长台词拆分前后的完成时间对比；'
+                             'pack: 逐行请求与合并短台词对比；lpt: 文件顺序与最长优先派发的完成时间对比')
+    parser.add_argument('--lines', type=int, default=400, help='合成行数')
+    parser.add_argument('--threads', type=int, default=None,
+                        help=f'线程数，默认split为{SPLIT_THREADS}，其他为{DEFAULT_THREADS}')
+    parser.add_argument('--latency', type=float, default=0.0, help='模拟服务器的合成延迟（秒）')
+    parser.add_argument('--capacity', type=int, default=8, help='模拟服务器不降速的最大并发数')
+    parser.add_argument('--overload', type=float, default=1.5, help='模拟服务器超出capacity后的降速系数')
+    parser.add_argument('--max-concurrency', type=int, default=64, help='自适应并发的上限')
+    parser.add_argument('--concurrency-list', default='1,4,16,64', help='suite: 要扫描的并发数，逗号分隔')
+    parser.add_argument('--distributions', default='short,mixed,long',
+                        help=f'suite: 台词长度分布，逗号分隔，可选: {",".join(LENGTH_DISTRIBUTIONS)}')
+    parser.add_argument('--audio-sizes', default='0.02,0.1', help='suite: 每个字对应的音频秒数，逗号分隔')
+    parser.add_argument('--latency-per-char', type=float, default=0.001, help='suite: 每个字增加的合成延迟（秒）')
+    parser.add_argument('--repeat', type=int, default=3, help='suite: 每个组合重复次数，取中位数')
+    parser.add_argument('--json', default=None, help='suite: JSON报告输出路径')
+    parser.add_argument('--baseline', default=None, help='suite: 基线报告路径，行/秒下降超过容差时退出码为1')
+    parser.add_argument('--save-baseline', default=None, help='suite: 把本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='suite: 允许的行/秒下降比例')
+    parser.add_argument('--rtt', type=float, default=0.005, help='api: 模拟的网络往返延迟（秒）')
+    parser.add_argument('--split-chars', type=int, default=40, help='split: 超过这么多字的台词拆分')
+    parser.add_argument('--pack-lines', type=int, default=10, help='pack: 每次请求合并的行数')
+
+    args = parser.parse_args()
+    if args.threads is None:
+        args.threads = SPLIT_THREADS if args.scenario == 'split' else DEFAULT_THREADS
+
+    if args.scenario == 'suite':
+        if args.latency == 0.0:
+            args.latency = 0.02
+        sys.exit(run_suite(args))
+
+    if args.scenario == 'api':
+        results = bench_api(args.lines, args.threads, args.latency or 0.02, args.rtt)
+        print(f"{'分布':<8}{'接口':<14}{'耗时(s)':>10}{'行/秒':>10}{'p50(s)':>10}{'p95(s)':>10}{'p50节省':>10}")
+        for (distribution, name), (elapsed, ok, latencies) in results.items():
+            saving = "-"
+            if name == "tts":
+                before = percentile(results[(distribution, "infer_single")][2], 50)
+                saving = f"{1 - percentile(latencies, 50) / before:.1%}"
+            print(f"{distribution:<8}{name:<14}{elapsed:>10.2f}{ok / elapsed:>10.1f}{percentile(latencies, 50):>10.3f}"
+                  f"{percentile(latencies, 95):>10.3f}{saving:>10}")
+        return
+
+    if args.scenario in ('split', 'lpt'):
+        if args.scenario == 'split':
+            results = bench_split(args.lines, args.threads, args.latency or 0.05, split_chars=args.split_chars)
+        else:
+            results = bench_lpt(args.lines, args.threads, args.latency or 0.05)
+        baseline = None
+        print(f"{'模式':<12}{'完成时间(s)':>12}{'行/秒':>10}{'p95(s)':>10}{'缩短':>10}")
+        for name, (elapsed, ok, latencies, _) in results.items():
+            baseline = baseline or elapsed
+            print(f"{name:<12}{elapsed:>12.2f}{ok / elapsed:>10.1f}{percentile(latencies, 95):>10.3f}"
+                  f"{1 - elapsed / baseline:>10.1%}")
+        return
+
+    if args.scenario == 'pack':
+        results = bench_pack(args.lines, args.threads, args.latency or 0.05, args.pack_lines)
+        baseline = None
+        print(f"{'模式':<12}{'耗时(s)':>10}{'行/秒':>10}{'p50(s)':>10}{'服务器请求':>12}{'缩短':>10}")
+        for name, (elapsed, ok, latencies, requests) in results.items():
+            baseline = baseline or elapsed
+            print(f"{name:<12}{elapsed:>10.2f}{ok / elapsed:>10.1f}{percentile(latencies, 50):>10.3f}{requests:>12}"
+                  f"{1 - elapsed / baseline:>10.1%}")
+        return
+
+    if args.scenario == 'adaptive':
+        results = bench_adaptive(args.lines, args.max_concurrency, args.latency or 0.1, args.capacity, args.overload)
+        print(f"{'模式':<10}{'耗时(s)':>10}{'行/秒':>10}{'p50(s)':>10}{'p95(s)':>10}{'最终并发':>10}")
+        for name, (elapsed, ok, latencies, limit) in results.items():
+            print(f"{name:<10}{elapsed:>10.2f}{ok / elapsed:>10.1f}{percentile(latencies, 50):>10.3f}"
+                  f"{percentile(latencies, 95):>10.3f}{limit:>10}")
+        return
+
+    results = bench_session_pool(args.lines, args.threads, args.latency)
+    print(f"{'模式':<10}{'耗时(s)':>10}{'行/秒':>10}{'成功':>8}{'TCP连接数':>12}")
+    for name, (elapsed, ok, connections) in results.items():
+        print(f"{name:<10}{elapsed:>10.2f}{ok / elapsed:>10.1f}{ok:>8}{connections:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import re
+import shutil
+import unicodedata
+
+from tts_client import atomic_write, build_payload
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".renpy_ai_tts", "cache")
+DEFAULT_CACHE_SIZE = 2 * 1024 ** 3
+# 缓存格式变化时修改，旧条目自动失效
+KEY_VERSION = 1
+
+
+def normalize_text(text):
+    """规范化文本：Unicode NFC、去掉首尾空白、合并连续空白"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def synthesis_key(text, model_name, speed_factor):
+    """
+    合成结果的内容地址
+
+    对规范化后的文本和完整请求体（模型、语速、种子、采样步数等）取SHA256，
+    任何一个参数变化都会得到不同的key。dl_url只是服务器地址，不影响音频内容，不参与计算。
+    """
+    payload = build_payload(normalize_text(text), model_name, speed_factor)
+    payload.pop("dl_url", None)
+    payload["_version"] = KEY_VERSION
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def link_or_copy(src, dst):
+    """把src原子地放到dst：同一文件系统用硬链接，否则复制"""
+    directory = os.path.dirname(dst) or "."
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f".{os.path.basename(dst)}.{os.getpid()}.link")
+    try:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        os.link(src, temp_path)
+        os.replace(temp_path, dst)
+        return
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+    with open(src, 'rb') as source, atomic_write(dst) as f:
+        shutil.copyfileobj(source, f)
+
+
+class SynthesisCache:
+    """
+    本地内容寻址的合成缓存
+
+    音频按synthesis_key存放在cache_dir/ab/<key>.wav，不同项目、不同输出目录之间共享。
+    总大小超过max_bytes时按最近使用时间（mtime，命中时更新）淘汰最旧的条目，
+    淘汰到max_bytes的90%为止。第一次用到时扫描一遍缓存目录建立索引，之后总大小和LRU顺序
+    随命中、加入和淘汰增量更新，不再遍历目录。只能在一个线程中使用。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.total_bytes = None
+        # 路径 → 字节数，从最久没用的到最近用过的
+        self._entries = None
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".wav")
+
+    def _scan(self):
+        entries = []
+        for root, dirs, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith(".wav"):
+                    path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _index(self):
+        if self._entries is None:
+            self._entries = collections.OrderedDict((path, size) for mtime, size, path in sorted(self._scan()))
+            self.total_bytes = sum(self._entries.values())
+        return self._entries
+
+    def _touch(self, path, size):
+        """path刚被用过，移到LRU的末尾；其他进程加入的条目在这时补进索引"""
+        entries = self._index()
+        if path in entries:
+            entries.move_to_end(path)
+        else:
+            entries[path] = size
+            self.total_bytes += size
+
+    def materialize(self, key, output_path):
+        """缓存命中时把音频放到output_path并返回True"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+            link_or_copy(path, output_path)
+            size = os.path.getsize(path)
+        except OSError:
+            self.misses += 1
+            return False
+        self._touch(path, size)
+        self.hits += 1
+        return True
+
+    def put(self, key, source_path):
+        """把刚合成好的文件加入缓存"""
+        path = self.path_for(key)
+        if path in self._index() or os.path.exists(path):
+            return
+        try:
+            link_or_copy(source_path, path)
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        self._touch(path, size)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """按LRU淘汰到max_bytes的90%"""
+        entries = self._index()
+        target = self.max_bytes * 0.9
+        while entries and self.total_bytes > target:
+            path, size = entries.popitem(last=False)
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            self.total_bytes -= size
@@ -0,0 +1,399 @@
+import contextlib
+import os
+import struct
+import threading
+import time
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from tts_backends import API_TTS, BackendPool, parse_backends
+from tts_retry import (BAD_RESPONSE, CONNECTION, DOWNLOAD_FAILED, SERVER_ERROR, SYNTHESIS_FAILED, TIMEOUT,
+                       WRITE_FAILED, RetryPolicy, SynthesisError, status_reason)
+
+DEFAULT_MODEL = "原神-中文-莱欧斯利_ZH"
+DEFAULT_SERVER = "http://127.0.0.1:8000"
+# 单个合成请求的总超时（秒），命令行、界面和引擎共用：非流式请求要等整句合成完才有响应，留得宽一些，
+# 卡住的请求由连接超时和流式传输的停滞检测更早发现
+DEFAULT_TIMEOUT = 300
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 服务器按标点切开的片段之间插入的静音（秒）
+FRAGMENT_INTERVAL = 0.3
+# 修正WAV头时需要保留的响应开头字节数
+WAV_HEADER_SCAN = 256
+
+DEFAULT_HEADERS = {
+    "Connection": "keep-alive",
+    "sec-ch-ua": "\"Chromium\";v=\"92\", \" Not A;Brand\";v=\"99\", \"Microsoft Edge\";v=\"92\"",
+    "Accept": "application/json, text/plain, */*",
+    "sec-ch-ua-mobile": "?0",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.131 Safari/537.36 Edg/92.0.902.67",
+    "Content-Type": "application/json",
+    "Origin": "http://127.0.0.1:8000",
+    "Sec-Fetch-Site": "same-origin",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Dest": "empty",
+    "Referer": "http://127.0.0.1:8000/",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6"
+}
+
+
+def build_payload(text, model_name=DEFAULT_MODEL, speed_factor=1.0, dl_url=DEFAULT_SERVER):
+    """构造/infer_single的请求体"""
+    return {
+        "dl_url": dl_url,
+        "version": "v4",
+        "model_name": model_name,
+        "prompt_text_lang": "中文",
+        "emotion": "默认",
+        "text": text,
+        "text_lang": "中文",
+        "top_k": 10,
+        "top_p": 1,
+        "temperature": 1,
+        "text_split_method": "按标点符号切",
+        "batch_size": 10,
+        "batch_threshold": 0.75,
+        "split_bucket": True,
+        "speed_facter": speed_factor,
+        "fragment_interval": FRAGMENT_INTERVAL,
+        "media_type": "wav",
+        "parallel_infer": True,
+        "repetition_penalty": 1.35,
+        "seed": 473410238,
+        "sample_steps": 16,
+        "if_sr": False
+    }
+
+
+def build_tts_payload(text, ref_audio_path, prompt_text="", prompt_lang="zh", text_lang="zh", speed_factor=1.0,
+                      streaming=False):
+    """构造/tts（GPT-SoVITS api_v2）的请求体，采样参数与build_payload相同"""
+    return {
+        "text": text,
+        "text_lang": text_lang,
+        "ref_audio_path": ref_audio_path,
+        "prompt_text": prompt_text,
+        "prompt_lang": prompt_lang,
+        "top_k": 10,
+        "top_p": 1,
+        "temperature": 1,
+        # cut5即按标点符号切
+        "text_split_method": "cut5",
+        "batch_size": 10,
+        "batch_threshold": 0.75,
+        "split_bucket": True,
+        "speed_factor": speed_factor,
+        "fragment_interval": FRAGMENT_INTERVAL,
+        "media_type": "wav",
+        "streaming_mode": streaming,
+        "parallel_infer": True,
+        "repetition_penalty": 1.35,
+        "seed": 473410238,
+        "sample_steps": 16,
+        "super_sampling": False
+    }
+
+
+def build_request(backend, text, model_name=DEFAULT_MODEL, speed_factor=1.0, streaming=False):
+    """
+    按后端的接口风格构造请求体，streaming=True时/tts接口边合成边分块返回音频
+
+    /tts后端的音色由它的参考音频（backend.options）决定，不用model_name。
+    """
+    if backend.api == API_TTS:
+        return build_tts_payload(text, speed_factor=speed_factor, streaming=streaming, **backend.options)
+    return build_payload(text, model_name, speed_factor, backend.url)
+
+
+def wav_size_fixups(header, total_size):
+    """
+    流式返回的WAV头里长度字段是占位值，写完后要按实际大小改正
+
+    header为文件开头（至少包含到data块头），返回需要改写的[(偏移, 字节)]，不是WAV或无需改正时为空。
+    """
+    if total_size < 44 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        return []
+    fixups = []
+    riff_size = struct.pack("<I", total_size - 8)
+    if header[4:8] != riff_size:
+        fixups.append((4, riff_size))
+    offset = 12
+    while offset + 8 <= len(header):
+        chunk_id = header[offset:offset + 4]
+        if chunk_id == b"data":
+            data_size = struct.pack("<I", total_size - offset - 8)
+            if header[offset + 4:offset + 8] != data_size:
+                fixups.append((offset + 4, data_size))
+            break
+        chunk_size = struct.unpack("<I", header[offset + 4:offset + 8])[0]
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return fixups
+
+
+def media_type(content_type):
+    """Content-Type去掉参数后的部分，如audio/wav"""
+    return (content_type or "").split(";")[0].strip().lower()
+
+
+def is_audio(content_type):
+    """/tts接口成功时返回音频，合成失败时返回JSON"""
+    media = media_type(content_type)
+    return media.startswith("audio/") or media == "application/octet-stream"
+
+
+def json_message(result):
+    """失败响应中的错误信息，兼容infer_single的msg和api_v2的message"""
+    if isinstance(result, dict):
+        return str(result.get("msg") or result.get("message") or result)
+    return str(result)
+
+
+def _create_temp(output_path):
+    """
+    在output_path同目录下独占新建一个临时文件，返回(fd, 路径)
+
+    不用mkstemp：它建的文件权限固定是0600。这里按0666新建，由umask决定最终权限，与open()新建的文件相同，
+    也不必为了读umask去改动整个进程的umask。
+    """
+    directory = os.path.dirname(output_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0)
+    while True:
+        temp_path = os.path.join(directory, f".{os.path.basename(output_path)}.{os.urandom(4).hex()}.part")
+        try:
+            return os.open(temp_path, flags, 0o666), temp_path
+        except FileExistsError:
+            continue
+
+
+class AtomicFile:
+    """
+    分步的原子写入，供要把每一步放到其他线程执行的调用方使用（一次写完的用atomic_write）
+
+    创建时在目标目录下新建临时文件，写入file之后commit()：fsync并os.replace到目标路径；
+    出错时discard()关闭并删除临时文件，commit()之后再调用什么也不做。
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        fd, self.temp_path = _create_temp(output_path)
+        self.file = os.fdopen(fd, 'wb')
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.temp_path, self.output_path)
+        self.temp_path = None
+
+    def discard(self):
+        if self.temp_path is None:
+            return
+        with contextlib.suppress(OSError):
+            self.file.close()
+        with contextlib.suppress(OSError):
+            os.remove(self.temp_path)
+        self.temp_path = None
+
+
+@contextlib.contextmanager
+def atomic_write(output_path):
+    """
+    原子写入文件
+
+    先写到同目录下的临时文件，fsync后再os.replace到目标路径。
+    中途崩溃或出错只会留下被删除的临时文件，目标路径要么不存在，要么是完整文件，
+    所以os.path.exists跳过检查不会把半截文件当成已完成。
+    """
+    output = AtomicFile(output_path)
+    try:
+        yield output.file
+        output.commit()
+    finally:
+        output.discard()
+
+
+def stream_to_file(response, output_path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """分块把响应正文写入文件，内存占用只与chunk_size有关，返回写入字节数"""
+    written = 0
+    with atomic_write(output_path) as f:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunk:
+                f.write(chunk)
+                written += len(chunk)
+    return written
+
+
+class SessionPool:
+    """
+    线程共享的keep-alive会话
+
+    所有工作线程共用一个Session，底层urllib3连接池是线程安全的。
+    pool_size应与线程数一致：每个线程同一时刻只占用一条连接，
+    连接用完归还池中复用，不会每次请求都重新建立TCP连接。
+    """
+
+    def __init__(self, pool_size=4, headers=None):
+        self.pool_size = max(1, int(pool_size))
+        self.headers = dict(headers or DEFAULT_HEADERS)
+        self._lock = threading.Lock()
+        self._session = self._create_session()
+
+    def _create_session(self):
+        session = requests.Session()
+        session.headers.update(self.headers)
+        # pool_block=True：连接数达到上限时等待归还，而不是临时新建再丢弃
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, pool_block=True)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @property
+    def session(self):
+        return self._session
+
+    def resize(self, pool_size):
+        """
+        按新的线程数重建连接池
+
+        其他线程可能还在用旧Session发请求，这里不关闭它；请求都结束、不再被引用后，连接随垃圾回收关闭。
+        """
+        pool_size = max(1, int(pool_size))
+        with self._lock:
+            if pool_size == self.pool_size:
+                return
+            self.pool_size = pool_size
+            self._session = self._create_session()
+
+    def close(self):
+        with self._lock:
+            self._session.close()
+
+
+class TTSGenerator:
+    """
+    同步的单条合成客户端
+
+    server可以是逗号分隔的多个地址，地址后可加“*权重”，每次请求发给最空闲的健康后端。
+    地址前加“tts+”的后端用/tts接口，音频直接在响应正文中返回，省去下载audio_url的第二次往返；
+    它的参考音频和语言写在地址的查询参数里（见parse_backends）。
+    """
+
+    def __init__(self, server=DEFAULT_SERVER, pool_size=4, timeout=DEFAULT_TIMEOUT, retry_policy=None):
+        backends = parse_backends(server) if isinstance(server, str) else list(server)
+        # 没有事件循环做主动健康检查，用真实请求试探已摘除的后端
+        self.backends = BackendPool(backends, passive_probe=True)
+        self.timeout = timeout
+        self.headers = dict(DEFAULT_HEADERS)
+        self.session_pool = SessionPool(pool_size, self.headers)
+        self.retry_policy = retry_policy or RetryPolicy()
+        # 最近一次失败的原因（SynthesisError），成功时为None
+        self.last_error = None
+
+    def set_pool_size(self, pool_size):
+        """连接池大小跟随线程数调整"""
+        self.session_pool.resize(pool_size)
+
+    def _save_direct(self, response, output_path):
+        """/tts接口：响应正文就是音频，边收边写"""
+        if response.status_code != 200:
+            raise SynthesisError(status_reason(response.status_code), f"HTTP {response.status_code}")
+        content_type = response.headers.get("Content-Type")
+        if not is_audio(content_type):
+            if media_type(content_type) == "application/json":
+                try:
+                    raise SynthesisError(SYNTHESIS_FAILED, json_message(response.json()))
+                except ValueError:
+                    pass
+            raise SynthesisError(BAD_RESPONSE, "返回内容不是音频")
+        self._stream(response, output_path)
+
+    def _stream(self, response, output_path):
+        """
+        把响应正文写到output_path
+
+        读取时的超时和断线不算写文件失败：socket超时是TimeoutError、断线是ConnectionError，都是OSError的子类，
+        要在OSError之前单独处理。
+        """
+        try:
+            stream_to_file(response, output_path)
+        except requests.ConnectionError as e:
+            # iter_content把读超时包装成ConnectionError
+            if e.args and isinstance(e.args[0], urllib3.exceptions.ReadTimeoutError):
+                raise SynthesisError(TIMEOUT, f"超过{self.timeout}秒")
+            raise
+        except requests.RequestException:
+            raise
+        except TimeoutError:
+            raise SynthesisError(TIMEOUT, f"超过{self.timeout}秒")
+        except ConnectionError as e:
+            raise SynthesisError(CONNECTION, str(e) or type(e).__name__)
+        except OSError as e:
+            raise SynthesisError(WRITE_FAILED, str(e))
+
+    def _request(self, backend, text, output_path, model_name, speed_factor):
+        data = build_request(backend, text, model_name, speed_factor)
+        session = self.session_pool.session
+
+        if backend.api == API_TTS:
+            with session.post(backend.endpoint, json=data, timeout=self.timeout, stream=True) as response:
+                self._save_direct(response, output_path)
+            return
+
+        response = session.post(backend.endpoint, json=data, timeout=self.timeout)
+        if response.status_code != 200:
+            raise SynthesisError(status_reason(response.status_code), f"HTTP {response.status_code}")
+        try:
+            result = response.json()
+        except ValueError:
+            raise SynthesisError(BAD_RESPONSE, "返回内容不是JSON")
+        if not isinstance(result, dict) or result.get("msg") != "合成成功":
+            raise SynthesisError(SYNTHESIS_FAILED, json_message(result))
+        if not result.get("audio_url"):
+            raise SynthesisError(BAD_RESPONSE, "缺少audio_url")
+
+        with session.get(result["audio_url"], timeout=self.timeout, stream=True) as audio_response:
+            if audio_response.status_code != 200:
+                reason = status_reason(audio_response.status_code)
+                raise SynthesisError(SERVER_ERROR if reason == SERVER_ERROR else DOWNLOAD_FAILED,
+                                     f"HTTP {audio_response.status_code}")
+            self._stream(audio_response, output_path)
+
+    def synthesize(self, text, output_path, model_name=DEFAULT_MODEL, speed_factor=1.0):
+        """合成一次，失败时抛出带原因的SynthesisError"""
+        backend = self.backends.pick()
+        start = time.monotonic()
+        error = None
+        try:
+            self._request(backend, text, output_path, model_name, speed_factor)
+        except SynthesisError as e:
+            error = e
+        except requests.Timeout:
+            error = SynthesisError(TIMEOUT, f"超过{self.timeout}秒")
+        except requests.ConnectionError as e:
+            error = SynthesisError(CONNECTION, str(e))
+        except requests.RequestException as e:
+            error = SynthesisError(DOWNLOAD_FAILED, str(e))
+        except BaseException:
+            self.backends.release(backend, time.monotonic() - start, SynthesisError(BAD_RESPONSE))
+            raise
+        self.backends.release(backend, time.monotonic() - start, error)
+        if error is not None:
+            raise error
+
+    def generate_tts(self, text, output_path, model_name=DEFAULT_MODEL, speed_factor=1.0):
+        """生成单个文本的TTS，可重试的失败按退避策略重试，失败原因见last_error"""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.synthesize(text, output_path, model_name, speed_factor)
+                self.last_error = None
+                return True
+            except SynthesisError as e:
+                self.last_error = e
+                if not self.retry_policy.should_retry(e, attempt):
+                    return False
+            time.sleep(self.retry_policy.delay(attempt))
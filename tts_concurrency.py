@@ -0,0 +1,218 @@
+import asyncio
+import collections
+import time
+
+# 统计实际请求速率的时间窗口（秒）
+RATE_WINDOW = 10.0
+
+
+def percentile(values, q):
+    """计算百分位数（q取0~100），values为空时返回0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+class ConcurrencyLimiter:
+    """
+    上限可随时调整的异步并发限制器
+
+    与asyncio.Semaphore用法相同，但limit可以在运行中修改：
+    调大时立即唤醒等待者，调小时已在途的请求不受影响，新请求要等在途数降到limit以下。
+    只能在事件循环线程中使用。
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self.in_use = 0
+        self._waiters = collections.deque()
+
+    async def acquire(self):
+        while self.in_use >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        self.in_use += 1
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+
+    def set_limit(self, limit):
+        self.limit = max(1, int(limit))
+        self._wake()
+
+    def _wake(self):
+        free = self.limit - self.in_use
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class TokenBucket:
+    """
+    令牌桶限速
+
+    每秒补充rate个令牌，最多攒burst个，每个请求取一个令牌，没有令牌时按先来后到排队等待；
+    rate为0时不限速。rate和burst可以在运行中用set_rate()修改，正在等待的请求按新的速率重新计算。
+    acquire/set_rate只能在事件循环线程中调用，recent_rate()可以在任意线程读取。
+    """
+
+    def __init__(self, rate=0.0, burst=None):
+        # burst为None时取约1秒的量
+        self.rate = max(0.0, float(rate or 0))
+        self.burst = max(1, int(burst or round(self.rate)))
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._queue = collections.deque()
+        self._wakeup = None
+        self._recent = collections.deque()
+
+    def set_rate(self, rate, burst=None):
+        """修改速率（次/秒）和突发量"""
+        self._refill(time.monotonic())
+        self.rate = max(0.0, float(rate or 0))
+        self.burst = max(1, int(burst or round(self.rate)))
+        self.tokens = min(self.tokens, self.burst)
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """取一个令牌，需要时等待"""
+        loop = asyncio.get_running_loop()
+        ticket = loop.create_future()
+        self._queue.append(ticket)
+        try:
+            if self._queue[0] is not ticket:
+                await ticket
+            while self.rate:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                self._wakeup = loop.create_future()
+                try:
+                    await asyncio.wait_for(self._wakeup, (1 - self.tokens) / self.rate)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._wakeup = None
+        finally:
+            self._queue.remove(ticket)
+            if self._queue and not self._queue[0].done():
+                self._queue[0].set_result(None)
+        self._recent.append(time.monotonic())
+
+    def recent_rate(self, now=None):
+        """最近RATE_WINDOW秒内实际放行的请求数/秒"""
+        now = time.monotonic() if now is None else now
+        while self._recent and now - self._recent[0] > RATE_WINDOW:
+            self._recent.popleft()
+        return len(self._recent) / RATE_WINDOW
+
+
+class AIMDController:
+    """
+    根据请求延迟自动调整并发数（加性增、乘性减）
+
+    每完成约limit个请求评估一次最近的窗口：
+    - 拥塞信号（超时、连接失败、5xx、停滞）的比例超过error_threshold、相对延迟的p50超过基线的
+      latency_tolerance倍、或耗时的p95逼近超时（latency_ceiling），并发数乘以decrease；
+    - 否则若并发已被用满，并发数加increase。开始时处于慢启动阶段，每次翻倍，
+      第一次过载时退回一半并结束慢启动。
+    在上次调整之前发出的请求不计入评估。
+    相对延迟为实际耗时/预计耗时，台词长短不一、不同模型快慢不同时也能放在一起比较；
+    基线取运行中观测到的最低p50，即服务器空闲时的相对延迟。
+    """
+
+    def __init__(self, limiter, min_limit=1, max_limit=64, window=200, min_samples=8, increase=1,
+                 decrease=0.7, latency_tolerance=1.5, latency_ceiling=None, error_threshold=0.05):
+        self.limiter = limiter
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.min_samples = min_samples
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.latency_ceiling = latency_ceiling
+        self.error_threshold = error_threshold
+        # (耗时, 相对延迟, 是否为拥塞信号)
+        self.samples = collections.deque(maxlen=window)
+        self.baseline = None
+        self.slow_start = True
+        self.saturated = False
+        self._changed_at = float("-inf")
+        # 最近一次评估的相对延迟p50、耗时p95和拥塞信号比例
+        self.last_p50 = 0.0
+        self.last_p95 = 0.0
+        self.last_error_rate = 0.0
+
+    def on_dispatch(self):
+        """派发请求时调用，记录窗口内并发是否被用满"""
+        if self.limiter.in_use >= self.limiter.limit:
+            self.saturated = True
+
+    def reset_baseline(self):
+        """预计耗时的算法变了，丢弃当前窗口，从下一次评估重新建立基线"""
+        self.baseline = None
+        self.samples.clear()
+
+    def record(self, latency, congested=False, expected=None):
+        """
+        记录一次请求，并发数发生变化时返回新的值，否则返回None
+
+        congested为True表示服务器过载或不可用（见BACKEND_DOWN_REASONS）；合成失败、写文件失败这类
+        与负载无关的失败不要记录。expected为这个请求的预计耗时，不传时直接比较耗时。
+        """
+        now = time.monotonic()
+        if now - latency < self._changed_at:
+            # 反映的是旧并发数下的延迟，计入的话一次过载会连续减小两次
+            return None
+        self.samples.append((latency, latency / expected if expected else latency, congested))
+        needed = min(self.samples.maxlen, max(self.min_samples, self.limiter.limit))
+        if len(self.samples) < needed:
+            return None
+
+        latencies = [sample[0] for sample in self.samples if not sample[2]]
+        relative = [sample[1] for sample in self.samples if not sample[2]]
+        error_rate = sum(1 for sample in self.samples if sample[2]) / len(self.samples)
+        p50 = percentile(relative, 50)
+        p95 = percentile(latencies, 95)
+        self.last_p50, self.last_p95, self.last_error_rate = p50, p95, error_rate
+        if relative and (self.baseline is None or p50 < self.baseline):
+            self.baseline = p50
+
+        limit = self.limiter.limit
+        overloaded = (error_rate > self.error_threshold
+                      or (self.baseline and p50 > self.baseline * self.latency_tolerance)
+                      or (self.latency_ceiling and p95 > self.latency_ceiling))
+        if overloaded and self.slow_start:
+            # 慢启动中上一个（一半的）并发数还没有过载，直接退回去
+            self.slow_start = False
+            new_limit = max(self.min_limit, limit // 2)
+        elif overloaded:
+            new_limit = max(self.min_limit, int(limit * self.decrease))
+        elif self.saturated:
+            new_limit = min(self.max_limit, limit * 2 if self.slow_start else limit + self.increase)
+        else:
+            new_limit = limit
+
+        # 每次评估后清空窗口，新的并发数用新的样本来评估
+        self.samples.clear()
+        self.saturated = False
+        if new_limit == limit:
+            return None
+        self.limiter.set_limit(new_limit)
+        self._changed_at = now
+        return new_limit
@@ -0,0 +1,1171 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import hashlib
+import heapq
+import os
+import re
+import time
+import wave
+
+import aiohttp
+
+from tts_backends import API_TTS, BackendPool, parse_backends
+from tts_cache import link_or_copy, synthesis_key
+from tts_client import (DEFAULT_HEADERS, DEFAULT_MODEL, DEFAULT_SERVER, DEFAULT_TIMEOUT, DOWNLOAD_CHUNK_SIZE,
+                        FRAGMENT_INTERVAL, WAV_HEADER_SCAN, AtomicFile, atomic_write, build_request, is_audio,
+                        json_message, media_type, wav_size_fixups)
+from tts_concurrency import AIMDController, ConcurrencyLimiter, TokenBucket
+from tts_journal import JobJournal
+from tts_metrics import MetricsServer
+from tts_retry import (BAD_RESPONSE, CONNECTION, DOWNLOAD_FAILED, SERVER_ERROR, STALLED, SYNTHESIS_FAILED, TIMEOUT,
+                       WRITE_FAILED, CircuitBreaker, RetryPolicy, SynthesisError, status_reason)
+from tts_schedule import MIN_SAMPLES, DurationModel
+from tts_stats import SynthesisStats
+from tts_stitch import (DEFAULT_CROSSFADE_MS, HAS_NUMPY, pack_text, packable, split_on_silence, split_text,
+                        stitch_wavs, write_pcm)
+from tts_voices import speaker_of
+
+DEFAULT_CONCURRENCY = 16
+# 自适应模式下的初始并发数
+ADAPTIVE_START = 4
+HEALTH_CHECK_TIMEOUT = 3.0
+# 切换模型后发给每个后端的预热文本
+WARM_UP_TEXT = "你好。"
+# 连续这么多秒没有收到音频数据视为传输停滞，中止后重新排队
+DEFAULT_STALL_TIMEOUT = 30.0
+# 建立TCP连接的超时，与合成耗时无关，不随timeout放宽
+CONNECT_TIMEOUT = 10.0
+# /tts后端上不少于这么多字的台词使用流式合成
+STREAM_MIN_CHARS = 60
+# 拆分合成时各段的临时目录（在输出目录下）
+PARTS_DIR = ".tts_parts"
+# 合并请求时不超过这么多字的台词才参与合并
+PACK_MAX_CHARS = 12
+# 计入counts的事件
+OUTCOMES = ("success", "failed", "skipped")
+
+
+def strip_speaker(line):
+    """去掉行首的“角色:”前缀，得到要合成的文本"""
+    return re.sub(r'^[^:]+:\s*', '', line.strip())
+
+
+def output_filename(original_line):
+    """与renpyVoicePath.rpy一致：对“角色:台词”整行取SHA1作为文件名"""
+    sha1_hash = hashlib.sha1()
+    sha1_hash.update(original_line.encode('utf-8'))
+    return sha1_hash.hexdigest() + ".wav"
+
+
+class SynthesisJob:
+    """一条待合成的台词"""
+
+    def __init__(self, index, original_line, output_dir, model_name=DEFAULT_MODEL, speed_factor=1.0, source=None):
+        self.index = index
+        # 所在的输入文件，index是该文件中的行号（从0开始）
+        self.source = source
+        self.original_line = original_line
+        self.text = strip_speaker(original_line)
+        self.filename = output_filename(original_line)
+        self.output_path = os.path.join(output_dir, self.filename)
+        self.model_name = model_name
+        self.speed_factor = speed_factor
+        # 文本+全部合成参数的指纹，用于缓存和判断已有文件是否过期
+        self.key = synthesis_key(self.text, model_name, speed_factor)
+        # 续跑状态：done（日志记录已完成）/ stale（现有文件参数已过期）/ None
+        self.resume_state = None
+        self.attempts = 0
+        # 最近一次请求本身的耗时，不含暂停、熔断和限速的等待
+        self.latency = None
+        # 最近一次请求期间是否暂停或限速过，这样的耗时不记入DurationModel
+        self.throttled = False
+        # 最近一次请求从发出到收到第一个音频字节的时间
+        self.ttfb = None
+
+
+def plan_jobs(lines, output_dir, model_name=DEFAULT_MODEL, speed_factor=1.0, source=None, voice_map=None):
+    """把输入文件的各行转换成合成任务，空行直接忽略；voice_map（角色名→模型名）中的角色使用各自的模型"""
+    jobs = []
+    for i, line in enumerate(lines):
+        original_line = line.strip()
+        if original_line:
+            job_model = voice_map.get(speaker_of(original_line), model_name) if voice_map else model_name
+            jobs.append(SynthesisJob(i, original_line, output_dir, job_model, speed_factor, source))
+    return jobs
+
+
+def group_jobs(jobs):
+    """
+    按synthesis key把任务分组，同一组只需要合成一次
+
+    再按模型排序（模型之间按首次出现的顺序，同一模型内保持原顺序），
+    让同一模型的台词连续派发，服务器不必来回切换模型。
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.key, []).append(job)
+    model_order = {}
+    for group in groups.values():
+        model_order.setdefault(group[0].model_name, len(model_order))
+    return sorted(groups.values(), key=lambda group: model_order[group[0].model_name])
+
+
+def count_model_switches(jobs):
+    """按给定顺序逐条合成时模型切换的次数"""
+    switches = 0
+    previous = None
+    for job in jobs:
+        if previous is not None and job.model_name != previous:
+            switches += 1
+        previous = job.model_name
+    return switches
+
+
+async def next_chunk(chunks, timeout):
+    """
+    读取下一块数据，timeout秒内没有读到时抛出asyncio.TimeoutError，读完时抛出StopAsyncIteration
+
+    不用asyncio.wait_for：Python 3.11及以前，数据刚好到达时任务被取消，wait_for会吞掉取消照常返回，
+    stop(cancel=True)之后这个请求还会一直接收到结束。
+    """
+    reading = asyncio.ensure_future(chunks.__anext__())
+    try:
+        done, _ = await asyncio.wait({reading}, timeout=timeout)
+    finally:
+        if not reading.done():
+            reading.cancel()
+    if not done:
+        raise asyncio.TimeoutError
+    return reading.result()
+
+
+class SynthesisEngine:
+    """
+    基于asyncio的批量合成引擎
+
+    单个事件循环驱动所有请求，同时在途的请求数不超过concurrency；GUI在后台线程中调用run()，命令行直接调用run()。
+    """
+
+    def __init__(self, server=DEFAULT_SERVER, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, on_event=None,
+                 adaptive=False, retry_policy=None, circuit_breaker=None, cache=None,
+                 stall_timeout=DEFAULT_STALL_TIMEOUT, stream_min_chars=STREAM_MIN_CHARS, split_chars=0,
+                 crossfade_ms=DEFAULT_CROSSFADE_MS, pack_lines=0, pack_chars=PACK_MAX_CHARS, durations=None,
+                 longest_first=True, rate_limit=0.0, burst=None, metrics_port=0, metrics_host="127.0.0.1",
+                 connect_timeout=CONNECT_TIMEOUT):
+        if split_chars and not HAS_NUMPY:
+            raise ValueError("拆分长台词需要安装numpy")
+        if pack_lines > 1 and not HAS_NUMPY:
+            raise ValueError("合并短台词需要安装numpy")
+        backends = parse_backends(server) if isinstance(server, str) else list(server)
+        self.backends = BackendPool(backends, on_change=lambda backend, healthy: self._emit("backend", None, backend))
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+        self.connect_timeout = min(connect_timeout, timeout)
+        self.stall_timeout = stall_timeout
+        self.stream_min_chars = stream_min_chars
+        self.split_chars = split_chars
+        self.crossfade_ms = crossfade_ms
+        self.pack_lines = pack_lines
+        self.pack_chars = pack_chars
+        self.durations = durations or DurationModel()
+        self.longest_first = longest_first
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.on_event = on_event
+        # adaptive=True时concurrency作为上限，实际并发数由AIMDController根据延迟和失败率调整
+        if adaptive:
+            self.limiter = ConcurrencyLimiter(min(ADAPTIVE_START, self.concurrency))
+            self.controller = AIMDController(self.limiter, max_limit=self.concurrency,
+                                             latency_ceiling=timeout * 0.5)
+        else:
+            self.limiter = ConcurrencyLimiter(self.concurrency)
+            self.controller = None
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = TokenBucket(rate_limit, burst)
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.circuit_breaker.on_state_change = lambda state: self._emit("circuit", None, state)
+        self.cache = cache
+        self.journals = {}
+        # 续跑计划之后实际要处理的任务数
+        self.planned = 0
+        self.stop_requested = False
+        self.paused = False
+        self.in_flight = 0
+        # 各结果的行数、重试、缓存命中、请求数、下载字节数和请求耗时，界面和命令行读取它的快照
+        # 只由合成线程写入、不加锁，counts/retries/cache_hits也来自它的快照
+        self.stats = SynthesisStats()
+        # 去重省下的服务器请求数
+        self.calls_saved = 0
+        self.duplicates = 0
+        # synthesis key → (完成时得到各跟随者错误的future, 跟随者的输出路径)
+        self._flights = {}
+        self.failure_reasons = collections.Counter()
+        self.ttfbs = []
+        self.streamed = 0
+        # 拆分合成的台词数和拆出的总段数
+        self.split_lines = 0
+        self.split_pieces = 0
+        # 合并请求的次数、合并合成的行数、切分对不上或失败后退回逐行合成的次数
+        self.packed_requests = 0
+        self.packed_lines = 0
+        self.pack_fallbacks = 0
+        # 全部派发单元和已完成单元的预测耗时之和，用于估算剩余时间
+        self.predicted_total = 0.0
+        self.predicted_done = 0.0
+        self._started = None
+        # 本次运行涉及的模型数、实际切换模型的次数、按文件顺序合成时会切换的次数
+        self.models = 0
+        self.model_switches = 0
+        self.file_order_switches = 0
+        self.current_model = None
+        self._switching = None
+        self._server_requests = 0
+        self._server_idle = None
+        self._loop = None
+        # 暂停时清除，派发和发请求前等待它
+        self._running = None
+        self._paused_at = None
+        self._paused_total = 0.0
+        self._tasks = set()
+        self._queue = None
+        self._expected_durations = self.durations
+        self._expected_fitted = False
+        # 日志和缓存的读写都在这个线程中按提交顺序执行
+        self._writer = None
+
+    @property
+    def counts(self):
+        snapshot = self.stats.snapshot()
+        return {outcome: snapshot[outcome] for outcome in OUTCOMES}
+
+    @property
+    def processed(self):
+        return sum(self.counts.values())
+
+    @property
+    def retries(self):
+        return self.stats.snapshot()["retries"]
+
+    @property
+    def cache_hits(self):
+        return self.stats.snapshot()["cache_hits"]
+
+    @property
+    def running(self):
+        """run()正在执行"""
+        return self._loop is not None
+
+    @property
+    def queue_depth(self):
+        """还没有派发的单元数（一个单元是一行、同文本的几行或合并请求的几行）"""
+        queue = self._queue
+        return len(queue) if queue else 0
+
+    @property
+    def concurrency_limit(self):
+        """当前允许的最大在途请求数"""
+        return self.limiter.limit
+
+    def _journal(self, job):
+        return self.journals[os.path.dirname(job.output_path)]
+
+    async def _in_writer(self, func, *args):
+        """在写线程中执行func(*args)并等待结果，SQLite提交、缓存的链接/复制和淘汰不阻塞事件循环"""
+        return await self._loop.run_in_executor(self._writer, func, *args)
+
+    def _open_journals(self, by_dir):
+        """在写线程中打开各输出目录的日志并登记任务，返回{输出目录: ResumePlan}"""
+        plans = {}
+        for output_dir, dir_jobs in by_dir.items():
+            journal = self.journals[output_dir] = JobJournal(output_dir)
+            plans[output_dir] = journal.plan(dir_jobs)
+        return plans
+
+    def _close_journals(self):
+        for journal in self.journals.values():
+            journal.reset_running()
+            journal.close()
+        with contextlib.suppress(OSError):
+            self.durations.save()
+
+    async def _plan_resume(self, jobs, only_failed=False):
+        """
+        在日志中登记任务并标记续跑状态，only_failed时只保留上次失败的任务
+
+        每个输出目录有一份JobJournal（SQLite），记录每行的参数指纹、状态、尝试次数、耗时和错误；
+        续跑时直接按日志跳过已完成的行，参数变化后已有文件会重新生成。
+        """
+        by_dir = {}
+        for job in jobs:
+            by_dir.setdefault(os.path.dirname(job.output_path), []).append(job)
+        plans = await self._in_writer(self._open_journals, by_dir)
+        selected = []
+        for output_dir, dir_jobs in by_dir.items():
+            plan = plans[output_dir]
+            for job in dir_jobs:
+                if job.filename in plan.done:
+                    job.resume_state = "done"
+                elif job.filename in plan.stale:
+                    job.resume_state = "stale"
+                if not only_failed or job.filename in plan.failed:
+                    selected.append(job)
+        return selected
+
+    @property
+    def request_rate(self):
+        """最近实际发往服务器的请求数/秒"""
+        return self.rate_limiter.recent_rate()
+
+    def _call_soon(self, callback, *args):
+        """在事件循环线程中执行callback，事件循环没有运行时直接执行"""
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(callback, *args)
+                return
+            except RuntimeError:
+                # 事件循环已经结束
+                pass
+        callback(*args)
+
+    def set_rate_limit(self, rate, burst=None):
+        """
+        修改限速（可在任意线程调用），rate为0时不限速
+
+        所有发往服务器的请求（含重试）共用一个令牌桶，每秒最多rate个、可突发burst个。
+        """
+        self._call_soon(self.rate_limiter.set_rate, rate, burst)
+
+    def eta(self):
+        """
+        预计剩余秒数，还没有完成任何任务时返回None
+
+        按已完成单元的预测耗时与实际经过时间之比换算，并发数、模型切换和预测的整体偏差都已包含在内。
+        """
+        if self._started is None or not self.predicted_done:
+            return None
+        now = time.monotonic()
+        # 暂停的时间不算
+        elapsed = now - self._started - self._paused_total
+        if self._paused_at is not None:
+            elapsed -= now - self._paused_at
+        return max(0.0, self.predicted_total - self.predicted_done) * elapsed / self.predicted_done
+
+    def stop(self, cancel=False):
+        """
+        停止派发新任务（可在任意线程调用），cancel=True时同时中止在途请求
+
+        中止时连接随任务取消而关闭，写了一半的输出随临时文件删除，这些行在日志中恢复为待处理，
+        下次运行重新合成，停止所需时间不取决于台词长短。
+        """
+        self.stop_requested = True
+        self._call_soon(self._abort, cancel)
+
+    def _abort(self, cancel):
+        if self._running is not None:
+            # 暂停中的派发循环要醒来才能看到停止
+            self._running.set()
+        if cancel:
+            for task in list(self._tasks):
+                task.cancel()
+
+    def pause(self):
+        """暂停发出新请求（可在任意线程调用），包括重试；在途请求照常完成，队列和日志保持不变"""
+        self.paused = True
+        self._call_soon(self._apply_pause)
+
+    def resume(self):
+        """继续发出请求（可在任意线程调用）"""
+        self.paused = False
+        self._call_soon(self._apply_pause)
+
+    def _apply_pause(self):
+        if self._running is None:
+            return
+        if self.paused and self._running.is_set() and not self.stop_requested:
+            self._running.clear()
+            self._paused_at = time.monotonic()
+            self._emit("paused", None, True)
+        elif not self.paused and self._paused_at is not None:
+            self._running.set()
+            self._paused_total += time.monotonic() - self._paused_at
+            self._paused_at = None
+            self._emit("paused", None, False)
+
+    def _emit(self, event, job, detail=None):
+        """
+        在事件循环线程中调用on_event(event, job, detail)
+
+        event取值：planned（job为None，detail为本次实际要处理的任务数）/ start / skipped /
+        success（detail为"cache"、"dedup"或"pack"表示没有单独请求服务器）/ failed（detail为SynthesisError）/
+        retry（detail为SynthesisError）/ concurrency（job为None，detail为新的并发数）/
+        circuit（job为None，detail为熔断器状态）/ backend（job为None，detail为健康状态发生变化的Backend）/
+        model（job为None，detail为切换到的模型名）/ paused（job为None，detail为True表示已暂停、False表示已继续）
+        """
+        if event in OUTCOMES:
+            self.stats.add(event)
+        if self.on_event:
+            self.on_event(event, job, detail)
+
+    async def _download(self, session, audio_url, job, backend, started, inferred):
+        async with session.get(audio_url) as audio_response:
+            if audio_response.status != 200:
+                # 音频文件404之类的按下载失败处理，整条重新合成
+                reason = status_reason(audio_response.status)
+                raise SynthesisError(SERVER_ERROR if reason == SERVER_ERROR else DOWNLOAD_FAILED,
+                                     f"HTTP {audio_response.status}")
+            await self._save(audio_response, job, backend, started, inferred=inferred)
+
+    async def _save(self, response, job, backend, started, stall_first=True, inferred=None):
+        """
+        把响应正文边收边写到job.output_path，记录首字节时间
+
+        两块数据之间超过stall_timeout秒视为停滞；stall_first=False时不限制第一块数据的等待
+        （非流式的/tts在返回第一个字节前还在合成）。写完后按实际大小改正流式WAV头中的长度。
+        写文件、fsync和改名都在工作线程中执行，不会让其他请求的接收停下来、误判为停滞。
+        接收时的超时和断线在读取处就转成STALLED/TIMEOUT/CONNECTION，只有写文件和改名失败算WRITE_FAILED
+        （TimeoutError和ConnectionError都是OSError的子类）。
+        各阶段耗时记入stats：infer为发出请求到服务器合成完（inferred，为None时取收到第一块音频的时刻），
+        download为之后接收音频的时间（不含写文件），write为写文件、fsync和改名的时间，直方图按backend分开。
+        """
+        chunks = response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE)
+        header = b""
+        size = 0
+        last = time.monotonic()
+        writing = 0.0
+        output = None
+        try:
+            # 新建临时文件不涉及刷盘，直接在这里做，被取消时一定能删掉
+            output = AtomicFile(job.output_path)
+            while True:
+                wait = self.stall_timeout if size or stall_first else None
+                try:
+                    chunk = await next_chunk(chunks, wait)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    # 也可能是整个请求的timeout到了
+                    if wait is not None and time.monotonic() - last >= wait:
+                        raise SynthesisError(STALLED, f"{wait:g}秒没有收到数据")
+                    raise SynthesisError(TIMEOUT, f"超过{self.timeout}秒")
+                except ConnectionError as e:
+                    raise SynthesisError(CONNECTION, str(e) or type(e).__name__)
+                last = time.monotonic()
+                if not size:
+                    job.ttfb = last - started
+                if len(header) < WAV_HEADER_SCAN:
+                    header += chunk[:WAV_HEADER_SCAN - len(header)]
+                await asyncio.to_thread(output.file.write, chunk)
+                size += len(chunk)
+                writing += time.monotonic() - last
+            received = time.monotonic()
+            await asyncio.to_thread(self._commit_output, output, header, size)
+            written = time.monotonic()
+            if inferred is None:
+                inferred = started + job.ttfb if size else received
+            self.stats.add("bytes", size)
+            self.stats.observe("infer", inferred - started, backend.name)
+            self.stats.observe("download", max(0.0, received - inferred - writing), backend.name)
+            self.stats.observe("write", writing + written - received, backend.name)
+        except (aiohttp.ClientError, SynthesisError):
+            raise
+        except asyncio.TimeoutError:
+            raise SynthesisError(TIMEOUT, f"超过{self.timeout}秒")
+        except OSError as e:
+            raise SynthesisError(WRITE_FAILED, str(e))
+        finally:
+            if output is not None:
+                # 已经改名到输出路径的不受影响
+                output.discard()
+
+    @staticmethod
+    def _commit_output(output, header, size):
+        """按实际大小改正流式WAV头中的长度，再fsync并改名到输出路径"""
+        for offset, value in wav_size_fixups(header, size):
+            output.file.seek(offset)
+            output.file.write(value)
+        output.commit()
+
+    async def _request_direct(self, session, job, backend, data, started):
+        """/tts接口：一次往返，响应正文就是音频"""
+        streaming = data.get("streaming_mode")
+        # 流式合成的总时长取决于台词长度，不限总时长，只限制连接和每次读取（服务器合成完第一个片段才发出响应头）
+        options = {"timeout": aiohttp.ClientTimeout(sock_connect=self.connect_timeout,
+                                                    sock_read=self.stall_timeout)} if streaming else {}
+        async with session.post(backend.endpoint, json=data, **options) as response:
+            if response.status != 200:
+                raise SynthesisError(status_reason(response.status), f"HTTP {response.status}")
+            content_type = response.headers.get("Content-Type")
+            if not is_audio(content_type):
+                if media_type(content_type) == "application/json":
+                    try:
+                        result = await response.json(content_type=None)
+                    except ValueError:
+                        result = None
+                    if result is not None:
+                        raise SynthesisError(SYNTHESIS_FAILED, json_message(result))
+                raise SynthesisError(BAD_RESPONSE, "返回内容不是音频")
+            await self._save(response, job, backend, started, stall_first=streaming)
+
+    async def _request(self, session, job, backend):
+        """
+        发一次合成请求并保存音频
+
+        建立连接最多等connect_timeout秒，服务器进程不在时很快失败，不必等满timeout。
+        /tts后端上不少于stream_min_chars字的长台词用流式合成，音频边生成边写入文件，不受timeout限制，
+        只在连续stall_timeout秒收不到数据时中止。
+        """
+        started = time.monotonic()
+        job.ttfb = None
+        streaming = backend.api == API_TTS and len(job.text) >= self.stream_min_chars
+        data = build_request(backend, job.text, job.model_name, job.speed_factor, streaming)
+        if backend.api == API_TTS:
+            if streaming:
+                self.streamed += 1
+            await self._request_direct(session, job, backend, data, started)
+            return
+        async with session.post(backend.endpoint, json=data) as response:
+            if response.status != 200:
+                raise SynthesisError(status_reason(response.status), f"HTTP {response.status}")
+            try:
+                result = await response.json(content_type=None)
+            except ValueError:
+                raise SynthesisError(BAD_RESPONSE, "返回内容不是JSON")
+        inferred = time.monotonic()
+        if not isinstance(result, dict) or result.get("msg") != "合成成功":
+            raise SynthesisError(SYNTHESIS_FAILED, json_message(result))
+        if not result.get("audio_url"):
+            raise SynthesisError(BAD_RESPONSE, "缺少audio_url")
+        await self._download(session, result["audio_url"], job, backend, started, inferred)
+
+    async def synthesize(self, session, job, backend):
+        """向backend请求合成并把音频写到job.output_path，失败时抛出带原因的SynthesisError"""
+        try:
+            await self._request(session, job, backend)
+        except SynthesisError:
+            raise
+        except asyncio.TimeoutError as e:
+            # 连接超时和读取超时（aiohttp.ServerTimeoutError）带有说明，整个请求超时的没有
+            raise SynthesisError(TIMEOUT, str(e) or f"超过{self.timeout}秒")
+        except aiohttp.ClientPayloadError as e:
+            raise SynthesisError(DOWNLOAD_FAILED, str(e) or type(e).__name__)
+        except (aiohttp.ClientConnectionError, ConnectionError) as e:
+            raise SynthesisError(CONNECTION, str(e) or type(e).__name__)
+        except aiohttp.ClientError as e:
+            raise SynthesisError(BAD_RESPONSE, str(e) or type(e).__name__)
+
+    async def _attempt(self, session, job):
+        """
+        经过熔断器发起一次请求，返回None表示成功，否则返回SynthesisError
+
+        服务器连续不可用时circuit_breaker暂停所有请求，等服务器恢复后再继续，不会把排队的任务全部耗成失败。
+        job.latency只计请求本身，不含暂停、熔断和限速的等待。
+        """
+        breaker = self.circuit_breaker
+        await self._running.wait()
+        try:
+            await breaker.acquire()
+        except SynthesisError as e:
+            return e
+        try:
+            await self.rate_limiter.acquire()
+            if self.models > 1:
+                # 每次尝试都重新确认模型：退避或排队期间服务器可能已切换到别的模型；
+                # 从这里到计入_server_requests之间没有await，切换不会插进来
+                await self._use_model(session, job.model_name)
+        except asyncio.CancelledError:
+            # 可能拿着半开状态的探测名额
+            breaker.record_neutral()
+            raise
+        backend = self.backends.pick()
+        throttled = self._throttled()
+        paused_total = self._paused_total
+        start = time.monotonic()
+        error = None
+        self._server_requests += 1
+        self._server_idle.clear()
+        try:
+            await self.synthesize(session, job, backend)
+        except SynthesisError as e:
+            error = e
+        except asyncio.CancelledError:
+            self.backends.abandon(backend)
+            breaker.record_neutral()
+            raise
+        except Exception as e:
+            error = SynthesisError(WRITE_FAILED if isinstance(e, OSError) else BAD_RESPONSE,
+                                   str(e) or type(e).__name__)
+        finally:
+            self._server_requests -= 1
+            if not self._server_requests:
+                self._server_idle.set()
+        latency = time.monotonic() - start
+        job.latency = latency
+        job.throttled = throttled or self._throttled() or self._paused_total != paused_total
+        self.backends.release(backend, latency, error)
+        self._record(job, latency, error)
+        self.stats.add("requests", label="success" if error is None else error.reason)
+        self.stats.observe("request", latency, backend.name)
+
+        if error is None:
+            breaker.record_success()
+        elif error.backend_down:
+            breaker.record_failure()
+        elif error.reason == WRITE_FAILED:
+            breaker.record_neutral()
+        else:
+            breaker.record_success()
+        return error
+
+    def _throttled(self):
+        """是否正在暂停或限速：这时服务器的负载与正常运行不同"""
+        return self.paused or self._paused_at is not None or self.rate_limiter.rate > 0
+
+    async def _from_cache(self, job):
+        """缓存中有job的音频时直接写到输出路径，返回是否命中；没有缓存时返回False且不计数"""
+        if not self.cache:
+            return False
+        if await self._in_writer(self.cache.materialize, job.key, job.output_path):
+            self.stats.add("cache_hits")
+            return True
+        self.stats.add("cache_misses")
+        return False
+
+    async def _fetch(self, session, job, started=False):
+        """从缓存或服务器取得音频写到job.output_path，返回(错误, 来源)；started=True表示已经发过start、记过运行中"""
+        if await self._from_cache(job):
+            return None, "cache"
+
+        if self.models > 1:
+            await self._use_model(session, job.model_name)
+        if not started:
+            await self._start(job)
+        pieces = split_text(job.text, self.split_chars) if 0 < self.split_chars < len(job.text) else []
+        if len(pieces) > 1:
+            error = await self._synthesize_split(session, job, pieces)
+        else:
+            error = await self._synthesize_retrying(session, job)
+        if error is not None:
+            return error, None
+        if job.ttfb is not None:
+            self.ttfbs.append(job.ttfb)
+        if self.cache:
+            await self._in_writer(self.cache.put, job.key, job.output_path)
+        return None, None
+
+    async def _start(self, job):
+        """通知界面开始合成job，并在日志中记为运行中"""
+        self._emit("start", job)
+        await self._in_writer(self._journal(job).mark_running, job)
+
+    async def _synthesize_retrying(self, session, job, parent=None):
+        """
+        请求服务器直到成功或不再重试，返回None或最后一次的SynthesisError；parent为拆分前的整行任务
+
+        可重试的失败按retry_policy指数退避，停滞的请求立即重新排队。成功请求的耗时记入durations，
+        暂停或限速期间的不记（见_attempt）。
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            job.attempts = attempt
+            error = await self._attempt(session, job)
+            if error is None:
+                if not job.throttled:
+                    self._observe(job)
+                return None
+            if not self.retry_policy.should_retry(error, attempt) or self.stop_requested:
+                return error
+            self.stats.add("retries")
+            self._emit("retry", parent or job, error)
+            if error.reason != STALLED:
+                # 停滞的请求立即重新排队，交给当前最空闲的后端
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+
+    async def _synthesize_piece(self, session, piece, parent):
+        """合成拆分出的一段，和普通任务一样占用一个并发名额，命中缓存或有相同的段在途时不请求服务器"""
+        error, _ = await self._single_flight(piece, lambda: self._fetch_piece(session, piece, parent))
+        return error
+
+    async def _fetch_piece(self, session, piece, parent):
+        if self.cache and await self._in_writer(self.cache.materialize, piece.key, piece.output_path):
+            return None, "cache"
+        await self.limiter.acquire()
+        try:
+            error = await self._synthesize_retrying(session, piece, parent)
+        finally:
+            self.limiter.release()
+        if error is None and self.cache:
+            await self._in_writer(self.cache.put, piece.key, piece.output_path)
+        return error, None
+
+    async def _synthesize_split(self, session, job, pieces):
+        """
+        把长台词拆成几段并行合成，再交叉淡化拼接到job.output_path
+
+        等待期间让出本任务的并发名额，由各段分别排队占用，空闲的名额都能用来合成同一行的不同段。
+        """
+        parts_dir = os.path.join(os.path.dirname(job.output_path), PARTS_DIR)
+        # 前缀不含冒号，strip_speaker只去掉前缀，得到的文本就是这一段
+        piece_jobs = [SynthesisJob(job.index, f"{job.filename}#{i}:{piece}", parts_dir, job.model_name,
+                                   job.speed_factor, job.source) for i, piece in enumerate(pieces)]
+        paths = [piece.output_path for piece in piece_jobs]
+        start = time.monotonic()
+        self.limiter.release()
+        try:
+            try:
+                errors = await asyncio.gather(*(self._synthesize_piece(session, piece, job) for piece in piece_jobs))
+            finally:
+                await self.limiter.acquire()
+            job.attempts = max(piece.attempts for piece in piece_jobs)
+            ttfbs = [piece.ttfb for piece in piece_jobs if piece.ttfb is not None]
+            job.ttfb = min(ttfbs) if ttfbs else None
+            error = next((error for error in errors if error is not None), None)
+            if error is None:
+                error = await self._stitch(paths, job.output_path)
+            if error is None:
+                self.split_lines += 1
+                self.split_pieces += len(pieces)
+        finally:
+            for path in paths:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+            with contextlib.suppress(OSError):
+                os.rmdir(parts_dir)
+        job.latency = time.monotonic() - start
+        return error
+
+    async def _stitch(self, paths, output_path):
+        """在工作线程中拼接各段写到output_path，返回None或SynthesisError"""
+        try:
+            await asyncio.to_thread(self._stitch_files, paths, output_path)
+        except OSError as e:
+            return SynthesisError(WRITE_FAILED, str(e))
+        except (ValueError, EOFError, wave.Error) as e:
+            return SynthesisError(BAD_RESPONSE, f"拼接失败: {e}")
+        return None
+
+    def _stitch_files(self, paths, output_path):
+        with atomic_write(output_path) as f:
+            stitch_wavs(paths, f, self.crossfade_ms, FRAGMENT_INTERVAL)
+
+    async def _synthesize_pack(self, session, jobs):
+        """一次请求合成jobs中的几行短台词，切回各自的输出文件，成功返回True"""
+        if self.models > 1:
+            await self._use_model(session, jobs[0].model_name)
+        for job in jobs:
+            await self._start(job)
+        first = jobs[0]
+        parts_dir = os.path.join(os.path.dirname(first.output_path), PARTS_DIR)
+        # 前缀不含冒号，合并的台词里也没有冒号
+        pack = SynthesisJob(first.index, f"{first.filename}#pack:{pack_text([job.text for job in jobs])}",
+                            parts_dir, first.model_name, first.speed_factor, first.source)
+        # 失败时不重试整个合并请求，直接逐行合成，每行有自己的重试
+        error = await self._attempt(session, pack)
+        try:
+            if error is None:
+                error = await asyncio.to_thread(self._unpack, pack.output_path, jobs)
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(pack.output_path)
+            with contextlib.suppress(OSError):
+                os.rmdir(parts_dir)
+        if error is not None:
+            self.pack_fallbacks += 1
+            return False
+        self.packed_requests += 1
+        self.packed_lines += len(jobs)
+        if pack.ttfb is not None:
+            self.ttfbs.append(pack.ttfb)
+        for job in jobs:
+            job.attempts = 1
+            job.latency = pack.latency
+            job.ttfb = pack.ttfb
+            if self.cache:
+                await self._in_writer(self.cache.put, job.key, job.output_path)
+        return True
+
+    def _unpack(self, path, jobs):
+        """把合并请求的音频按静音切开写到各行的输出路径，返回None或SynthesisError"""
+        try:
+            result = split_on_silence(path, len(jobs), FRAGMENT_INTERVAL)
+            if result is None:
+                return SynthesisError(BAD_RESPONSE, "切分出的段数与行数不一致")
+            params, segments = result
+            for job, frames in zip(jobs, segments):
+                with atomic_write(job.output_path) as f:
+                    write_pcm(f, params, frames)
+        except OSError as e:
+            return SynthesisError(WRITE_FAILED, str(e))
+        except (ValueError, EOFError, wave.Error) as e:
+            return SynthesisError(BAD_RESPONSE, f"切分失败: {e}")
+        return None
+
+    async def _use_model(self, session, model_name):
+        """
+        等服务器切换到model_name：先排空在途请求，再预热新模型；同一时间只有一个任务负责切换
+
+        任务中有多个模型时按模型分批派发，不同模型的请求不会在服务器上交错、反复加载权重。
+        _fetch和_synthesize_pack在报告开始之前调用一次，_attempt在每次发出请求之前（包括重试）再确认一次。
+        """
+        # 正在切换时即使当前模型就是model_name也要等：切换者在等服务器空闲、随后预热新模型，不能再发请求
+        while self.current_model != model_name or self._switching is not None:
+            if self._switching is not None:
+                await asyncio.shield(self._switching)
+                continue
+            self._switching = asyncio.get_running_loop().create_future()
+            try:
+                await self._server_idle.wait()
+                await self._warm_up(session, model_name)
+                if self.current_model is not None:
+                    self.model_switches += 1
+                self.current_model = model_name
+            finally:
+                self._switching.set_result(None)
+                self._switching = None
+
+    async def _warm_up_backend(self, session, backend, model_name):
+        """发一条短请求让后端加载模型，结果丢弃；失败不影响后续请求"""
+        data = build_request(backend, WARM_UP_TEXT, model_name)
+        try:
+            async with session.post(backend.endpoint, json=data) as response:
+                if backend.api == API_TTS or response.status != 200:
+                    await response.read()
+                    return
+                result = await response.json(content_type=None)
+            if isinstance(result, dict) and result.get("audio_url"):
+                async with session.get(result["audio_url"]) as audio_response:
+                    await audio_response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError):
+            pass
+
+    async def _warm_up(self, session, model_name):
+        backends = [backend for backend in self.backends.backends if backend.healthy] or self.backends.backends
+        await asyncio.gather(*(self._warm_up_backend(session, backend, model_name) for backend in backends))
+        self._emit("model", None, model_name)
+
+    async def _single_flight(self, job, fetch):
+        """
+        同一个synthesis key同时只取一次音频（singleflight），返回(错误, 来源)
+
+        fetch()查缓存、请求服务器，把音频写到job.output_path。同一个key已有任务在途时
+        （如不同台词拆出的相同一段，或与某段相同的短台词），后来的任务不查缓存、不请求服务器，
+        只登记自己的输出路径，由在途的任务完成后硬链接/复制过去：拆出的段合成完就会被删除，
+        不能等跟随者自己去复制。
+        """
+        flight = self._flights.get(job.key)
+        if flight is not None:
+            done, followers = flight
+            followers.append(job.output_path)
+            errors = await asyncio.shield(done)
+            self.calls_saved += 1
+            return errors[job.output_path], "dedup"
+
+        done = asyncio.get_running_loop().create_future()
+        followers = []
+        self._flights[job.key] = (done, followers)
+        error, via = SynthesisError(BAD_RESPONSE, "任务被中断"), None
+        copied = {}
+        try:
+            error, via = await fetch()
+            del self._flights[job.key]
+            if error is None and followers:
+                copied = await asyncio.to_thread(self._link_outputs, job.output_path, followers)
+        finally:
+            self._flights.pop(job.key, None)
+            interrupted = error or SynthesisError(BAD_RESPONSE, "任务被中断")
+            done.set_result({path: copied.get(path, interrupted) for path in followers})
+        return error, via
+
+    @staticmethod
+    def _link_outputs(source, paths):
+        """把source硬链接/复制到各个路径，返回路径 → None或SynthesisError"""
+        errors = {}
+        for path in paths:
+            try:
+                link_or_copy(source, path)
+                errors[path] = None
+            except OSError as e:
+                errors[path] = SynthesisError(WRITE_FAILED, str(e))
+        return errors
+
+    async def _copy_output(self, source, output_path):
+        try:
+            await asyncio.to_thread(link_or_copy, source, output_path)
+        except OSError as e:
+            return SynthesisError(WRITE_FAILED, str(e))
+        return None
+
+    async def _finish(self, job, error, via):
+        if error is None:
+            await self._in_writer(self._journal(job).mark_done, job, job.attempts, job.latency)
+            self._emit("success", job, via)
+        else:
+            await self._in_writer(self._journal(job).mark_failed, job, error, job.attempts, job.latency)
+            self.failure_reasons[error.reason] += 1
+            self._emit("failed", job, error)
+
+    async def _pending(self, group):
+        """跳过不需要合成的任务，返回剩下的任务，第一个是实际请求服务器的主任务"""
+        pending = []
+        seen = set()
+        for job in group:
+            if not job.text:
+                await self._in_writer(self._journal(job).mark_skipped, job)
+                self._emit("skipped", job)
+            elif job.output_path in seen:
+                self._emit("skipped", job, "重复")
+            elif job.resume_state == "done":
+                seen.add(job.output_path)
+                self._emit("skipped", job, "已存在")
+            elif job.resume_state is None and os.path.exists(job.output_path):
+                # 日志之前就已存在的文件，视为用当前参数生成的
+                seen.add(job.output_path)
+                await self._in_writer(self._journal(job).mark_done, job)
+                self._emit("skipped", job, "已存在")
+            else:
+                seen.add(job.output_path)
+                pending.append(job)
+        return pending
+
+    async def _finish_pending(self, pending, error, via):
+        """主任务完成后，同一组其余的任务复用它的输出"""
+        primary = pending[0]
+        await self._finish(primary, error, via)
+        for job in pending[1:]:
+            self.calls_saved += 1
+            job_error = error if error is not None else await self._copy_output(primary.output_path, job.output_path)
+            await self._finish(job, job_error, "dedup")
+
+    async def _complete(self, session, pending, started=False):
+        error, via = await self._single_flight(pending[0], lambda: self._fetch(session, pending[0], started))
+        await self._finish_pending(pending, error, via)
+
+    async def _complete_queued(self, session, pending):
+        """合并请求失败后退回逐行合成：每行重新排队占用一个并发名额，合并时已经发过start"""
+        await self.limiter.acquire()
+        try:
+            await self._complete(session, pending, started=True)
+        finally:
+            self.limiter.release()
+
+    async def _run_group(self, session, group):
+        """处理synthesis key相同的一组任务（如不同角色的“嗯。”），只请求一次服务器，其余输出用硬链接/复制得到"""
+        pending = await self._pending(group)
+        if pending:
+            await self._complete(session, pending)
+
+    async def _run_pack(self, session, groups):
+        """
+        把几组短台词合并成一次请求，让服务器的batch_size/parallel_infer真正起作用
+
+        缓存命中的行直接完成；合并请求失败或切分对不上时让出本任务的并发名额，各行分别排队逐行合成。
+        """
+        batch = []
+        for group in groups:
+            pending = await self._pending(group)
+            if not pending:
+                continue
+            if await self._from_cache(pending[0]):
+                await self._finish_pending(pending, None, "cache")
+            else:
+                batch.append(pending)
+        if len(batch) > 1 and await self._synthesize_pack(session, [pending[0] for pending in batch]):
+            for pending in batch:
+                await self._finish_pending(pending, None, "pack")
+        elif len(batch) == 1:
+            await self._complete(session, batch[0])
+        elif batch:
+            self.limiter.release()
+            try:
+                await asyncio.gather(*(self._complete_queued(session, pending) for pending in batch))
+            finally:
+                await self.limiter.acquire()
+
+    def _units(self, groups):
+        """
+        派发单元：每个单元是一组或几组任务
+
+        pack_lines>1时相邻的、同模型同语速的可合并短台词每pack_lines组合成一个单元，其余每组单独一个单元。
+        """
+        units = []
+        batch = []
+        for group in groups:
+            job = group[0]
+            if self.pack_lines < 2 or not packable(job.text, self.pack_chars):
+                units.append([group])
+                continue
+            if batch and (len(batch) >= self.pack_lines or (batch[0][0].model_name, batch[0][0].speed_factor)
+                          != (job.model_name, job.speed_factor)):
+                units.append(batch)
+                batch = []
+            batch.append(group)
+        if batch:
+            units.append(batch)
+        return units
+
+    def _sample_count(self):
+        return sum(len(samples) for samples in self.durations.samples.values())
+
+    def _observe(self, job):
+        """记录成功合成的耗时；运行开始时没有历史记录的话，用本次运行最初的样本重新拟合一次预计耗时"""
+        self.durations.observe(job.model_name, job.speed_factor, len(job.text), job.latency)
+        if self._expected_fitted or self._sample_count() < MIN_SAMPLES:
+            return
+        self._expected_fitted = True
+        self._expected_durations = copy.deepcopy(self.durations)
+        if self.controller:
+            # 先验的固定开销与每字耗时之比和实际的不同，按先验算出的相对延迟建立的基线不能再用
+            self.controller.reset_baseline()
+
+    def _record(self, job, latency, error):
+        """把一次请求交给AIMDController；只有超时、连接失败、5xx这类说明服务器过载的失败算作拥塞"""
+        if self.controller is None or (error is not None and not error.backend_down):
+            return
+        expected = self._expected_durations.predict(job.model_name, job.speed_factor, len(job.text))
+        new_limit = self.controller.record(latency, error is not None, expected)
+        if new_limit is not None:
+            self._emit("concurrency", None, new_limit)
+
+    async def _probe(self, session, backend):
+        timeout = aiohttp.ClientTimeout(total=HEALTH_CHECK_TIMEOUT)
+        try:
+            async with session.get(backend.url + "/", timeout=timeout) as response:
+                healthy = response.status < 500
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+            healthy = False
+        self.backends.set_health(backend, healthy)
+
+    async def _check_health(self, session):
+        """定期探测已摘除和空闲的后端（服务器有任何非5xx响应即视为可用）"""
+        while True:
+            # 每个后端的探测间隔由probes_due控制，这里只决定检查的粒度
+            await asyncio.sleep(min(1.0, self.backends.check_interval))
+            due = self.backends.probes_due()
+            if due:
+                await asyncio.gather(*(self._probe(session, backend) for backend in due))
+
+    def _cost(self, unit):
+        """预测一个派发单元的耗时，续跑时已完成的为0"""
+        texts = [group[0].text for group in unit
+                 if any(job.text and job.resume_state != "done" for job in group)]
+        if not texts:
+            return 0.0
+        job = unit[0][0]
+        text = pack_text(texts) if len(texts) > 1 else texts[0]
+        return self.durations.predict(job.model_name, job.speed_factor, len(text))
+
+    def _schedule(self, units):
+        """
+        把派发单元放进优先队列
+
+        排序键依次为模型的分批顺序、预测耗时（longest_first时从长到短，即LPT）、原顺序，返回堆。
+        避免长台词排在最后拖长整批的完成时间。
+        """
+        model_order = {}
+        queue = []
+        for seq, unit in enumerate(units):
+            rank = model_order.setdefault(unit[0][0].model_name, len(model_order))
+            cost = self._cost(unit)
+            queue.append((rank, -cost if self.longest_first else 0.0, seq, cost, unit))
+        heapq.heapify(queue)
+        self.predicted_total = sum(entry[3] for entry in queue)
+        return queue
+
+    async def _run_unit(self, session, unit, cost):
+        try:
+            if len(unit) == 1:
+                await self._run_group(session, unit[0])
+            else:
+                await self._run_pack(session, unit)
+        finally:
+            self.predicted_done += cost
+
+    async def _dispatch(self, queue):
+        limiter = self.limiter
+        tasks = self._tasks
+
+        def on_done(task):
+            tasks.discard(task)
+            self.in_flight -= 1
+            limiter.release()
+
+        timeout = aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.connect_timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(headers=DEFAULT_HEADERS, timeout=timeout, connector=connector) as session:
+            health_task = asyncio.create_task(self._check_health(session)) if len(self.backends) > 1 else None
+            try:
+                while queue:
+                    await self._running.wait()
+                    if self.stop_requested:
+                        break
+                    _, _, _, cost, unit = heapq.heappop(queue)
+                    await limiter.acquire()
+                    if self.stop_requested:
+                        limiter.release()
+                        break
+                    if self.controller:
+                        self.controller.on_dispatch()
+                    self.in_flight += 1
+                    task = asyncio.create_task(self._run_unit(session, unit, cost))
+                    tasks.add(task)
+                    task.add_done_callback(on_done)
+                if tasks:
+                    # 被stop(cancel=True)取消的任务不算出错，其余异常照常抛出
+                    done, _ = await asyncio.wait(set(tasks))
+                    for task in done:
+                        if not task.cancelled() and task.exception() is not None:
+                            raise task.exception()
+            finally:
+                if health_task:
+                    health_task.cancel()
+
+    async def run_async(self, jobs, only_failed=False):
+        """metrics_port不为0时运行期间在metrics_host:metrics_port上提供Prometheus格式的/metrics（见tts_metrics）"""
+        metrics = None
+        if self.metrics_port:
+            try:
+                metrics = MetricsServer(self, self.metrics_port, self.metrics_host).start_background()
+            except OSError as e:
+                raise ValueError(f"无法在{self.metrics_host}:{self.metrics_port}上提供/metrics: {e}")
+        self._loop = asyncio.get_running_loop()
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-writer")
+        try:
+            jobs = await self._plan_resume(jobs, only_failed)
+            self.planned = len(jobs)
+            self._emit("planned", None, self.planned)
+            self.models = len({job.model_name for job in jobs})
+            self.file_order_switches = count_model_switches(jobs)
+            self._server_idle = asyncio.Event()
+            self._server_idle.set()
+            self._running = asyncio.Event()
+            self._running.set()
+            self._apply_pause()
+            groups = group_jobs(jobs)
+            self.duplicates = len(jobs) - len(groups)
+            queue = self._queue = self._schedule(self._units(groups))
+            # 用运行开始时的预测作为预计耗时：运行中学到的耗时已包含过载的排队，拿来比较就看不出延迟上升
+            self._expected_durations = copy.deepcopy(self.durations)
+            self._expected_fitted = self._sample_count() >= MIN_SAMPLES
+            self._started = time.monotonic()
+            await self._dispatch(queue)
+        finally:
+            try:
+                # 排在前面的日志更新都写完之后才关闭
+                self._writer.submit(self._close_journals).result()
+            finally:
+                self._writer.shutdown()
+                self._writer = None
+            self._loop = None
+            self._queue = None
+            self.journals = {}
+            if metrics:
+                metrics.close()
+        return self.counts
+
+    def run(self, jobs, only_failed=False):
+        """阻塞运行直到所有任务完成或被停止，返回计数"""
+        return asyncio.run(self.run_async(jobs, only_failed))
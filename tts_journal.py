@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import time
+
+JOURNAL_NAME = ".tts_journal.db"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    file TEXT PRIMARY KEY,
+    line_index INTEGER,
+    original_line TEXT,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    done_key TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    latency REAL,
+    error TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state);
+"""
+
+
+class ResumePlan:
+    """journal.plan()的结果，均为文件名集合"""
+
+    def __init__(self, done, stale, failed):
+        # 已用当前参数完成，无需再检查文件
+        self.done = done
+        # 磁盘上的文件是用旧参数生成的，需要重新合成
+        self.stale = stale
+        # 上一次运行失败的
+        self.failed = failed
+
+
+class JobJournal:
+    """
+    合成任务日志（SQLite，WAL模式）
+
+    保存在输出目录下，每个输出文件一行，记录synthesis key、状态、尝试次数、耗时和失败原因。
+    key是希望得到的参数指纹，done_key是磁盘上现有文件的参数指纹，两者相等即为已完成。
+    续跑时用一次按state索引的查询得到已完成的文件，不再逐个stat输出文件。
+    写入先攒在事务里，每commit_interval秒提交一次，崩溃最多丢失最近一小段进度，
+    对应的台词下次重新合成即可（输出文件是原子写入的）。
+    只能在创建它的线程中使用。
+    """
+
+    def __init__(self, output_dir, commit_interval=0.5):
+        os.makedirs(output_dir, exist_ok=True)
+        self.path = os.path.join(output_dir, JOURNAL_NAME)
+        self.commit_interval = commit_interval
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self._last_commit = time.monotonic()
+
+    def _files(self, sql, *params):
+        return {row[0] for row in self.conn.execute(sql, params)}
+
+    def plan(self, jobs):
+        """登记本次运行的任务，返回ResumePlan"""
+        failed = self._files("SELECT file FROM jobs WHERE state = ?", FAILED)
+        now = time.time()
+        self.conn.executemany("""
+            INSERT INTO jobs (file, line_index, original_line, key, state, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(file) DO UPDATE SET
+                line_index = excluded.line_index,
+                original_line = excluded.original_line,
+                key = excluded.key,
+                state = CASE
+                    WHEN jobs.done_key = excluded.key THEN 'done'
+                    WHEN jobs.state = 'failed' AND jobs.key = excluded.key THEN 'failed'
+                    ELSE 'pending' END,
+                updated_at = excluded.updated_at
+        """, [(job.filename, job.index, job.original_line, job.key, PENDING, now) for job in jobs])
+        self.conn.commit()
+        done = self._files("SELECT file FROM jobs WHERE state = ?", DONE)
+        stale = self._files("SELECT file FROM jobs WHERE state != ? AND done_key IS NOT NULL", DONE)
+        return ResumePlan(done, stale, failed)
+
+    def _update(self, job, state, **fields):
+        fields["state"] = state
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self.conn.execute(f"UPDATE jobs SET {columns} WHERE file = ?", (*fields.values(), job.filename))
+        if time.monotonic() - self._last_commit >= self.commit_interval:
+            self.commit()
+
+    def mark_running(self, job):
+        self._update(job, RUNNING)
+
+    def mark_done(self, job, attempts=0, latency=None):
+        self._update(job, DONE, done_key=job.key, attempts=attempts, latency=latency, error=None)
+
+    def mark_failed(self, job, error, attempts=0, latency=None):
+        self._update(job, FAILED, attempts=attempts, latency=latency, error=str(error))
+
+    def mark_skipped(self, job):
+        self._update(job, SKIPPED)
+
+    def reset_running(self):
+        """把中止时仍在合成的任务恢复为待处理"""
+        self.conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE state = ?", (PENDING, time.time(), RUNNING))
+
+    def counts(self):
+        """各状态的任务数"""
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    def commit(self):
+        self.conn.commit()
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,106 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tts_stats import LATENCY_BUCKETS
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(**labels):
+    """按Prometheus文本格式写出标签，值中的反斜杠、引号和换行要转义"""
+    items = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for name, value in labels.items() if value is not None]
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+
+def render_metrics(engine):
+    """
+    把引擎当前的统计快照写成Prometheus文本格式
+
+    只读取engine.stats.snapshot()和几个计数属性，不碰合成用的数据结构，可以在任何线程调用。
+    """
+    stats = engine.stats.snapshot()
+    out = []
+
+    def metric(name, kind, help_text, samples):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            out.append(f"{name}{labels} {value:g}" if isinstance(value, float) else f"{name}{labels} {value}")
+
+    metric("tts_lines_total", "counter", "按结果统计的台词行数",
+           [(_labels(outcome=outcome), stats[outcome]) for outcome in ("success", "failed", "skipped")])
+    metric("tts_requests_total", "counter", "发往服务器的请求数，outcome为success或失败原因",
+           [(_labels(outcome=outcome), count) for outcome, count in sorted(stats.labelled("requests").items())])
+    metric("tts_retries_total", "counter", "重试次数", [("", stats["retries"])])
+    hits, misses = stats["cache_hits"], stats["cache_misses"]
+    metric("tts_cache_hits_total", "counter", "合成缓存命中次数", [("", hits)])
+    metric("tts_cache_misses_total", "counter", "合成缓存未命中次数", [("", misses)])
+    metric("tts_cache_hit_ratio", "gauge", "合成缓存命中率", [("", hits / (hits + misses) if hits + misses else 0.0)])
+    metric("tts_bytes_written_total", "counter", "从服务器收到并写入文件的音频字节数", [("", stats["bytes"])])
+    metric("tts_queue_depth", "gauge", "还没有派发的任务单元数", [("", engine.queue_depth)])
+    metric("tts_in_flight", "gauge", "在途的任务单元数", [("", engine.in_flight)])
+    metric("tts_concurrency_limit", "gauge", "当前允许的最大在途请求数", [("", engine.concurrency_limit)])
+    eta = engine.eta()
+    if eta is not None:
+        metric("tts_eta_seconds", "gauge", "预计剩余秒数", [("", float(eta))])
+    metric("tts_backend_up", "gauge", "后端是否健康", [(_labels(backend=backend.name), int(backend.healthy))
+                                                      for backend in engine.backends.backends])
+
+    out.append("# HELP tts_stage_latency_seconds 各阶段耗时：request整次请求，infer推理，download下载，write写文件")
+    out.append("# TYPE tts_stage_latency_seconds histogram")
+    for (stage, backend), histogram in sorted(stats.histograms.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram):
+            cumulative += count
+            le = bound if isinstance(bound, str) else f"{bound:g}"
+            out.append(f"tts_stage_latency_seconds_bucket{_labels(stage=stage, backend=backend, le=le)} {cumulative}")
+        labels = _labels(stage=stage, backend=backend)
+        out.append(f"tts_stage_latency_seconds_sum{labels} {histogram[-1]:g}")
+        out.append(f"tts_stage_latency_seconds_count{labels} {cumulative}")
+    return "\n".join(out) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """只提供GET /metrics"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics(self.server.engine).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    在本机端口上提供Prometheus格式的/metrics，供长时间运行时接入监控
+
+    每次抓取时读一次引擎的统计快照，工作线程记录统计时不加锁，抓取不会拖慢合成。
+    默认只监听127.0.0.1，要让其他机器上的Prometheus抓取时把host设为0.0.0.0。
+    """
+    daemon_threads = True
+
+    def __init__(self, engine, port, host="127.0.0.1"):
+        super().__init__((host, port), MetricsHandler)
+        self.engine = engine
+
+    def start_background(self):
+        """在后台线程中运行，返回服务器自身"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
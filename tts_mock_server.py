@@ -0,0 +1,502 @@
+import argparse
+import array
+import hashlib
+import io
+import json
+import random
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_RATE = 32000
+# 与GPT-SoVITS的“按标点符号切”一致，切开的片段之间插入fragment_interval秒静音
+SPLIT_PATTERN = re.compile(r'(?<=[。！？!?；;…\n])')
+
+# 可注入的错误类型
+ERROR_HTTP_500 = "http500"
+ERROR_BUSY = "busy"
+ERROR_SYNTHESIS = "synthesis"
+ERROR_BAD_JSON = "bad_json"
+ERROR_MISSING_AUDIO = "missing_audio"
+ERROR_DISCONNECT = "disconnect"
+# 音频发出一部分后不再发送数据
+ERROR_STALL = "stall"
+ERROR_KINDS = [ERROR_HTTP_500, ERROR_BUSY, ERROR_SYNTHESIS, ERROR_BAD_JSON, ERROR_MISSING_AUDIO, ERROR_DISCONNECT,
+               ERROR_STALL]
+
+# api_v2的/tts接受的字段和取值；模拟服务器比真实服务器严格，多出的字段（如/infer_single的speed_facter）也拒绝
+TTS_FIELDS = {"text", "text_lang", "ref_audio_path", "aux_ref_audio_paths", "prompt_text", "prompt_lang", "top_k",
+              "top_p", "temperature", "text_split_method", "batch_size", "batch_threshold", "split_bucket",
+              "speed_factor", "fragment_interval", "seed", "media_type", "streaming_mode", "parallel_infer",
+              "repetition_penalty", "sample_steps", "super_sampling"}
+TTS_LANGUAGES = {"zh", "en", "ja", "ko", "yue", "all_zh", "all_ja", "all_yue", "all_ko", "auto", "auto_yue"}
+TTS_SPLIT_METHODS = {"cut0", "cut1", "cut2", "cut3", "cut4", "cut5"}
+# 测试用的/tts后端的参考音频
+MOCK_REF_AUDIO = "mock/ref.wav"
+
+
+def check_tts_request(data):
+    """按api_v2的规则检查/tts的请求体，返回错误信息，没有问题时返回None"""
+    if not isinstance(data, dict):
+        return "参数错误"
+    unknown = set(data) - TTS_FIELDS
+    if unknown:
+        return f"unknown fields: {', '.join(sorted(unknown))}"
+    if not isinstance(data.get("text"), str) or not data["text"]:
+        return "text is required"
+    if not data.get("ref_audio_path"):
+        return "ref_audio_path is required"
+    for field in ("text_lang", "prompt_lang"):
+        if not data.get(field):
+            return f"{field} is required"
+        if data[field] not in TTS_LANGUAGES:
+            return f"{field}: {data[field]} is not supported"
+    if data.get("media_type", "wav") != "wav":
+        return f"media_type: {data['media_type']} is not supported"
+    if data.get("text_split_method", "cut5") not in TTS_SPLIT_METHODS:
+        return f"text_split_method:{data['text_split_method']} is not supported"
+    speed_factor = data.get("speed_factor", 1.0)
+    if isinstance(speed_factor, bool) or not isinstance(speed_factor, (int, float)) or speed_factor <= 0:
+        return f"speed_factor: {speed_factor} is not supported"
+    return None
+
+
+def voice_of(data):
+    """决定音频内容的音色和语速：/infer_single是model_name和speed_facter，/tts是参考音频和speed_factor"""
+    if "ref_audio_path" in data:
+        return data["ref_audio_path"], data.get("speed_factor", 1.0)
+    return data.get("model_name", ""), data.get("speed_facter", 1.0)
+
+
+def wav_header(data_size, sample_rate=SAMPLE_RATE):
+    """16bit单声道WAV头"""
+    header = io.BytesIO()
+    header.write(b"RIFF")
+    header.write(struct.pack("<I", 36 + data_size))
+    header.write(b"WAVEfmt ")
+    header.write(struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16))
+    header.write(b"data")
+    header.write(struct.pack("<I", data_size))
+    return header.getvalue()
+
+
+def tone_samples(frame_count, seed, amplitude=8000):
+    """
+    由seed决定音高的方波PCM
+
+    只生成一个周期再整段重复，合成几十秒的音频也只要几毫秒，
+    不会让模拟服务器自己的CPU成为压测瓶颈。
+    """
+    period = 40 + seed % 120
+    half = period // 2
+    one_period = array.array("h", [amplitude] * half + [-amplitude] * (period - half)).tobytes()
+    repeats = frame_count // period + 1
+    return (one_period * repeats)[:frame_count * 2]
+
+
+def speech_fragments(text, model_name="", speed_factor=1.0, seconds_per_char=0.05, fragment_interval=0.3,
+                     sample_rate=SAMPLE_RATE):
+    """
+    按片段生成PCM，除最后一段外每段末尾带fragment_interval秒静音
+
+    按句末标点把文本切成片段，每段是一段方波（时长与字数成正比、与语速成反比），
+    和真实服务器的输出结构一致；流式返回时每合成完一段就发出一段。
+    """
+    speed = speed_factor if speed_factor and speed_factor > 0 else 1.0
+    silence = b"\x00" * (int(fragment_interval * sample_rate) * 2)
+    pieces = []
+    for fragment in SPLIT_PATTERN.split(text):
+        fragment = fragment.strip()
+        if not fragment:
+            continue
+        digest = hashlib.sha1(f"{model_name}:{fragment}".encode("utf-8")).digest()
+        frame_count = max(1, int(seconds_per_char * len(fragment) / speed * sample_rate))
+        pieces.append(tone_samples(frame_count, int.from_bytes(digest[:4], "little")))
+    if not pieces:
+        pieces.append(b"\x00" * (int(seconds_per_char * sample_rate) * 2))
+    return [piece + silence for piece in pieces[:-1]] + pieces[-1:]
+
+
+def speech_wav(text, model_name="", speed_factor=1.0, seconds_per_char=0.05, fragment_interval=0.3,
+               sample_rate=SAMPLE_RATE):
+    """模拟合成结果：同样的文本和参数总是得到同样的字节"""
+    data = b"".join(speech_fragments(text, model_name, speed_factor, seconds_per_char, fragment_interval,
+                                     sample_rate))
+    return wav_header(len(data), sample_rate) + data
+
+
+class MockTTSHandler(BaseHTTPRequestHandler):
+    """模拟GPT-SoVITS的/infer_single接口（返回audio_url）和/tts接口（直接返回音频）"""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # 头部与正文分两次写出，不关Nagle的话keep-alive连接会卡在延迟ACK上
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, obj):
+        self._send(status, json.dumps(obj, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def _disconnect(self):
+        """不回复直接断开连接"""
+        self.close_connection = True
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _send_stalled(self, body, content_type):
+        """发出响应头和一半正文后停住，stall_time秒后断开"""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body[:len(body) // 2])
+        self.wfile.flush()
+        time.sleep(self.server.stall_time)
+        self._disconnect()
+
+    def _write_chunk(self, data):
+        """HTTP分块传输的一块，空数据表示结束"""
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_error(self, error):
+        """按注入的错误类型回复，返回是否已经处理"""
+        if error == ERROR_HTTP_500:
+            self._send_json(500, {"msg": "Internal Server Error"})
+        elif error == ERROR_BUSY:
+            self._send_json(503, {"msg": "服务器繁忙"})
+        elif error == ERROR_SYNTHESIS:
+            self._send_json(200, {"msg": "合成失败"})
+        elif error == ERROR_BAD_JSON:
+            self._send(200, b"<html>502 Bad Gateway</html>", "text/html")
+        elif error == ERROR_DISCONNECT:
+            self._disconnect()
+        elif error == ERROR_MISSING_AUDIO and self.path == "/tts":
+            # api_v2合成出错时返回400和JSON
+            self._send_json(400, {"message": "tts failed"})
+        else:
+            return False
+        return True
+
+    def _stream(self, text, data):
+        """
+        流式/tts：每合成完一个片段发一块PCM
+
+        与api_v2一致，合成完第一个片段才发出响应头，长度为0的WAV头和第一块PCM一起发出。
+        """
+        server = self.server
+        if not server.enter():
+            self._send_json(503, {"msg": "服务器繁忙"})
+            return
+        try:
+            delay = server.service_time(len(text), server.active)
+            error = server.pick_error()
+            if error not in (None, ERROR_STALL, ERROR_DISCONNECT):
+                time.sleep(delay)
+                self._send_error(error)
+                return
+            pieces = server.render_fragments(text, data)
+            for i, piece in enumerate(pieces):
+                time.sleep(delay / len(pieces))
+                if error is not None and i == len(pieces) // 2:
+                    if error == ERROR_STALL:
+                        time.sleep(server.stall_time)
+                    self._disconnect()
+                    return
+                if not i:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "audio/wav")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    self._write_chunk(wav_header(0, server.sample_rate) + piece)
+                else:
+                    self._write_chunk(piece)
+                with server.lock:
+                    server.bytes_sent += len(piece)
+            self._write_chunk(b"")
+            with server.lock:
+                server.infer_count += 1
+        finally:
+            server.leave()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        self.server.network_delay()
+        if self.path not in ("/infer_single", "/tts"):
+            self._send_json(404, {"msg": "not found"})
+            return
+        try:
+            data = json.loads(raw.decode("utf-8"))
+        except ValueError:
+            self._send_json(400, {"msg": "参数错误"})
+            return
+        if self.path == "/tts":
+            message = check_tts_request(data)
+            if message:
+                self._send_json(400, {"message": message})
+                return
+        elif not isinstance(data, dict) or not isinstance(data.get("text"), str) or not data.get("model_name"):
+            self._send_json(400, {"msg": "参数错误"})
+            return
+
+        server = self.server
+        text = data["text"]
+        if self.path == "/tts" and data.get("streaming_mode"):
+            self._stream(text, data)
+            return
+        if not server.enter():
+            self._send_json(503, {"msg": "服务器繁忙"})
+            return
+        try:
+            time.sleep(server.load_model(data.get("model_name")) + server.service_time(len(text), server.active))
+        finally:
+            server.leave()
+
+        error = server.pick_error()
+        if self._send_error(error):
+            return
+
+        if self.path == "/tts":
+            body = server.render(text, data)
+            if error == ERROR_STALL:
+                self._send_stalled(body, "audio/wav")
+                return
+            with server.lock:
+                server.infer_count += 1
+                server.bytes_sent += len(body)
+            self._send(200, body, "audio/wav")
+            return
+
+        audio_id = uuid.uuid4().hex
+        if error != ERROR_MISSING_AUDIO:
+            body = server.render(text, data)
+            with server.lock:
+                server.audio[audio_id] = body
+                if error == ERROR_STALL:
+                    server.stalled_audio.add(audio_id)
+        with server.lock:
+            server.infer_count += 1
+        host, port = server.server_address[:2]
+        self._send_json(200, {"msg": "合成成功", "audio_url": f"http://{host}:{port}/audio/{audio_id}.wav"})
+
+    def do_GET(self):
+        server = self.server
+        server.network_delay()
+        if not self.path.startswith("/audio/"):
+            self._send_json(404, {"msg": "not found"})
+            return
+        audio_id = self.path[len("/audio/"):].rsplit(".", 1)[0]
+        with server.lock:
+            body = server.audio.pop(audio_id, None)
+            stalled = audio_id in server.stalled_audio
+            server.stalled_audio.discard(audio_id)
+        if body is None:
+            self._send_json(404, {"msg": "音频不存在"})
+            return
+        if stalled:
+            self._send_stalled(body, "audio/wav")
+            return
+        with server.lock:
+            server.bytes_sent += len(body)
+        self._send(200, body, "audio/wav")
+
+
+class MockTTSServer(ThreadingHTTPServer):
+    """
+    模拟TTS服务器
+
+    单次合成耗时 = (latency + latency_per_char * 字数) * 过载系数，
+    同时处理的请求数超过capacity后，过载系数为 1 + overload * 超出数 / capacity，
+    用来模拟GPU被挤满后延迟上升的曲线。capacity为0表示不限。
+    slots>0时最多同时合成slots个请求，其余排队（真实服务器通常一次只合成一条），
+    排队数超过max_queue时直接返回503。
+    音频时长 = seconds_per_char * 字数 / 语速，加上片段间的静音；内容只取决于文本、模型（/tts为参考音频）和语速。
+    rtt为每个HTTP请求额外的网络往返延迟，用来比较/infer_single（两次往返）和/tts（一次往返）。
+    服务器同一时间只加载一个模型，/infer_single请求的模型与当前模型不同时先花model_load_time秒切换模型。
+    /tts请求按api_v2检查请求体（check_tts_request），不合格时返回400和{"message": ...}。
+    error_rate为每次合成注入错误的概率，错误类型从error_kinds中随机选取，seed固定时结果可复现；
+    stall错误发出一部分音频后停住stall_time秒再断开。
+    /tts请求带streaming_mode=true时按片段分块返回，合成耗时平均分摊到各片段之前。
+    """
+    daemon_threads = True
+    # 默认的listen backlog只有5，几十个连接同时建立时SYN被丢弃，要等1秒重传
+    request_queue_size = 256
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, seconds_per_char=0.05, latency_per_char=0.0,
+                 capacity=0, overload=1.0, slots=0, max_queue=0, error_rate=0.0, error_kinds=None, seed=0,
+                 sample_rate=SAMPLE_RATE, model_load_time=0.0, rtt=0.0, stall_time=60.0):
+        super().__init__((host, port), MockTTSHandler)
+        self.latency = latency
+        self.seconds_per_char = seconds_per_char
+        self.latency_per_char = latency_per_char
+        self.capacity = capacity
+        self.overload = overload
+        self.slots = threading.Semaphore(slots) if slots else None
+        self.max_queue = max_queue
+        self.error_rate = error_rate
+        self.error_kinds = list(error_kinds or [ERROR_HTTP_500])
+        self.sample_rate = sample_rate
+        self.model_load_time = model_load_time
+        self.rtt = rtt
+        self.stall_time = stall_time
+        self.loaded_model = None
+        self.random = random.Random(seed)
+        self.active = 0
+        self.waiting = 0
+        self.lock = threading.Lock()
+        self.audio = {}
+        self.stalled_audio = set()
+        self.infer_count = 0
+        self.error_count = 0
+        self.rejected_count = 0
+        self.connection_count = 0
+        self.bytes_sent = 0
+        self.model_loads = 0
+
+    def service_time(self, text_length, active):
+        """按字数和当前并发计算本次合成耗时"""
+        base = self.latency + self.latency_per_char * text_length
+        if self.capacity and active > self.capacity:
+            base *= 1 + self.overload * (active - self.capacity) / self.capacity
+        return base
+
+    def network_delay(self):
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def load_model(self, model_name):
+        """切换到model_name，返回切换耗时；/tts请求没有模型（api_v2另有切换权重的接口），model_name为None"""
+        with self.lock:
+            if model_name is None or self.loaded_model == model_name:
+                return 0.0
+            self.loaded_model = model_name
+            self.model_loads += 1
+        return self.model_load_time
+
+    def enter(self):
+        """占用一个合成名额，排队已满时返回False"""
+        if self.slots is not None:
+            with self.lock:
+                if self.max_queue and self.waiting >= self.max_queue:
+                    self.rejected_count += 1
+                    return False
+                self.waiting += 1
+            self.slots.acquire()
+            with self.lock:
+                self.waiting -= 1
+        with self.lock:
+            self.active += 1
+        return True
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+        if self.slots is not None:
+            self.slots.release()
+
+    def pick_error(self):
+        """按error_rate决定本次是否注入错误，返回错误类型或None"""
+        if not self.error_rate:
+            return None
+        with self.lock:
+            if self.random.random() >= self.error_rate:
+                return None
+            self.error_count += 1
+            return self.random.choice(self.error_kinds)
+
+    def render(self, text, data):
+        """按请求参数生成音频"""
+        voice, speed_factor = voice_of(data)
+        return speech_wav(text, voice, speed_factor, self.seconds_per_char, data.get("fragment_interval", 0.3),
+                          self.sample_rate)
+
+    def render_fragments(self, text, data):
+        """按请求参数分片段生成PCM，拼接后与render()的数据部分相同"""
+        voice, speed_factor = voice_of(data)
+        return speech_fragments(text, voice, speed_factor, self.seconds_per_char, data.get("fragment_interval", 0.3),
+                                self.sample_rate)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def tts_url(self):
+        """把本服务器当作/tts后端时的地址（parse_backends格式），带上参考音频"""
+        return f"tts+{self.base_url}?ref_audio_path={MOCK_REF_AUDIO}"
+
+    def handle_error(self, request, client_address):
+        # 客户端中途断开（如停止时取消了在途请求）是正常情况，不打印堆栈
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    def start_background(self):
+        """在后台线程中运行，返回服务器自身"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟TTS服务器')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8000, help='监听端口')
+    parser.add_argument('--latency', type=float, default=0.0, help='每次合成的固定延迟（秒）')
+    parser.add_argument('--latency-per-char', type=float, default=0.0, help='每个字增加的合成延迟（秒）')
+    parser.add_argument('--capacity', type=int, default=0, help='不降速的最大并发数，0为不限')
+    parser.add_argument('--overload', type=float, default=1.0, help='超出capacity后的降速系数')
+    parser.add_argument('--slots', type=int, default=0, help='同时合成的最大请求数，其余排队，0为不限')
+    parser.add_argument('--max-queue', type=int, default=0, help='排队数超过此值时返回503，0为不限')
+    parser.add_argument('--seconds-per-char', type=float, default=0.05, help='每个字对应的音频时长（秒）')
+    parser.add_argument('--model-load-time', type=float, default=0.0, help='切换模型的耗时（秒）')
+    parser.add_argument('--rtt', type=float, default=0.0, help='每个HTTP请求额外的网络往返延迟（秒）')
+    parser.add_argument('--stall-time', type=float, default=60.0, help='stall错误停住的秒数')
+    parser.add_argument('--sample-rate', type=int, default=SAMPLE_RATE, help='音频采样率')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='注入错误的概率（0~1）')
+    parser.add_argument('--error-kinds', default=ERROR_HTTP_500,
+                        help=f'注入的错误类型，逗号分隔，可选: {",".join(ERROR_KINDS)}')
+    parser.add_argument('--seed', type=int, default=0, help='错误注入的随机种子')
+
+    args = parser.parse_args()
+    error_kinds = [kind.strip() for kind in args.error_kinds.split(",") if kind.strip()]
+    unknown = set(error_kinds) - set(ERROR_KINDS)
+    if unknown:
+        parser.error(f"未知的错误类型: {','.join(sorted(unknown))}")
+
+    server = MockTTSServer(args.host, args.port, args.latency, args.seconds_per_char, args.latency_per_char,
+                           args.capacity, args.overload, args.slots, args.max_queue, args.error_rate, error_kinds,
+                           args.seed, args.sample_rate, args.model_load_time, args.rtt, args.stall_time)
+    print(f"模拟TTS服务器已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
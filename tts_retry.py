@@ -0,0 +1,195 @@
+import asyncio
+import random
+import time
+
+# 失败原因
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+SERVER_ERROR = "server_error"
+CLIENT_ERROR = "client_error"
+BAD_RESPONSE = "bad_response"
+SYNTHESIS_FAILED = "synthesis_failed"
+DOWNLOAD_FAILED = "download_failed"
+WRITE_FAILED = "write_failed"
+# 已经开始传输音频，但连续一段时间没有收到数据
+STALLED = "stalled"
+# 熔断时间超过max_outage，没有发出请求
+BACKEND_UNAVAILABLE = "backend_unavailable"
+
+REASON_LABELS = {
+    TIMEOUT: "请求超时",
+    CONNECTION: "连接失败",
+    SERVER_ERROR: "服务器错误",
+    CLIENT_ERROR: "请求错误",
+    BAD_RESPONSE: "响应无法解析",
+    SYNTHESIS_FAILED: "合成失败",
+    DOWNLOAD_FAILED: "音频下载失败",
+    WRITE_FAILED: "写入文件失败",
+    STALLED: "传输停滞",
+    BACKEND_UNAVAILABLE: "服务器不可用",
+}
+
+# 可以重试的原因；合成失败时请求体和种子都不变，重试也是同样结果
+RETRYABLE_REASONS = {TIMEOUT, CONNECTION, SERVER_ERROR, BAD_RESPONSE, DOWNLOAD_FAILED, STALLED}
+# 说明服务器本身不可用的原因，计入熔断
+BACKEND_DOWN_REASONS = {TIMEOUT, CONNECTION, SERVER_ERROR, BACKEND_UNAVAILABLE, STALLED}
+
+
+class SynthesisError(Exception):
+    """带失败原因的合成异常"""
+
+    def __init__(self, reason, message=""):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+
+    @property
+    def retryable(self):
+        return self.reason in RETRYABLE_REASONS
+
+    @property
+    def backend_down(self):
+        return self.reason in BACKEND_DOWN_REASONS
+
+    def __str__(self):
+        label = REASON_LABELS.get(self.reason, self.reason)
+        return f"{label}: {self.message}" if self.message else label
+
+
+def status_reason(status):
+    """HTTP状态码对应的失败原因，429和5xx视为服务器繁忙或故障"""
+    if status == 429 or status >= 500:
+        return SERVER_ERROR
+    return CLIENT_ERROR
+
+
+def format_reasons(counter):
+    """把失败原因计数格式化为一行文字"""
+    return "，".join(f"{REASON_LABELS.get(reason, reason)}×{count}" for reason, count in counter.most_common())
+
+
+class RetryPolicy:
+    """指数退避重试策略（full jitter）"""
+
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=30.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error, attempt):
+        """attempt为已经尝试的次数"""
+        return error.retryable and attempt < self.max_attempts
+
+    def delay(self, attempt):
+        """第attempt次失败后的等待时间"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续failure_threshold次服务器不可用（超时、连接失败、5xx）后断开，
+    断开期间所有请求在acquire()处等待，不再打到服务器上。
+    等待recovery_timeout秒后进入半开状态，只放行一个探测请求：
+    探测成功则恢复，失败则再次断开并把等待时间翻倍（不超过max_recovery_timeout）。
+    设置max_outage后，服务器持续不可用超过这么多秒时acquire()不再等待，直接抛出BACKEND_UNAVAILABLE，
+    让无人值守的批量任务能够结束，而不是无限期地等下去。
+    只能在事件循环线程中使用。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, recovery_timeout=5.0, max_recovery_timeout=120.0, on_state_change=None,
+                 max_outage=None):
+        self.failure_threshold = failure_threshold
+        self.base_recovery_timeout = recovery_timeout
+        self.recovery_timeout = recovery_timeout
+        self.max_recovery_timeout = max_recovery_timeout
+        self.on_state_change = on_state_change
+        self.max_outage = max_outage
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # 本次不可用开始的时间（从closed断开时记录）
+        self.outage_started = 0.0
+        self.open_count = 0
+        self._probing = False
+        self._changed = None
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        previous = self.state
+        self.state = state
+        if state == self.OPEN:
+            self.opened_at = time.monotonic()
+            if previous == self.CLOSED:
+                self.outage_started = self.opened_at
+            self.open_count += 1
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+        if self.on_state_change:
+            self.on_state_change(state)
+
+    async def _wait_change(self, timeout=None):
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _outage_left(self):
+        """距离max_outage还剩的秒数，未设置时为None"""
+        if self.max_outage is None:
+            return None
+        left = self.outage_started + self.max_outage - time.monotonic()
+        if left <= 0:
+            raise SynthesisError(BACKEND_UNAVAILABLE, f"持续超过{self.max_outage:.0f}秒")
+        return left
+
+    async def acquire(self):
+        """发请求前调用，熔断期间阻塞，半开时只有一个请求能通过"""
+        while True:
+            if self.state == self.CLOSED:
+                return
+            outage_left = self._outage_left()
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.recovery_timeout - time.monotonic()
+                if remaining > 0:
+                    await self._wait_change(remaining if outage_left is None else min(remaining, outage_left))
+                    continue
+                self._set_state(self.HALF_OPEN)
+            if not self._probing:
+                self._probing = True
+                return
+            await self._wait_change(outage_left)
+
+    def record_success(self):
+        """服务器有正常响应（包括业务上的合成失败）"""
+        self.failures = 0
+        self._probing = False
+        if self.state != self.CLOSED:
+            self.recovery_timeout = self.base_recovery_timeout
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        """服务器不可用"""
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            self._probing = False
+            self.recovery_timeout = min(self.max_recovery_timeout, self.recovery_timeout * 2)
+            self._set_state(self.OPEN)
+        elif self.state == self.CLOSED and self.failures >= self.failure_threshold:
+            self._set_state(self.OPEN)
+
+    def record_neutral(self):
+        """与服务器无关的失败（如本地写文件出错），只释放探测名额"""
+        if self._probing:
+            self._probing = False
+            if self._changed is not None:
+                self._changed.set()
+                self._changed = None
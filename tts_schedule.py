@@ -0,0 +1,92 @@
+import json
+import os
+
+from tts_client import atomic_write
+
+DEFAULT_TIMINGS_PATH = os.path.join(os.path.expanduser("~"), ".renpy_ai_tts", "timings.json")
+# 每个模型保留最近这么多条耗时记录
+MAX_SAMPLES = 500
+# 样本少于这个数的模型不单独拟合，用全部模型合在一起的拟合结果
+MIN_SAMPLES = 8
+# 没有任何历史记录时的先验：固定开销 + 每字耗时（秒）
+PRIOR_BASE = 1.0
+PRIOR_PER_CHAR = 0.1
+# 预测耗时的下限，避免截距为负时得到0或负数
+MIN_COST = 0.01
+
+
+def fit_line(samples):
+    """最小二乘拟合 y = a + b*x，返回(a, b)；斜率不会小于0，x全部相同时斜率为0"""
+    n = len(samples)
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+    if not var_x:
+        return mean_y, 0.0
+    slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x)
+    return mean_y - slope * mean_x, slope
+
+
+def format_duration(seconds):
+    """把秒数写成“1小时02分”“3分20秒”“45秒”"""
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}小时{seconds % 3600 // 60:02d}分"
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60:02d}秒"
+    return f"{seconds}秒"
+
+
+class DurationModel:
+    """
+    按历史合成耗时预测一行台词的耗时
+
+    耗时 ≈ 固定开销 + 每字耗时 × 字数 / 语速，每个模型单独拟合；
+    样本不足的模型用全部模型合在一起的拟合，完全没有历史时用先验值。
+    path不为None时从该JSON文件读取历史、save()写回，在多次运行之间积累。
+    只能在一个线程中使用。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        # 模型名 → [(字数/语速, 耗时秒数)]
+        self.samples = {}
+        self._fits = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.samples = {model_name: [tuple(sample) for sample in samples][-MAX_SAMPLES:]
+                                for model_name, samples in data.items()}
+            except (OSError, ValueError, TypeError, AttributeError):
+                # 文件损坏时从头积累
+                self.samples = {}
+
+    def observe(self, model_name, speed_factor, chars, latency):
+        """记录一次成功合成的耗时"""
+        samples = self.samples.setdefault(model_name, [])
+        samples.append((chars / (speed_factor or 1.0), latency))
+        del samples[:-MAX_SAMPLES]
+        self._fits.clear()
+
+    def _fit(self, model_name):
+        if model_name not in self._fits:
+            samples = self.samples.get(model_name, [])
+            if len(samples) < MIN_SAMPLES:
+                samples = [sample for model_samples in self.samples.values() for sample in model_samples]
+            if len(samples) < MIN_SAMPLES:
+                self._fits[model_name] = (PRIOR_BASE, PRIOR_PER_CHAR)
+            else:
+                self._fits[model_name] = fit_line(samples)
+        return self._fits[model_name]
+
+    def predict(self, model_name, speed_factor, chars):
+        """预测合成chars字需要的秒数"""
+        base, per_char = self._fit(model_name)
+        return max(MIN_COST, base + per_char * chars / (speed_factor or 1.0))
+
+    def save(self):
+        if not self.path:
+            return
+        with atomic_write(self.path) as f:
+            f.write(json.dumps(self.samples, ensure_ascii=False).encode('utf-8'))
@@ -0,0 +1,109 @@
+import bisect
+import collections
+import threading
+import time
+
+from tts_concurrency import percentile
+
+# 每个阶段的滚动耗时窗口保留最近这么多个样本
+ROLLING_SAMPLES = 1000
+# 快照中给出的耗时分位数
+QUANTILES = (50, 95, 99)
+# 耗时直方图的桶上限（秒），另有一个+Inf桶；直方图从运行开始累计，不滚动
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def format_bytes(size):
+    """把字节数写成“512 B”“3.2 MB”这样"""
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} GB"
+
+
+class StatsSnapshot:
+    """
+    某一时刻的统计快照，各线程的数据已经合并，之后不再变化
+
+    snapshot["success"]读取计数（没有记录过的为0），labelled(name)返回带标签的计数{标签: 值}，
+    latency(stage)返回该阶段最近样本的{50: p50, 95: p95, 99: p99}，没有样本时返回None。
+    histograms为{(阶段, 标签): 各桶的计数（最后一个是+Inf桶）+ [耗时总和]}。
+    """
+
+    def __init__(self, counters, samples, histograms, taken):
+        self.counters = counters
+        self.samples = samples
+        self.histograms = histograms
+        self.taken = taken
+
+    def __getitem__(self, name):
+        return self.counters.get(name, 0)
+
+    def labelled(self, name):
+        return {key[1]: value for key, value in self.counters.items() if isinstance(key, tuple) and key[0] == name}
+
+    def latency(self, stage):
+        values = self.samples.get(stage)
+        if not values:
+            return None
+        return {q: percentile(values, q) for q in QUANTILES}
+
+
+class SynthesisStats:
+    """
+    合成过程的统计：计数、字节数和各阶段的滚动耗时
+
+    每个线程第一次记录时得到自己的一份计数和耗时窗口，之后只有这个线程修改它，记录时不加锁；
+    snapshot()把所有线程的数据合并成StatsSnapshot，可以在任何线程调用，
+    界面、命令行和指标导出都只读快照，不碰合成用的数据结构。
+    """
+
+    def __init__(self, window=ROLLING_SAMPLES):
+        self.window = window
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = (collections.Counter(), {}, {})
+            # 只有新线程第一次记录时才加锁
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def add(self, name, amount=1, label=None):
+        """计数name增加amount，label不为None时按标签分别计数"""
+        self._shard()[0][name if label is None else (name, label)] += amount
+
+    def observe(self, stage, seconds, label=None):
+        """记录stage阶段的一次耗时，直方图按label（如后端名）分开，滚动窗口不分"""
+        _, samples, histograms = self._shard()
+        window = samples.get(stage)
+        if window is None:
+            window = samples[stage] = collections.deque(maxlen=self.window)
+        window.append(seconds)
+        histogram = histograms.get((stage, label))
+        if histogram is None:
+            histogram = histograms[(stage, label)] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def snapshot(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        counters = collections.Counter()
+        samples = {}
+        histograms = {}
+        for shard_counters, shard_samples, shard_histograms in shards:
+            # dict()和list()在C层一次复制完，不会读到修改了一半的数据
+            counters.update(dict(shard_counters))
+            for stage, window in list(shard_samples.items()):
+                samples.setdefault(stage, []).extend(list(window))
+            for key, histogram in list(shard_histograms.items()):
+                histogram = list(histogram)
+                merged = histograms.get(key)
+                histograms[key] = histogram if merged is None else [a + b for a, b in zip(merged, histogram)]
+        return StatsSnapshot(dict(counters), samples, histograms, time.monotonic())
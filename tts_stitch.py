@@ -0,0 +1,147 @@
+import re
+import wave
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAS_NUMPY = np is not None
+
+# 优先在句末标点后断开，单句仍然太长时再在逗号等处断开
+SENTENCE_END = re.compile(r'(?<=[。！？!?；;…])')
+CLAUSE_END = re.compile(r'(?<=[，,、：:])')
+DEFAULT_CROSSFADE_MS = 10
+
+# 合并请求：每行以一个句末标点结尾，服务器按标点把它们切成各自的片段，片段之间留fragment_interval秒静音
+PACK_ENDS = "。！？!?…"
+# 除结尾外带有这些标点的台词会被服务器切成多段，切回时对不上行数，不参与合并
+PUNCTUATION = re.compile(r'[。！？!?；;…，,、：:“”"\'‘’（）()《》—～~\s]')
+# 绝对值不超过这个值的采样视为静音
+SILENCE_THRESHOLD = 64
+# 不短于fragment_interval这个比例的静音才算台词之间的分隔
+SILENCE_RATIO = 0.8
+
+
+def split_text(text, max_chars):
+    """
+    把文本按标点拆成若干段，每段不超过max_chars字
+
+    相邻的短句合并到同一段，尽量少拆；找不到标点的超长句子保持原样。
+    """
+    units = []
+    for sentence in SENTENCE_END.split(text):
+        if len(sentence) > max_chars:
+            units.extend(CLAUSE_END.split(sentence))
+        else:
+            units.append(sentence)
+    pieces = []
+    current = ""
+    for unit in units:
+        if current and len(current) + len(unit) > max_chars:
+            pieces.append(current)
+            current = unit
+        else:
+            current += unit
+    pieces.append(current)
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+
+def packable(text, max_chars):
+    """text能否和其他短台词合并成一次请求：不超过max_chars字，只有结尾可以有一个标点"""
+    body = text[:-1] if text[-1:] in PACK_ENDS else text
+    return 0 < len(text) <= max_chars and bool(body) and not PUNCTUATION.search(body)
+
+
+def pack_text(texts):
+    """把几条短台词拼成一次请求的文本，没有句末标点的补一个句号"""
+    return "".join(text if text[-1] in PACK_ENDS else text + "。" for text in texts)
+
+
+def read_pcm(path):
+    """读取16bit PCM WAV，返回((声道数, 采样率), 形状为(帧数, 声道数)的int16数组)"""
+    with wave.open(path, 'rb') as w:
+        if w.getsampwidth() != 2:
+            raise ValueError(f"只支持16bit音频: {path}")
+        channels = w.getnchannels()
+        frames = np.frombuffer(w.readframes(w.getnframes()), dtype='<i2')
+        return (channels, w.getframerate()), frames.reshape(-1, channels)
+
+
+def stitch_wavs(paths, f, crossfade_ms=DEFAULT_CROSSFADE_MS, gap=0.0):
+    """
+    按顺序拼接多段WAV写入文件对象f
+
+    段与段之间插入gap秒静音（与服务器在句子之间留的停顿一致），每个接缝重叠crossfade_ms毫秒
+    做线性交叉淡化，避免爆音；各段的声道数和采样率必须相同。
+    """
+    if np is None:
+        raise RuntimeError("拆分合成需要安装numpy")
+    params = None
+    segments = []
+    for path in paths:
+        segment_params, frames = read_pcm(path)
+        if params is None:
+            params = segment_params
+        elif segment_params != params:
+            raise ValueError("各段音频的格式不一致")
+        segments.append(frames)
+    channels, sample_rate = params
+    if gap > 0 and len(segments) > 1:
+        silence = np.zeros((int(sample_rate * gap), channels), dtype='<i2')
+        segments = [part for frames in segments for part in (frames, silence)][:-1]
+
+    fade = min([int(sample_rate * crossfade_ms / 1000)] + [len(frames) for frames in segments])
+    total = sum(len(frames) for frames in segments) - fade * (len(segments) - 1)
+    out = np.zeros((total, channels), dtype=np.float32)
+    fade_in = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, None]
+    position = 0
+    for i, frames in enumerate(segments):
+        frames = frames.astype(np.float32)
+        if i and fade:
+            position -= fade
+            overlap = out[position:position + fade]
+            overlap *= 1.0 - fade_in
+            overlap += frames[:fade] * fade_in
+            out[position + fade:position + len(frames)] = frames[fade:]
+        else:
+            out[position:position + len(frames)] = frames
+        position += len(frames)
+    write_pcm(f, params, np.clip(np.rint(out), -32768, 32767).astype('<i2'))
+
+
+def write_pcm(f, params, frames):
+    """把int16帧数组写成WAV，params同read_pcm"""
+    channels, sample_rate = params
+    with wave.open(f, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(frames.tobytes())
+
+
+def find_gaps(frames, min_frames, threshold=SILENCE_THRESHOLD):
+    """不短于min_frames帧的静音区间[(起始帧, 结束帧)]，不含开头和结尾的静音"""
+    quiet = (np.abs(frames.astype(np.int32)) <= threshold).all(axis=1)
+    edges = np.diff(np.concatenate(([0], quiet.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return [(int(start), int(end)) for start, end in zip(starts, ends)
+            if end - start >= min_frames and start > 0 and end < len(quiet)]
+
+
+def split_on_silence(path, count, gap):
+    """
+    把合并请求返回的音频在台词之间的静音处切回count段
+
+    返回(params, [每段的帧数组])，去掉了段间的静音；检测到的分隔数不是count-1时返回None，
+    说明某行内部也有停顿或服务器没有按预期切分，调用方应改为逐行合成。
+    """
+    if np is None:
+        raise RuntimeError("合并短台词需要安装numpy")
+    params, frames = read_pcm(path)
+    gaps = find_gaps(frames, max(1, int(params[1] * gap * SILENCE_RATIO)))
+    if len(gaps) != count - 1:
+        return None
+    bounds = [0] + [bound for gap_range in gaps for bound in gap_range] + [len(frames)]
+    return params, [frames[bounds[i]:bounds[i + 1]] for i in range(0, len(bounds), 2)]
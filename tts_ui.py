@@ -0,0 +1,270 @@
+import atexit
+import collections
+import logging
+import logging.handlers
+import os
+import queue
+import tkinter as tk
+from tkinter import ttk
+
+from tts_schedule import format_duration
+from tts_stats import format_bytes
+
+# 界面刷新间隔（毫秒），每帧最多重绘一次
+FRAME_INTERVAL = 50
+# 日志区域最多保留的条数，更早的只在日志文件中
+MAX_LOG_LINES = 2000
+DEFAULT_LOG_PATH = os.path.join(os.path.expanduser("~"), ".renpy_ai_tts", "logs", "synthesis.log")
+# 日志文件超过这个大小时轮转，保留LOG_BACKUPS个旧文件
+LOG_MAX_BYTES = 10 * 1024 ** 2
+LOG_BACKUPS = 5
+# 实时监控的刷新间隔（毫秒），与合成进度事件无关
+DASHBOARD_INTERVAL = 1000
+# 曲线上保留的点数，每次刷新一个点
+SPARKLINE_POINTS = 60
+# 实时监控中显示耗时分位数的阶段
+STAGES = (("infer", "推理"), ("download", "下载"), ("write", "写入"))
+
+
+class LogFile:
+    """
+    后台线程把日志写入按大小轮转的文件
+
+    write()只把记录放进队列，文件IO都在QueueListener的线程中完成；程序退出时写完队列中剩余的记录。
+    """
+
+    def __init__(self, path=DEFAULT_LOG_PATH, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                       encoding='utf-8')
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        self._queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(self._queue, handler)
+        self._listener.start()
+        atexit.register(self.close)
+
+    def write(self, message, failed=False):
+        level = logging.ERROR if failed else logging.INFO
+        self._queue.put(logging.makeLogRecord({"msg": message, "levelno": level,
+                                               "levelname": logging.getLevelName(level)}))
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener.handlers[0].close()
+            self._listener = None
+
+
+class UIEventBus:
+    """
+    工作线程向Tk界面发布日志和更新，由Tk主线程按帧批量处理
+
+    log/refresh/call只往deque里追加一项，不碰Tk、不加锁，可以在任何线程中调用，
+    合成线程不会因为界面重绘而阻塞。Tk主线程每FRAME_INTERVAL毫秒用after()取出积压的消息：
+    日志合并成一次insert和一次see()，refresh登记的回调每帧最多执行一次，
+    然后按发布顺序执行call登记的回调（放在refresh之后，最终状态不会被覆盖）。
+
+    日志区域是只保留最近max_lines条的环形缓冲，运行多久内存和重绘开销都不变；
+    log_file不为None时每条日志同时交给它写入文件。failures_only为True时只显示失败的日志，
+    失败的日志另有一个同样大小的环形缓冲，不会被大量成功日志挤掉。
+    """
+
+    def __init__(self, root, log_text, interval=FRAME_INTERVAL, max_lines=MAX_LOG_LINES, log_file=None):
+        self.root = root
+        self.log_text = log_text
+        self.interval = interval
+        self.max_lines = max_lines
+        self.log_file = log_file
+        self.failures_only = False
+        # 最近max_lines条日志和最近max_lines条失败日志，切换过滤时从这里重建日志区域
+        self.entries = collections.deque(maxlen=max_lines)
+        self.failures = collections.deque(maxlen=max_lines)
+        self._events = collections.deque()
+        self.root.after(self.interval, self._drain)
+
+    def log(self, message, failed=False):
+        """追加一条日志，failed为True表示失败"""
+        self._events.append(("log", message, failed))
+        if self.log_file:
+            self.log_file.write(message, failed)
+
+    def refresh(self, callback):
+        """请求在下一帧调用callback()，同一帧内多次请求只调用一次"""
+        self._events.append(("refresh", callback, ()))
+
+    def call(self, callback, *args):
+        """在Tk主线程中调用callback(*args)"""
+        self._events.append(("call", callback, args))
+
+    def clear(self):
+        """清空日志区域，只能在Tk主线程中调用"""
+        self.entries.clear()
+        self.failures.clear()
+        self.log_text.delete("1.0", tk.END)
+
+    def set_failures_only(self, failures_only):
+        """切换是否只显示失败的日志，只能在Tk主线程中调用"""
+        self.failures_only = failures_only
+        self.log_text.delete("1.0", tk.END)
+        self._show(list(self.failures if failures_only else self.entries))
+
+    def _show(self, messages):
+        if not messages:
+            return
+        self.log_text.insert(tk.END, "\n".join(messages[-self.max_lines:]) + "\n")
+        # 末尾的换行之后还有一个空行
+        excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - self.max_lines
+        if excess > 0:
+            self.log_text.delete("1.0", f"{excess + 1}.0")
+        self.log_text.see(tk.END)
+
+    def _drain(self):
+        lines = []
+        refreshes = {}
+        calls = []
+        # 只处理本帧开始前积压的消息，处理期间新到的留到下一帧
+        for _ in range(len(self._events)):
+            kind, value, args = self._events.popleft()
+            if kind == "log":
+                self.entries.append(value)
+                if args:
+                    self.failures.append(value)
+                if args or not self.failures_only:
+                    lines.append(value)
+            elif kind == "refresh":
+                refreshes[value] = None
+            else:
+                calls.append((value, args))
+        try:
+            self._show(lines)
+            for callback in refreshes:
+                callback()
+            for callback, args in calls:
+                callback(*args)
+        finally:
+            self.root.after(self.interval, self._drain)
+
+
+class Sparkline:
+    """Canvas上的迷你折线图，最新的值在最右边，纵轴按最近SPARKLINE_POINTS个值中的最大值缩放"""
+
+    def __init__(self, parent, width=180, height=32, color="#1f77b4"):
+        self.width = width
+        self.height = height
+        self.values = collections.deque(maxlen=SPARKLINE_POINTS)
+        self.canvas = tk.Canvas(parent, width=width, height=height, background="white", highlightthickness=0)
+        self._line = self.canvas.create_line(0, height - 1, width, height - 1, fill=color, width=1.5)
+
+    def add(self, value):
+        self.values.append(value)
+        self._draw()
+
+    def clear(self):
+        self.values.clear()
+        self._draw()
+
+    def _draw(self):
+        bottom = self.height - 1
+        if len(self.values) < 2:
+            self.canvas.coords(self._line, 0, bottom, self.width, bottom)
+            return
+        peak = max(self.values) or 1
+        step = self.width / (SPARKLINE_POINTS - 1)
+        offset = SPARKLINE_POINTS - len(self.values)
+        points = []
+        for i, value in enumerate(self.values):
+            points += [(offset + i) * step, bottom - value / peak * (self.height - 2)]
+        self.canvas.coords(self._line, *points)
+
+
+class Dashboard:
+    """
+    合成实时监控：行/秒和字节/秒曲线、推理/下载/写入各阶段耗时分位数、排队数、在途请求数和预计剩余时间
+
+    用自己的after()定时器每interval毫秒从get_engine()返回的引擎读一次统计快照，与合成线程的进度事件无关：
+    服务器卡住、没有任何行完成时曲线会如实降到0，合成再快界面也只按固定频率重绘。
+    """
+
+    def __init__(self, parent, get_engine, interval=DASHBOARD_INTERVAL):
+        self.get_engine = get_engine
+        self.interval = interval
+        self.frame = ttk.LabelFrame(parent, text="实时监控", padding=5)
+
+        self.lines_rate = Sparkline(self.frame)
+        self.lines_var = tk.StringVar()
+        ttk.Label(self.frame, text="行/秒:").grid(row=0, column=0, sticky=tk.W)
+        self.lines_rate.canvas.grid(row=0, column=1, padx=5)
+        ttk.Label(self.frame, textvariable=self.lines_var, width=10).grid(row=0, column=2, sticky=tk.W)
+
+        self.bytes_rate = Sparkline(self.frame, color="#2ca02c")
+        self.bytes_var = tk.StringVar()
+        ttk.Label(self.frame, text="下载速度:").grid(row=0, column=3, sticky=tk.W, padx=(10, 0))
+        self.bytes_rate.canvas.grid(row=0, column=4, padx=5)
+        ttk.Label(self.frame, textvariable=self.bytes_var, width=12).grid(row=0, column=5, sticky=tk.W)
+
+        stages_frame = ttk.Frame(self.frame)
+        stages_frame.grid(row=1, column=0, columnspan=6, sticky=tk.W, pady=(5, 0))
+        self.stage_vars = {}
+        for stage, label in STAGES:
+            ttk.Label(stages_frame, text=f"{label}:").pack(side=tk.LEFT)
+            self.stage_vars[stage] = tk.StringVar()
+            ttk.Label(stages_frame, textvariable=self.stage_vars[stage]).pack(side=tk.LEFT, padx=(0, 15))
+
+        queue_frame = ttk.Frame(self.frame)
+        queue_frame.grid(row=2, column=0, columnspan=6, sticky=tk.W, pady=(5, 0))
+        self.queue_var = tk.StringVar()
+        self.in_flight_var = tk.StringVar()
+        self.eta_var = tk.StringVar()
+        for label, var in (("排队:", self.queue_var), ("在途:", self.in_flight_var), ("预计剩余:", self.eta_var)):
+            ttk.Label(queue_frame, text=label).pack(side=tk.LEFT)
+            ttk.Label(queue_frame, textvariable=var).pack(side=tk.LEFT, padx=(0, 15))
+
+        self.reset()
+        self.frame.after(self.interval, self._tick)
+
+    def reset(self):
+        """开始新的一次运行时清空曲线和数值"""
+        # 上一次刷新时的(快照时刻, 已完成行数, 已下载字节数)
+        self._last = None
+        self.lines_rate.clear()
+        self.bytes_rate.clear()
+        self.lines_var.set("0.0")
+        self.bytes_var.set(f"{format_bytes(0)}/秒")
+        for var in self.stage_vars.values():
+            var.set("-")
+        self.queue_var.set("0")
+        self.in_flight_var.set("0")
+        self.eta_var.set("-")
+
+    def _tick(self):
+        try:
+            engine = self.get_engine()
+            if engine is not None and engine.running:
+                self._update(engine)
+        finally:
+            self.frame.after(self.interval, self._tick)
+
+    def _update(self, engine):
+        stats = engine.stats.snapshot()
+        # 跳过的行不请求服务器，不计入速度
+        lines = stats["success"] + stats["failed"]
+        if self._last is not None:
+            taken, last_lines, last_bytes = self._last
+            elapsed = stats.taken - taken
+            if elapsed > 0:
+                lines_rate = (lines - last_lines) / elapsed
+                bytes_rate = (stats["bytes"] - last_bytes) / elapsed
+                self.lines_rate.add(lines_rate)
+                self.bytes_rate.add(bytes_rate)
+                self.lines_var.set(f"{lines_rate:.1f}")
+                self.bytes_var.set(f"{format_bytes(bytes_rate)}/秒")
+        self._last = (stats.taken, lines, stats["bytes"])
+        for stage, var in self.stage_vars.items():
+            latency = stats.latency(stage)
+            if latency:
+                var.set(f"p50 {latency[50]:.2f}s / p95 {latency[95]:.2f}s / p99 {latency[99]:.2f}s")
+        self.queue_var.set(str(engine.queue_depth))
+        self.in_flight_var.set(str(engine.in_flight))
+        eta = engine.eta()
+        self.eta_var.set(format_duration(eta) if eta is not None else "-")
@@ -0,0 +1,77 @@
+import os
+import re
+
+VOICE_MAP_HEADER = ("# 角色模型映射：每行“角色 = 模型名”，角色可以写中文名或角色代码\n"
+                    "# 没有列出或模型名留空的角色使用界面上选择的模型\n\n")
+LINE_PATTERN = re.compile(r'^([^=#]+?)\s*=\s*(.*)$')
+
+
+def speaker_of(line):
+    """“角色:台词”中的角色名，没有角色前缀时为空字符串"""
+    match = re.match(r'^([^:]+):', line.strip())
+    return match.group(1).strip() if match else ""
+
+
+def speakers_in(lines):
+    """按首次出现的顺序列出所有角色"""
+    speakers = {}
+    for line in lines:
+        speaker = speaker_of(line)
+        if speaker:
+            speakers.setdefault(speaker, None)
+    return list(speakers)
+
+
+def _read_pairs(path):
+    pairs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            match = LINE_PATTERN.match(line)
+            if match:
+                pairs.append((match.group(1).strip(), match.group(2).strip()))
+    return pairs
+
+
+def load_character_names(path):
+    """读取第一步生成的角色定义文件（角色代码 = 中文名），得到translation_dict"""
+    return dict(_read_pairs(path))
+
+
+def load_voice_map(path, translation_dict=None):
+    """
+    读取角色模型映射文件，返回{角色名: 模型名}
+
+    角色写成角色代码时按translation_dict换成对话文件里的中文名，两种写法都保留，
+    所以不论对话文件里是代码还是中文名都能匹配上。
+    """
+    translation_dict = translation_dict or {}
+    voice_map = {}
+    for speaker, model_name in _read_pairs(path):
+        if not model_name:
+            continue
+        voice_map[speaker] = model_name
+        if speaker in translation_dict:
+            voice_map.setdefault(translation_dict[speaker], model_name)
+    return voice_map
+
+
+def write_voice_map_template(path, speakers, default_model=""):
+    """
+    生成映射模板，每个角色一行
+
+    文件已存在时保留已经填好的模型，只追加新出现的角色。
+    """
+    existing = _read_pairs(path) if os.path.exists(path) else []
+    known = {speaker for speaker, _ in existing}
+    entries = existing + [(speaker, default_model) for speaker in speakers if speaker not in known]
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(VOICE_MAP_HEADER)
+        for speaker, model_name in entries:
+            f.write(f"{speaker} = {model_name}\n")
+    return len(entries) - len(existing)